@@ -0,0 +1,203 @@
+"""Séries temporelles de participation.
+
+Chaque idée, vote, commentaire et vote de commentaire incrémente le compteur
+de sa tranche journalière (``ActivityBucket``, granularité ``day``) et, s'il
+est récent, de sa tranche horaire (granularité ``hour``, conservée
+``ACTIVITY_HOURLY_RETENTION_DAYS`` jours). Les séries sont lues uniquement
+depuis ces tranches, jamais depuis les tables de votes.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import ActivityBucket, Comment, CommentVote, Idea, Vote
+from .stats import upsert_counters
+
+COUNTER_FIELDS = ['ideas', 'votes', 'comments', 'comment_votes']
+
+DAY = ActivityBucket.GRANULARITY.DAY
+HOUR = ActivityBucket.GRANULARITY.HOUR
+
+
+def hourly_retention():
+    return timedelta(days=getattr(settings, 'ACTIVITY_HOURLY_RETENTION_DAYS', 2))
+
+
+def hourly_cutoff(now=None):
+    """Début de la première tranche horaire conservée"""
+    return truncate(HOUR, (now or timezone.now()) - hourly_retention())
+
+
+def truncate(granularity, moment):
+    """Début de la tranche contenant ``moment`` (dans le fuseau du projet)"""
+    local = timezone.localtime(moment)
+    if granularity == DAY:
+        return local.replace(hour=0, minute=0, second=0, microsecond=0)
+    return local.replace(minute=0, second=0, microsecond=0)
+
+
+def apply_delta(granularity, bucket_start, zone_id, category, **deltas):
+    lookup = {
+        'granularity': granularity,
+        'bucket_start': bucket_start,
+        'zone_id': zone_id,
+        'category': category,
+    }
+    # Un retrait ne crée jamais de tranche (ex. tranche horaire déjà purgée)
+    create = all(value >= 0 for value in deltas.values())
+    upsert_counters(ActivityBucket, lookup, deltas, create=create)
+
+
+def record(zone_id, category, moment, **deltas):
+    """Reporte un événement (ou son retrait) dans ses tranches jour et heure"""
+    apply_delta(DAY, truncate(DAY, moment), zone_id, category, **deltas)
+    if moment >= hourly_cutoff():
+        apply_delta(HOUR, truncate(HOUR, moment), zone_id, category, **deltas)
+
+
+def idea_contribution(idea_id, created_at):
+    """Contribution d'une idée et de ses enfants : {(granularité, début): compteurs}"""
+    contribution = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    contribution[(DAY, truncate(DAY, created_at))]['ideas'] += 1
+    cutoff = hourly_cutoff()
+    if created_at >= cutoff:
+        contribution[(HOUR, truncate(HOUR, created_at))]['ideas'] += 1
+
+    sources = [
+        ('votes', Vote.objects.filter(idea_id=idea_id)),
+        ('comments', Comment.objects.filter(idea_id=idea_id)),
+        ('comment_votes', CommentVote.objects.filter(comment__idea_id=idea_id)),
+    ]
+    for field, queryset in sources:
+        for granularity, trunc, subset in (
+            (DAY, TruncDay, queryset),
+            (HOUR, TruncHour, queryset.filter(created_at__gte=cutoff)),
+        ):
+            rows = (
+                subset.annotate(bucket=trunc('created_at'))
+                .values('bucket').annotate(n=Count('id')).order_by()
+            )
+            for row in rows:
+                contribution[(granularity, row['bucket'])][field] += row['n']
+    return contribution
+
+
+def apply_contribution(contribution, zone_id, category, sign=1):
+    for (granularity, bucket_start), counters in contribution.items():
+        apply_delta(
+            granularity, bucket_start, zone_id, category,
+            **{field: sign * value for field, value in counters.items()}
+        )
+
+
+# Source -> champs (zone, catégorie, idée) de ses lignes
+SOURCE_LOOKUPS = {
+    'ideas': ('zone_id', 'category', 'pk'),
+    'votes': ('idea__zone_id', 'idea__category', 'idea_id'),
+    'comments': ('idea__zone_id', 'idea__category', 'idea_id'),
+    'comment_votes': ('comment__idea__zone_id', 'comment__idea__category', 'comment__idea_id'),
+}
+
+
+def count_rows(field, queryset, rows=None):
+    """Compte les lignes d'une source par tranche, zone et catégorie (ajoutées à ``rows``)"""
+    if rows is None:
+        rows = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    zone_field, category_field, _ = SOURCE_LOOKUPS[field]
+    cutoff = hourly_cutoff()
+    for granularity, trunc, subset in (
+        (DAY, TruncDay, queryset),
+        (HOUR, TruncHour, queryset.filter(created_at__gte=cutoff)),
+    ):
+        grouped = (
+            subset.annotate(bucket=trunc('created_at'))
+            .values('bucket', zone_field, category_field)
+            .annotate(n=Count('id'))
+            .order_by()
+        )
+        for row in grouped:
+            rows[(granularity, row['bucket'], row[zone_field], row[category_field])][field] += row['n']
+    return rows
+
+
+def compute_rows(since=None, idea_ids=None):
+    """Recalcule les tranches depuis les tables sources (éventuellement pour quelques idées)"""
+    rows = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    sources = [
+        ('ideas', Idea.objects.all()),
+        ('votes', Vote.objects.all()),
+        ('comments', Comment.objects.all()),
+        ('comment_votes', CommentVote.objects.all()),
+    ]
+    for field, queryset in sources:
+        if since is not None:
+            queryset = queryset.filter(created_at__gte=since)
+        if idea_ids is not None:
+            queryset = queryset.filter(**{f'{SOURCE_LOOKUPS[field][2]}__in': idea_ids})
+        count_rows(field, queryset, rows)
+    return rows
+
+
+def apply_rows(rows, sign=1, zone_id=None):
+    """Reporte des lignes de ``compute_rows`` (vers une autre zone si ``zone_id``)"""
+    for (granularity, bucket_start, row_zone_id, category), counters in rows.items():
+        apply_delta(
+            granularity, bucket_start, row_zone_id if zone_id is None else zone_id, category,
+            **{field: sign * value for field, value in counters.items()}
+        )
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """Reconstruit les tranches (toutes, ou à partir du jour de ``since``)"""
+    existing = ActivityBucket.objects.all()
+    if since is not None:
+        since = truncate(DAY, since)
+        existing = existing.filter(bucket_start__gte=since)
+    existing.delete()
+    rows = compute_rows(since)
+    ActivityBucket.objects.bulk_create(
+        [
+            ActivityBucket(
+                granularity=granularity, bucket_start=bucket_start,
+                zone_id=zone_id, category=category, **counters
+            )
+            for (granularity, bucket_start, zone_id, category), counters in rows.items()
+        ],
+        batch_size=500,
+    )
+    return len(rows)
+
+
+def prune_hourly(now=None):
+    """Supprime les tranches horaires sorties de la fenêtre de rétention"""
+    deleted, _ = ActivityBucket.objects.filter(granularity=HOUR, bucket_start__lt=hourly_cutoff(now)).delete()
+    return deleted
+
+
+def timeseries(interval, start, end, zone_id=None, category=None):
+    """Série agrégée [{bucket, ideas, votes, ...}] entre ``start`` et ``end`` exclus"""
+    granularity = HOUR if interval == 'hour' else DAY
+    queryset = ActivityBucket.objects.filter(
+        granularity=granularity, bucket_start__gte=start, bucket_start__lt=end
+    )
+    if zone_id is not None:
+        queryset = queryset.filter(zone_id=zone_id)
+    if category is not None:
+        queryset = queryset.filter(category=category)
+
+    series = {}
+    rows = queryset.values_list('bucket_start', *COUNTER_FIELDS)
+    for bucket_start, *counters in rows:
+        if interval == 'week':
+            bucket_start = timezone.localtime(bucket_start)
+            bucket_start -= timedelta(days=bucket_start.weekday())
+        point = series.setdefault(bucket_start, dict.fromkeys(COUNTER_FIELDS, 0))
+        for field, value in zip(COUNTER_FIELDS, counters):
+            point[field] += value
+    return [{'bucket': bucket, **series[bucket]} for bucket in sorted(series)]
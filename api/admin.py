@@ -1,12 +1,40 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Zone, Idea, Vote, Comment, CommentVote
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from . import deletion, jobs, moderation
+from .models import User, Zone, Idea, Vote, Comment, CommentVote, RevokedToken, ZoneStat, ModerationJob, Job
+from .pagination import CachedCountPaginator
+
+
+class LargeTableAdminMixin:
+    """Listes d'administration à coût borné : nombre total mis en cache, pas de second COUNT"""
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+
+class SoftDeleteAdminMixin:
+    """Suppression masquant l'objet et purgeant ses données en tâche de fond (api/deletion.py)"""
+
+    def get_deleted_objects(self, objs, request):
+        # Ni collecte ni liste de la cascade : seuls les objets choisis sont affichés
+        return [str(obj) for obj in objs], {}, set(), []
+
+    def delete_model(self, request, obj):
+        deletion.soft_delete(obj, user=request.user)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset.filter(deleted_at__isnull=True):
+            deletion.soft_delete(obj, user=request.user)
 
 
 @admin.register(User)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(SoftDeleteAdminMixin, LargeTableAdminMixin, UserAdmin):
     """Administration des utilisateurs"""
-    list_display = ['email', 'username', 'is_anonymous', 'is_active', 'date_joined']
+    list_display = ['email', 'username', 'is_anonymous', 'is_active', 'date_joined', 'deleted_at']
     list_filter = ['is_anonymous', 'is_active', 'is_staff', 'date_joined']
     search_fields = ['email', 'username']
     ordering = ['-date_joined']
@@ -20,26 +48,65 @@ class CustomUserAdmin(UserAdmin):
 
 
 @admin.register(Zone)
-class ZoneAdmin(admin.ModelAdmin):
+class ZoneAdmin(SoftDeleteAdminMixin, LargeTableAdminMixin, admin.ModelAdmin):
     """Administration des zones géographiques"""
-    list_display = ['name', 'zone_type', 'latitude', 'longitude', 'idea_count', 'created_at']
+    list_display = ['name', 'zone_type', 'latitude', 'longitude', 'idea_count', 'created_at', 'deleted_at']
     list_filter = ['zone_type', 'created_at']
     search_fields = ['name', 'description']
     ordering = ['name']
-    
+    readonly_fields = ['deleted_at']
+
+    def get_queryset(self, request):
+        # Nombre d'idées lu dans les statistiques matérialisées (ZoneStat)
+        idea_count = (
+            ZoneStat.objects.filter(zone=OuterRef('pk')).order_by()
+            .values('zone').annotate(n=Sum('idea_count')).values('n')
+        )
+        return super().get_queryset(request).annotate(_idea_count=Coalesce(Subquery(idea_count), 0))
+
+    def get_search_results(self, request, queryset, search_term):
+        queryset, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if 'field_name' in request.GET:
+            # Autocomplétion d'une zone cible : zones en cours de suppression exclues
+            queryset = queryset.filter(deleted_at__isnull=True)
+        return queryset, may_have_duplicates
+
     def idea_count(self, obj):
-        return obj.ideas.count()
+        return obj._idea_count
     idea_count.short_description = 'Nombre d\'idées'
+    idea_count.admin_order_field = '_idea_count'
+
+
+class IdeaActionForm(ActionForm):
+    """Formulaire d'action des idées : zone cible des déplacements groupés"""
+    # Autocomplétion plutôt qu'une liste de toutes les zones à chaque page
+    zone = forms.ModelChoiceField(
+        queryset=Zone.objects.filter(deleted_at__isnull=True), required=False, label='Zone',
+        widget=AutocompleteSelect(Idea._meta.get_field('zone'), admin.site),
+    )
+
+
+def status_action(status):
+    """Action d'administration appliquant un statut par lots"""
+    def apply_status(modeladmin, request, queryset):
+        modeladmin.run_moderation(request, queryset, ModerationJob.ACTIONS.STATUS, status=status)
+    apply_status.__name__ = f'set_status_{status}'
+    return admin.action(description=f'Passer au statut « {Idea.STATUS(status).label} »')(apply_status)
 
 
 @admin.register(Idea)
-class IdeaAdmin(admin.ModelAdmin):
+class IdeaAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Administration des idées"""
+    action_form = IdeaActionForm
+    actions = [status_action(status) for status in Idea.STATUS.values] + ['move_to_zone', 'bulk_delete']
     list_display = ['title', 'category', 'status', 'author', 'zone', 'vote_count', 'comment_count', 'created_at']
     list_filter = ['category', 'status', 'created_at', 'zone']
+    list_select_related = ['author', 'zone']
     search_fields = ['title', 'description', 'author__email', 'zone__name']
     ordering = ['-created_at']
-    readonly_fields = ['vote_count', 'positive_votes', 'negative_votes', 'created_at', 'updated_at']
+    raw_id_fields = ['author']
+    autocomplete_fields = ['zone']
+    readonly_fields = ['vote_count', 'positive_votes', 'negative_votes', 'comment_count', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Informations générales', {
@@ -52,7 +119,7 @@ class IdeaAdmin(admin.ModelAdmin):
             'fields': ('author',)
         }),
         ('Statistiques', {
-            'fields': ('vote_count', 'positive_votes', 'negative_votes'),
+            'fields': ('vote_count', 'positive_votes', 'negative_votes', 'comment_count'),
             'classes': ('collapse',)
         }),
         ('Métadonnées', {
@@ -60,44 +127,145 @@ class IdeaAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
-    
-    def comment_count(self, obj):
-        return obj.comments.count()
-    comment_count.short_description = 'Nombre de commentaires'
+
+    def get_actions(self, request):
+        # La suppression standard charge et confirme chaque objet lié
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def run_moderation(self, request, queryset, action, **params):
+        ids = list(queryset.values_list('pk', flat=True))
+        job = moderation.start(action, {'ids': ids, **params}, user=request.user)
+        self.message_user(
+            request, f'{len(ids)} idée(s) sélectionnée(s) : opération n° {job.pk} mise en file (tâches de fond)'
+        )
+
+    @admin.action(description='Déplacer vers la zone choisie')
+    def move_to_zone(self, request, queryset):
+        try:
+            zone = IdeaActionForm().fields['zone'].clean(request.POST.get('zone'))
+        except forms.ValidationError:
+            zone = None
+        if zone is None:
+            self.message_user(request, 'Choisissez une zone cible', messages.WARNING)
+            return
+        self.run_moderation(request, queryset, ModerationJob.ACTIONS.ZONE, zone=zone.pk)
+
+    @admin.action(description='Supprimer par lots', permissions=['delete'])
+    def bulk_delete(self, request, queryset):
+        self.run_moderation(request, queryset, ModerationJob.ACTIONS.DELETE)
 
 
 @admin.register(Vote)
-class VoteAdmin(admin.ModelAdmin):
+class VoteAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Administration des votes"""
     list_display = ['idea', 'user', 'is_positive', 'created_at']
     list_filter = ['is_positive', 'created_at']
+    list_select_related = ['idea', 'user']
     search_fields = ['idea__title', 'user__email']
     ordering = ['-created_at']
+    raw_id_fields = ['idea', 'user']
     readonly_fields = ['created_at']
 
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Administration des commentaires"""
     list_display = ['idea', 'user', 'content_preview', 'vote_count', 'created_at']
     list_filter = ['created_at', 'updated_at']
+    list_select_related = ['idea', 'user']
     search_fields = ['content', 'idea__title', 'user__email']
     ordering = ['-created_at']
+    raw_id_fields = ['idea', 'user']
     readonly_fields = ['created_at', 'updated_at']
+
+    def get_queryset(self, request):
+        # Sous-requête corrélée : seules les lignes de la page sont comptées
+        vote_count = (
+            CommentVote.objects.filter(comment=OuterRef('pk')).order_by()
+            .values('comment').annotate(n=Count('id')).values('n')
+        )
+        return super().get_queryset(request).annotate(_vote_count=Coalesce(Subquery(vote_count), 0))
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Contenu'
     
     def vote_count(self, obj):
-        return obj.votes.count()
+        return obj._vote_count
     vote_count.short_description = 'Nombre de votes'
+    vote_count.admin_order_field = '_vote_count'
 
 
 @admin.register(CommentVote)
-class CommentVoteAdmin(admin.ModelAdmin):
+class CommentVoteAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """Administration des votes de commentaires"""
-    list_display = ['comment', 'user', 'is_positive']
+    list_display = ['comment', 'user', 'is_positive', 'created_at']
     list_filter = ['is_positive']
+    list_select_related = ['comment__idea', 'comment__user', 'user']
     search_fields = ['comment__content', 'user__email']
-    ordering = ['-comment__created_at']
+    ordering = ['-created_at']
+    raw_id_fields = ['comment', 'user']
+    readonly_fields = ['created_at']
+
+
+@admin.register(RevokedToken)
+class RevokedTokenAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    """Administration des jetons révoqués"""
+    list_display = ['jti', 'user', 'token_type', 'expires_at', 'created_at']
+    list_filter = ['token_type', 'created_at']
+    search_fields = ['jti', 'user__email']
+    ordering = ['-created_at']
+    raw_id_fields = ['user']
+    readonly_fields = ['created_at']
+
+
+@admin.register(ModerationJob)
+class ModerationJobAdmin(admin.ModelAdmin):
+    """Suivi des opérations de modération groupée"""
+    list_display = ['action', 'state', 'processed', 'total', 'affected', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['action', 'state']
+    list_select_related = ['created_by']
+    ordering = ['-created_at']
+    readonly_fields = ['action', 'params', 'state', 'total', 'processed', 'affected', 'error',
+                       'created_by', 'created_at', 'finished_at']
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    """Suivi de la file de tâches de fond : profondeur et latences au-dessus de la liste"""
+    actions = ['retry']
+    list_display = ['task', 'state', 'attempts', 'run_at', 'started_at', 'finished_at', 'wait', 'duration', 'worker']
+    list_filter = ['state', 'task']
+    search_fields = ['task', 'dedup_key']
+    ordering = ['-created_at']
+    readonly_fields = ['task', 'params', 'state', 'dedup_key', 'attempts', 'max_attempts', 'run_at', 'worker',
+                       'result', 'error', 'created_at', 'started_at', 'heartbeat_at', 'finished_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), 'queue_stats': jobs.queue_stats()}
+        return super().changelist_view(request, extra_context)
+
+    def wait(self, obj):
+        if obj.started_at is None:
+            return None
+        return f'{(obj.started_at - obj.run_at).total_seconds():.1f} s'
+    wait.short_description = 'Attente'
+
+    def duration(self, obj):
+        if obj.started_at is None or obj.finished_at is None or obj.finished_at < obj.started_at:
+            return None
+        return f'{(obj.finished_at - obj.started_at).total_seconds():.1f} s'
+    duration.short_description = 'Durée'
+
+    @admin.action(description='Relancer les tâches échouées')
+    def retry(self, request, queryset):
+        retried = jobs.retry_failed(queryset)
+        self.message_user(request, f'{retried} tâche(s) remise(s) en file')
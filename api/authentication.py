@@ -0,0 +1,16 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .revocation import revoked_tokens
+
+
+class RevocableJWTAuthentication(JWTAuthentication):
+    """Authentification JWT refusant les jetons révoqués"""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        jti = validated_token.get(jwt_settings.JTI_CLAIM)
+        if jti and revoked_tokens.is_revoked(jti):
+            raise InvalidToken({'detail': 'Ce jeton a été révoqué', 'code': 'token_revoked'})
+        return validated_token
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+from .hashing import password_hashing
+
+UserModel = get_user_model()
+
+
+class BoundedHashingBackend(ModelBackend):
+    """Backend d'authentification déléguant le hachage au pool borné"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Hachage factice pour limiter l'écart de temps avec un compte existant
+            password_hashing.make_password(password)
+            return None
+
+        is_correct, must_update = password_hashing.verify_password(password, user.password)
+        if not is_correct:
+            return None
+        if must_update:
+            user.password = password_hashing.make_password(password)
+            user.save(update_fields=['password'])
+        if self.user_can_authenticate(user):
+            return user
+        return None
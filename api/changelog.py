@@ -0,0 +1,125 @@
+"""Journal des modifications pour la synchronisation incrémentale.
+
+``ChangeLog`` contient une seule ligne par objet synchronisé (zone, idée,
+commentaire, vote) : à chaque écriture, la ligne de l'objet est remplacée
+par une nouvelle, dont l'identifiant (auto-incrémenté, jamais réutilisé)
+sert de position dans le journal. Une suppression laisse une ligne
+``deleted`` (tombstone), conservée ``TOMBSTONE_RETENTION_DAYS`` jours.
+
+Les commentaires et votes d'une idée supprimée n'ont pas de tombstone
+propre : la suppression de l'idée implique celle de ses enfants.
+
+Un jeton de synchronisation ``<position>-<horodatage>`` n'est plus accepté
+une fois les tombstones de sa période purgés : le client doit alors tout
+resynchroniser. Les écritures SQLite étant sérialisées, les positions sont
+attribuées dans l'ordre de validation des transactions.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChangeLog
+
+ZONE = ChangeLog.KINDS.ZONE
+IDEA = ChangeLog.KINDS.IDEA
+COMMENT = ChangeLog.KINDS.COMMENT
+VOTE = ChangeLog.KINDS.VOTE
+
+DEFAULTS = {
+    'TOMBSTONE_RETENTION_DAYS': 30,
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+}
+
+
+class InvalidToken(ValueError):
+    """Jeton de synchronisation illisible"""
+
+
+class ExpiredToken(ValueError):
+    """Jeton antérieur aux tombstones conservés"""
+
+
+def sync_setting(name):
+    return getattr(settings, 'SYNC', {}).get(name, DEFAULTS[name])
+
+
+def tombstone_retention():
+    return timedelta(days=sync_setting('TOMBSTONE_RETENTION_DAYS'))
+
+
+def record(kind, object_id, deleted=False, idea_id=None, user_id=None):
+    """Enregistre la dernière modification d'un objet"""
+    record_many(kind, [object_id], deleted, {object_id: idea_id}, {object_id: user_id})
+
+
+def record_many(kind, object_ids, deleted=False, idea_ids=None, user_ids=None):
+    """Enregistre la modification de plusieurs objets d'un même type"""
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+    idea_ids = idea_ids or {}
+    user_ids = user_ids or {}
+    entries = [
+        ChangeLog(
+            kind=kind, object_id=object_id, deleted=deleted,
+            idea_id=idea_ids.get(object_id), user_id=user_ids.get(object_id),
+        )
+        for object_id in object_ids
+    ]
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                ChangeLog.objects.filter(kind=kind, object_id__in=object_ids).delete()
+                ChangeLog.objects.bulk_create(entries, batch_size=500)
+            return
+        except IntegrityError:
+            # Ligne recréée entre-temps par une autre requête
+            if attempt:
+                raise
+
+
+def forget_children(idea_ids):
+    """Oublie les commentaires et votes d'idées supprimées (couverts par leur tombstone)"""
+    ChangeLog.objects.filter(kind__in=[COMMENT, VOTE], idea_id__in=list(idea_ids)).delete()
+
+
+def make_token(position, moment=None):
+    return f'{position}-{int((moment or timezone.now()).timestamp())}'
+
+
+def parse_token(token, now=None):
+    """Position d'un jeton ; lève InvalidToken ou ExpiredToken"""
+    try:
+        position, issued = (int(part) for part in token.split('-'))
+    except (AttributeError, ValueError):
+        raise InvalidToken(token)
+    if position < 0:
+        raise InvalidToken(token)
+    now = now or timezone.now()
+    if issued < (now - tombstone_retention()).timestamp():
+        raise ExpiredToken(token)
+    return position
+
+
+def changes(position, user_id=None, limit=None):
+    """Entrées postérieures à ``position`` visibles par l'utilisateur (votes : les siens)"""
+    limit = limit or sync_setting('PAGE_SIZE')
+    visible = ~Q(kind=VOTE)
+    if user_id is not None:
+        visible |= Q(user_id=user_id)
+    return list(
+        ChangeLog.objects.filter(visible, id__gt=position)
+        .order_by('id')
+        .values('id', 'kind', 'object_id', 'deleted')[:limit]
+    )
+
+
+def prune(now=None):
+    """Supprime les tombstones sortis de la fenêtre de rétention"""
+    cutoff = (now or timezone.now()) - tombstone_retention()
+    deleted, _ = ChangeLog.objects.filter(deleted=True, changed_at__lt=cutoff).delete()
+    return deleted
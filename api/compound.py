@@ -0,0 +1,79 @@
+"""Réponses de liste au format document composé (``?include=zones,users``).
+
+Dans une page d'idées, la même zone et les mêmes auteurs sont répétés d'une
+idée à l'autre. Avec ``include``, les idées ne portent plus que des
+références (``zone_id``, ``author_id``, ``user_id`` des commentaires) et
+chaque objet référencé est renvoyé une seule fois dans la section
+``included`` de la réponse :
+
+    {"count": ..., "next": ..., "previous": ..., "results": [...],
+     "included": {"zones": [...], "users": [...]}}
+
+Les identifiants référencés sont relevés dans les représentations déjà
+assemblées (fragments en cache compris) : une requête par type d'objet
+inclus, quelle que soit la taille de la page.
+"""
+from rest_framework.exceptions import ValidationError
+
+from .models import User, Zone
+from .serializers import UserSummarySerializer, ZoneSerializer
+
+INCLUDE_PARAM = 'include'
+
+
+def referenced_users(ideas):
+    """Identifiants des auteurs des idées et de leurs commentaires"""
+    ids = set()
+    for idea in ideas:
+        ids.add(idea['author_id'])
+        ids.update(comment['user_id'] for comment in idea['comments'])
+    return ids
+
+
+def included_zones(ideas):
+    ids = {idea['zone_id'] for idea in ideas if idea['zone_id'] is not None}
+    return ZoneSerializer(Zone.objects.filter(pk__in=ids).order_by('pk'), many=True).data
+
+
+def included_users(ideas):
+    users = (
+        User.objects.filter(pk__in=referenced_users(ideas))
+        .only('id', 'username', 'first_name', 'last_name').order_by('pk')
+    )
+    return UserSummarySerializer(users, many=True).data
+
+
+class CompoundDocumentMixin:
+    """Ajoute la section ``included`` aux listes paginées et aux récupérations groupées"""
+    # Nom de la collection -> fonction (représentations de la page) -> objets inclus
+    includable = {}
+
+    def requested_includes(self):
+        """Collections demandées par ``?include=`` (liste vide sans le paramètre)"""
+        raw = self.request.query_params.get(INCLUDE_PARAM, '')
+        names = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+        unknown = [name for name in names if name not in self.includable]
+        if unknown:
+            raise ValidationError({INCLUDE_PARAM: f"Valeurs possibles : {', '.join(self.includable)}"})
+        return names
+
+    def is_compound(self):
+        """Réponse au format document composé (références et section ``included``)"""
+        return self.action in ('list', 'batch') and bool(self.requested_includes())
+
+    def add_included(self, payload):
+        if self.is_compound():
+            results = payload['results']
+            payload['included'] = {name: self.includable[name](results) for name in self.requested_includes()}
+        return payload
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        self.add_included(response.data)
+        return response
+
+    def batch_response(self, raw_ids):
+        response = super().batch_response(raw_ids)
+        if response.status_code == 200:
+            self.add_included(response.data)
+        return response
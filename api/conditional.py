@@ -0,0 +1,70 @@
+"""Requêtes GET conditionnelles (``If-None-Match`` / ``If-Modified-Since``).
+
+Les validateurs d'une réponse (``ETag``, ``Last-Modified``) sont calculés
+avant la requête principale et la sérialisation, à partir d'agrégats peu
+coûteux sur les tables dont dépend la représentation : ``Max('updated_at')``
+(indexé pour les idées et les commentaires) et, pour les petites tables, le
+nombre de lignes. Si rien n'a changé, la vue répond ``304 Not Modified``
+sans lire les lignes.
+
+Toute écriture qui change la représentation d'un objet avance son
+``updated_at`` (voir ``api/signals.py``). Une suppression avance celui du
+parent (idée d'un commentaire) ou des agrégats ``ZoneStat`` (idées) ; celle
+d'une zone change le nombre de zones.
+
+L'``ETag`` porte aussi l'URL complète et l'utilisateur connecté (``my_vote``) :
+les réponses varient selon ``Authorization`` et ``Cookie``.
+"""
+import functools
+import hashlib
+from datetime import datetime
+
+from django.db.models import Max
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def latest(queryset):
+    """Dernière date de modification des lignes d'un queryset (None s'il est vide)"""
+    return queryset.order_by().aggregate(latest=Max('updated_at'))['latest']
+
+
+def compute(request, parts):
+    """``ETag`` et date de dernière modification (timestamp) d'une réponse"""
+    moments = [part for part in parts if isinstance(part, datetime)]
+    last_modified = int(max(moments).timestamp()) if moments else None
+    user = request.user.pk if request.user.is_authenticated else None
+    scope = repr((request.get_full_path(), user, parts))
+    return quote_etag(hashlib.sha256(scope.encode()).hexdigest()[:32]), last_modified
+
+
+def conditional(validators):
+    """Rend une action GET conditionnelle.
+
+    ``validators`` est le nom de la méthode de la vue qui, appelée avec les
+    arguments de l'action, renvoie les valeurs (dates, nombres) dont dépend
+    la réponse.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in SAFE_METHODS:
+                return handler(self, request, *args, **kwargs)
+            etag, last_modified = compute(request, getattr(self, validators)(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = handler(self, request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+            return response
+
+        return wrapper
+
+    return decorator
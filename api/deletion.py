@@ -0,0 +1,75 @@
+"""Suppression non bloquante des utilisateurs et des zones.
+
+Supprimer un utilisateur ou une zone en cascade emporte ses idées, votes,
+commentaires et votes de commentaires dans une seule transaction, qui
+verrouille la base le temps de tout supprimer ; les votes supprimés par la
+cascade laissent en outre périmés les compteurs des idées des autres
+utilisateurs. La suppression se fait donc en deux temps :
+
+- ``soft_delete`` marque le sujet (``deleted_at``, compte désactivé pour un
+  utilisateur) : l'API le masque aussitôt, avec les idées qui lui
+  appartiennent ;
+- la tâche de fond ``purge_subject`` (``run_worker``) supprime ensuite ses
+  données par lots, en recalculant les compteurs touchés, puis le sujet
+  lui-même (voir ``api/moderation.py``). Sa progression est suivie dans
+  l'opération ``ModerationJob`` renvoyée par ``soft_delete``.
+
+Les votes et commentaires d'un utilisateur sur les idées des autres restent
+visibles jusqu'à leur purge, qui les traite en premier.
+"""
+from django.db import transaction
+from django.db.models import Value
+from django.utils import timezone
+
+from . import jobs
+from .models import ModerationJob, User, Zone
+
+
+def hidden_subjects():
+    """Zones et utilisateurs en cours de suppression : (ids de zones, ids d'utilisateurs), en une requête"""
+    zones = Zone.objects.filter(deleted_at__isnull=False).annotate(kind=Value('zone'))
+    users = User.objects.filter(deleted_at__isnull=False).annotate(kind=Value('user'))
+    rows = zones.order_by().values_list('kind', 'pk').union(users.order_by().values_list('kind', 'pk'), all=True)
+    hidden = {'zone': [], 'user': []}
+    for kind, pk in rows:
+        hidden[kind].append(pk)
+    return tuple(sorted(hidden['zone'])), tuple(sorted(hidden['user']))
+
+
+def visible_ideas(queryset, hidden=None):
+    """Idées de ``queryset`` hors zones et auteurs en cours de suppression (``hidden`` déjà lus)"""
+    zone_ids, user_ids = hidden or hidden_subjects()
+    if zone_ids:
+        queryset = queryset.exclude(zone_id__in=zone_ids)
+    if user_ids:
+        queryset = queryset.exclude(author_id__in=user_ids)
+    return queryset
+
+
+def visible_comments(queryset, hidden=None):
+    """Commentaires de ``queryset`` hors idées masquées"""
+    zone_ids, user_ids = hidden or hidden_subjects()
+    if zone_ids:
+        queryset = queryset.exclude(idea__zone_id__in=zone_ids)
+    if user_ids:
+        queryset = queryset.exclude(idea__author_id__in=user_ids)
+    return queryset
+
+
+def soft_delete(subject, user=None):
+    """Masque un utilisateur ou une zone et met sa purge en file ; retourne l'opération de suivi"""
+    if isinstance(subject, Zone):
+        action, params = ModerationJob.ACTIONS.PURGE_ZONE, {'zone': subject.pk}
+    else:
+        action, params = ModerationJob.ACTIONS.PURGE_USER, {'user': subject.pk}
+    with transaction.atomic():
+        subject.deleted_at = timezone.now()
+        fields = ['deleted_at', 'updated_at']
+        if isinstance(subject, User):
+            subject.is_active = False
+            fields.append('is_active')
+        subject.save(update_fields=fields)
+        job = ModerationJob.objects.create(action=action, params=params, created_by=user)
+        jobs.enqueue('purge_subject', {'moderation_job': job.pk}, dedup_key=f'{action}:{subject.pk}')
+    return job
+
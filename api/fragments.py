@@ -0,0 +1,131 @@
+"""Cache des représentations sérialisées (fragments) des objets listés.
+
+Les listes d'idées et de zones sont assemblées à partir de fragments mis en
+cache objet par objet, sous une clé portant l'identifiant et ``updated_at``
+de l'objet : après une écriture, seul l'objet modifié est de nouveau
+sérialisé, le reste de la page étant lu en une seule lecture groupée
+(``get_many``) du cache ``fragments``. Les fragments périmés ne sont plus
+relus et expirent d'eux-mêmes.
+
+Tout ce qui change la représentation d'une idée (votes, commentaires, votes
+de commentaires, nom d'un auteur) avance donc son ``updated_at`` (voir
+``api/signals.py`` et ``api/votes.py``).
+
+Les champs ``fragment_volatile`` d'un sérialiseur (vote de l'utilisateur
+connecté, nombre d'idées d'une zone…) ne sont jamais mis en cache mais
+calculés à chaque réponse. Un champ volatil lui-même sérialisé par fragments
+(la zone d'une idée) est lu dans le cache en une fois pour toute la page.
+"""
+from django.core.cache import caches
+from django.db import models
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+
+# Entrées du contexte propres à l'utilisateur, exclues du rendu des fragments
+PERSONAL_CONTEXT = ('my_votes',)
+
+
+def store():
+    return caches['fragments']
+
+
+def cache_key(serializer, obj):
+    """Clé du fragment d'un objet (None si l'objet n'a pas de date de modification)"""
+    updated_at = getattr(obj, 'updated_at', None)
+    if obj.pk is None or updated_at is None:
+        return None
+    return f'fragment:{type(serializer).__name__}:{obj.pk}:{updated_at.isoformat()}'
+
+
+def represent(serializer, obj, names):
+    """Représentation des seuls champs ``names`` d'un objet (comme ``to_representation``)"""
+    data = {}
+    for field in serializer._readable_fields:
+        if field.field_name not in names:
+            continue
+        try:
+            attribute = field.get_attribute(obj)
+        except SkipField:
+            continue
+        check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+        data[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+    return data
+
+
+def render_fragments(serializer, objects):
+    """Fragments des objets, sérialisés sans le contexte propre à l'utilisateur"""
+    context = {name: value for name, value in serializer.context.items() if name not in PERSONAL_CONTEXT}
+    shared = type(serializer)(context=context)
+    names = [name for name in shared.fields if name not in serializer.fragment_volatile]
+    serializer.prepare_fragments(objects)
+    return [represent(shared, obj, names) for obj in objects]
+
+
+def render_volatile(serializer, objects):
+    """Champs volatils de chaque objet ; les sérialiseurs à fragments sont lus en une fois"""
+    serializer.prepare_volatile(objects)
+    values = [{} for _ in objects]
+    for name in serializer.fragment_volatile:
+        field = serializer.fields[name]
+        if isinstance(field, FragmentCacheMixin):
+            related = [field.get_attribute(obj) for obj in objects]
+            unique = list({item.pk: item for item in related if item is not None}.values())
+            rendered = dict(zip((item.pk for item in unique), render(field, unique)))
+            for value, item in zip(values, related):
+                value[name] = None if item is None else rendered[item.pk]
+        else:
+            for value, obj in zip(values, objects):
+                value.update(represent(serializer, obj, (name,)))
+    return values
+
+
+def render(serializer, objects):
+    """Représentations des objets, assemblées à partir des fragments en cache"""
+    if not objects:
+        return []
+    cache = store()
+    keys = [cache_key(serializer, obj) for obj in objects]
+    cached = cache.get_many([key for key in keys if key is not None])
+    fragments = [cached.get(key) for key in keys]
+    missing = [index for index, fragment in enumerate(fragments) if fragment is None]
+    if missing:
+        fresh = render_fragments(serializer, [objects[index] for index in missing])
+        for index, fragment in zip(missing, fresh):
+            fragments[index] = fragment
+        cache.set_many({keys[index]: fragments[index] for index in missing if keys[index] is not None})
+
+    names = list(serializer.fields)
+    results = []
+    for fragment, volatile in zip(fragments, render_volatile(serializer, objects)):
+        data = {name: volatile[name] if name in volatile else fragment[name]
+                for name in names if name in volatile or name in fragment}
+        serializer.personalize(data)
+        results.append(data)
+    return results
+
+
+class FragmentListSerializer(serializers.ListSerializer):
+    """Liste dont chaque élément est assemblé à partir du cache de fragments"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return render(self.child, list(iterable))
+
+
+class FragmentCacheMixin:
+    """Sérialiseur dont les listes sont assemblées à partir de fragments en cache.
+
+    À utiliser avec ``Meta.list_serializer_class = FragmentListSerializer``.
+    """
+    # Champs calculés à chaque réponse (propres à l'utilisateur ou trop changeants)
+    fragment_volatile = ()
+
+    def prepare_fragments(self, objects):
+        """Charge en une fois les relations des objets dont le fragment est à calculer"""
+
+    def prepare_volatile(self, objects):
+        """Charge en une fois ce que les champs volatils lisent"""
+
+    def personalize(self, data):
+        """Complète une représentation assemblée avec les données de l'utilisateur"""
@@ -0,0 +1,70 @@
+"""Hachage des mots de passe dans un pool de threads borné.
+
+Le hachage PBKDF2 coûte plusieurs dizaines de millisecondes de CPU. Il est
+exécuté dans un pool dédié dont la concurrence et la file d'attente sont
+limitées. Une requête qui ne trouve pas de créneau libre est refusée aussitôt
+(503 avec ``Retry-After``), sans attendre : pendant une rafale de connexions,
+un worker n'est retenu que par les hachages admis, jamais par l'attente d'un
+créneau.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingCapacityExceeded(APIException):
+    """Plus de capacité disponible pour le hachage des mots de passe"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Service momentanément surchargé, veuillez réessayer.'
+    default_code = 'hashing_capacity_exceeded'
+
+    def __init__(self, wait=None):
+        super().__init__()
+        # Lu par le gestionnaire d'exceptions de DRF pour l'en-tête Retry-After
+        self.wait = wait
+
+
+class BoundedHashingExecutor:
+    """Pool de threads avec un budget de concurrence séparé"""
+
+    def __init__(self, max_workers=None, max_pending=None, retry_after=None):
+        config = getattr(settings, 'PASSWORD_HASHING', {})
+        self.max_workers = max_workers or config.get('MAX_WORKERS', 2)
+        self.max_pending = max_pending if max_pending is not None else config.get('MAX_PENDING', 8)
+        self.retry_after = retry_after or config.get('RETRY_AFTER', 1)
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='password-hashing',
+                    )
+        return self._executor
+
+    def run(self, fn, *args, **kwargs):
+        """Exécute ``fn`` dans le pool ; lève HashingCapacityExceeded sans attendre si saturé"""
+        if not self._slots.acquire(blocking=False):
+            raise HashingCapacityExceeded(self.retry_after)
+        try:
+            return self._get_executor().submit(fn, *args, **kwargs).result()
+        finally:
+            self._slots.release()
+
+    def make_password(self, raw_password):
+        return self.run(make_password, raw_password)
+
+    def verify_password(self, raw_password, encoded):
+        """Retourne (mot de passe correct, hachage à régénérer)"""
+        return self.run(verify_password, raw_password, encoded)
+
+
+password_hashing = BoundedHashingExecutor()
@@ -0,0 +1,171 @@
+"""Carte de chaleur de la participation.
+
+Les idées d'une emprise (filtrables par catégorie et statut) sont réparties
+sur une grille ``resolution`` × ``resolution`` ; chaque idée pèse
+``1 + vote_count``. La grille peut être lissée par un noyau gaussien
+(``smooth`` = écart type en cellules).
+
+Le calcul utilise NumPy s'il est installé (histogramme 2D et convolution
+vectorisés), sinon une implémentation en Python pur donnant le même
+résultat. Seules les coordonnées et le nombre de votes sont lus.
+
+Les grilles sont mises en cache par combinaison de paramètres. Les clés
+portent un numéro de version des données, renouvelé à chaque écriture sur
+une idée ou un vote : les grilles périmées ne sont plus jamais relues et
+expirent d'elles-mêmes. Le cache par défaut étant propre à chaque
+processus, ``CACHE_TIMEOUT`` borne le retard vis-à-vis des écritures des
+autres processus.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .mapdata import FILTERS, filter_ideas
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dépendance optionnelle
+    np = None
+
+DEFAULTS = {
+    'DEFAULT_RESOLUTION': 64,
+    'MAX_RESOLUTION': 256,
+    # Écart type maximal du lissage (cellules)
+    'MAX_SMOOTHING': 5,
+    # Durée de conservation d'une grille (secondes)
+    'CACHE_TIMEOUT': 300,
+}
+
+VERSION_KEY = 'heatmap:version'
+
+
+def heatmap_setting(name):
+    return getattr(settings, 'HEATMAP', {}).get(name, DEFAULTS[name])
+
+
+def data_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = invalidate()
+    return version
+
+
+def invalidate():
+    """Périme toutes les grilles en cache (après une écriture sur les idées ou les votes)"""
+    version = time.time_ns()
+    cache.set(VERSION_KEY, version, None)
+    return version
+
+
+def cache_key(bbox, resolution, smooth, filters):
+    params = repr((bbox, resolution, smooth, sorted(filters.items())))
+    return f'heatmap:{data_version()}:{hashlib.md5(params.encode()).hexdigest()}'
+
+
+def gaussian_kernel(sigma):
+    """Noyau gaussien 1D normalisé (rayon 3 sigma)"""
+    radius = max(math.ceil(3 * sigma), 1)
+    weights = [math.exp(-(offset * offset) / (2 * sigma * sigma)) for offset in range(-radius, radius + 1)]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+def _cell(value, start, step, resolution):
+    # Valeur sur le bord supérieur de l'emprise : dernière cellule
+    return min(int((value - start) / step), resolution - 1)
+
+
+def bin_python(rows, bbox, resolution):
+    """Grille (liste de lignes, du sud au nord) en Python pur"""
+    west, south, east, north = bbox
+    lat_step = (north - south) / resolution
+    lng_step = (east - west) / resolution
+    grid = [[0.0] * resolution for _ in range(resolution)]
+    for latitude, longitude, votes in rows:
+        grid[_cell(latitude, south, lat_step, resolution)][_cell(longitude, west, lng_step, resolution)] += 1 + votes
+    return grid
+
+
+def smooth_python(grid, sigma):
+    kernel = gaussian_kernel(sigma)
+    radius = len(kernel) // 2
+    size = len(grid)
+
+    def convolve(line):
+        result = [0.0] * size
+        for index, value in enumerate(line):
+            if value:
+                for offset, weight in enumerate(kernel, -radius):
+                    target = index + offset
+                    if 0 <= target < size:
+                        result[target] += value * weight
+        return result
+
+    rows = [convolve(line) for line in grid]
+    columns = [convolve(column) for column in zip(*rows)]
+    return [list(line) for line in zip(*columns)]
+
+
+def bin_numpy(rows, bbox, resolution):
+    """Grille (tableau, lignes du sud au nord) par histogramme 2D vectorisé"""
+    west, south, east, north = bbox
+    if not rows:
+        return np.zeros((resolution, resolution))
+    points = np.asarray(rows, dtype=float)
+    grid, _, _ = np.histogram2d(
+        points[:, 0], points[:, 1], bins=resolution,
+        range=[[south, north], [west, east]], weights=points[:, 2] + 1,
+    )
+    return grid
+
+
+def smooth_numpy(grid, sigma):
+    kernel = np.asarray(gaussian_kernel(sigma))
+    radius = len(kernel) // 2
+    size = len(grid)
+
+    def convolve(line):
+        return np.convolve(line, kernel)[radius:radius + size]
+
+    grid = np.apply_along_axis(convolve, 1, grid)
+    return np.apply_along_axis(convolve, 0, grid)
+
+
+def compute(bbox, resolution, smooth=0, filters=None, use_numpy=None):
+    """Grille de chaleur (liste de lignes du sud au nord) et nombre d'idées"""
+    use_numpy = np is not None if use_numpy is None else use_numpy
+    rows = list(filter_ideas(bbox, filters).order_by().values_list('latitude', 'longitude', 'vote_count'))
+    if use_numpy:
+        grid = bin_numpy(rows, bbox, resolution)
+        if smooth:
+            grid = smooth_numpy(grid, smooth)
+        grid = grid.tolist()
+    else:
+        grid = bin_python(rows, bbox, resolution)
+        if smooth:
+            grid = smooth_python(grid, smooth)
+    return grid, len(rows)
+
+
+def heatmap(bbox, resolution, smooth=0, filters=None):
+    """Carte de chaleur sérialisable, lue en cache si possible"""
+    filters = filters or {}
+    filters = {name: filters.get(name) for name in FILTERS if filters.get(name)}
+    key = cache_key(bbox, resolution, smooth, filters)
+    data = cache.get(key)
+    if data is None:
+        grid, count = compute(bbox, resolution, smooth, filters)
+        cells = [round(value, 4) for line in grid for value in line]
+        data = {
+            'bbox': list(bbox),
+            'resolution': resolution,
+            'smooth': smooth,
+            'count': count,
+            'max': max(cells, default=0),
+            'grid': cells,
+        }
+        cache.set(key, data, heatmap_setting('CACHE_TIMEOUT'))
+    return data
@@ -0,0 +1,100 @@
+"""Rejeu des requêtes POST portant un en-tête ``Idempotency-Key``.
+
+Un client qui renvoie une requête (réseau instable) avec la même clé reçoit
+la réponse enregistrée lors du premier passage, sans nouvelle écriture ni
+sérialisation. Les réponses réussies (2xx) sont conservées, compressées,
+dans le cache ``idempotency`` (partagé entre les processus), dont le
+``TIMEOUT`` fixe la fenêtre de rejeu et ``MAX_ENTRIES`` la taille maximale.
+
+Les clés sont propres à chaque utilisateur et à chaque URL. Une requête
+encore en cours avec la même clé donne un 409 ; une clé réutilisée pour un
+contenu différent, un 422.
+"""
+import functools
+import hashlib
+import json
+import zlib
+
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+REPLAY_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# Durée maximale de traitement d'une requête avant que sa clé soit libérée (secondes)
+PENDING_TIMEOUT = 60
+
+PENDING = 'pending'
+DONE = 'done'
+
+
+def store():
+    return caches['idempotency']
+
+
+def cache_key(request, key):
+    scope = f'{request.user.pk}:{request.path}:{key}'
+    return f'idempotency:{hashlib.sha256(scope.encode()).hexdigest()}'
+
+
+def fingerprint(request):
+    """Empreinte du contenu de la requête"""
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def replay(entry):
+    _, _, status_code, body = entry
+    response = HttpResponse(zlib.decompress(body), status=status_code, content_type='application/json')
+    response[REPLAY_HEADER] = 'true'
+    return response
+
+
+def idempotent(handler):
+    """Rend une action POST rejouable avec l'en-tête ``Idempotency-Key``"""
+
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or request.method != 'POST' or not request.user.is_authenticated:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({
+                'error': f"{HEADER} ne doit pas dépasser {MAX_KEY_LENGTH} caractères"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        entries = store()
+        entry_key = cache_key(request, key)
+        digest = fingerprint(request)
+        entry = entries.get(entry_key)
+        if entry is not None or not entries.add(entry_key, (PENDING, digest), PENDING_TIMEOUT):
+            # Clé connue, ou enregistrée entre-temps par une requête concurrente
+            entry = entry or entries.get(entry_key)
+            if entry is not None and entry[1] != digest:
+                return Response({
+                    'error': f"{HEADER} déjà utilisée pour une requête différente"
+                }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if entry is not None and entry[0] == DONE:
+                return replay(entry)
+            return Response({
+                'error': 'Une requête avec la même clé est en cours de traitement'
+            }, status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            entries.delete(entry_key)
+            raise
+        if isinstance(response, Response) and status.is_success(response.status_code):
+            body = zlib.compress(JSONRenderer().render(response.data))
+            entries.set(entry_key, (DONE, digest, response.status_code, body))
+        else:
+            # Échec : la requête peut être retentée avec la même clé
+            entries.delete(entry_key)
+        return response
+
+    return wrapper
@@ -0,0 +1,287 @@
+"""File d'attente de tâches de fond stockée en base (sans broker externe).
+
+Les recalculs (scores, compteurs de votes, agrégats par zone, index de
+similarité…) sont enregistrés dans la table ``Job`` et exécutés par la
+commande ``run_worker`` dans un pool de processus :
+
+- ``enqueue`` ajoute une tâche ; avec ``dedup_key``, une tâche identique
+  déjà en attente est réutilisée (index unique partiel sur les tâches en
+  attente) ;
+- ``claim`` réserve des tâches prêtes par mise à jour conditionnelle
+  (``pending`` -> ``running``) : deux workers ne prennent jamais la même ;
+- une tâche en échec est relancée après un délai exponentiel
+  (``RETRY_BASE_DELAY`` * 2^(tentative - 1), borné par ``RETRY_MAX_DELAY``)
+  jusqu'à ``max_attempts`` tentatives ;
+- pendant l'exécution, un thread du worker renouvelle ``heartbeat_at``
+  toutes les ``HEARTBEAT_INTERVAL`` secondes ; une tâche ``running`` sans
+  signe de vie depuis ``STALE_AFTER`` secondes (worker arrêté brutalement)
+  est remise en attente, quelle que soit la durée de la tâche ;
+- les tâches de ``PERIODIC`` sont mises en file à chaque échéance.
+
+Les tâches sont des fonctions enregistrées avec ``@task`` (voir
+``api/tasks.py``) dont les paramètres et le résultat sont sérialisables en
+JSON.
+"""
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Count, F, Max, Min
+from django.utils import timezone
+
+from .models import Job
+
+DEFAULTS = {
+    # Processus d'exécution du worker (0 : dans le processus principal)
+    'PROCESSES': 2,
+    # Attente entre deux scrutations de la file vide (secondes)
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BASE_DELAY': 10,
+    'RETRY_MAX_DELAY': 3600,
+    # Intervalle des signes de vie d'une tâche en cours (secondes)
+    'HEARTBEAT_INTERVAL': 30,
+    # Silence au-delà duquel une tâche en cours est considérée abandonnée (secondes)
+    'STALE_AFTER': 300,
+    # Conservation des tâches terminées ou échouées (jours)
+    'RETENTION_DAYS': 7,
+    # Nom de tâche -> {'every': secondes, 'params': {...}}
+    'PERIODIC': {},
+}
+
+# Nom -> fonction des tâches enregistrées
+TASKS = {}
+
+
+class UnknownTask(LookupError):
+    pass
+
+
+def jobs_setting(name):
+    return getattr(settings, 'JOBS', {}).get(name, DEFAULTS[name])
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """Enregistre une fonction comme tâche de fond (``@task`` ou ``@task(max_attempts=3)``)"""
+
+    def register(func):
+        func.max_attempts = max_attempts
+        TASKS[name or func.__name__] = func
+        return func
+
+    return register(func) if func is not None else register
+
+
+def enqueue(name, params=None, dedup_key=None, run_at=None, max_attempts=None):
+    """Met une tâche en file ; retourne la tâche en attente de même ``dedup_key`` s'il y en a une"""
+    if name not in TASKS:
+        raise UnknownTask(f'Tâche inconnue : {name}')
+    if max_attempts is None:
+        max_attempts = TASKS[name].max_attempts or jobs_setting('MAX_ATTEMPTS')
+    fields = {
+        'task': name, 'params': params or {}, 'dedup_key': dedup_key,
+        'run_at': run_at or timezone.now(), 'max_attempts': max_attempts,
+    }
+    if dedup_key is None:
+        return Job.objects.create(**fields)
+    pending = Job.objects.filter(dedup_key=dedup_key, state=Job.STATES.PENDING)
+    while True:
+        existing = pending.first()
+        if existing is not None:
+            return existing
+        try:
+            with transaction.atomic():
+                return Job.objects.create(**fields)
+        except IntegrityError:
+            # Ajoutée entre-temps par un autre processus
+            continue
+
+
+def claim(worker, limit, now=None):
+    """Réserve jusqu'à ``limit`` tâches prêtes pour ``worker`` ; retourne leurs identifiants"""
+    now = now or timezone.now()
+    ready = Job.objects.filter(state=Job.STATES.PENDING, run_at__lte=now).order_by('run_at', 'pk')
+    claimed = []
+    for pk in ready.values_list('pk', flat=True)[:limit * 2]:
+        if len(claimed) == limit:
+            break
+        # Mise à jour conditionnelle : sans effet si un autre worker l'a prise
+        taken = Job.objects.filter(pk=pk, state=Job.STATES.PENDING).update(
+            state=Job.STATES.RUNNING, worker=worker, started_at=now, heartbeat_at=now, finished_at=None,
+            attempts=F('attempts') + 1,
+        )
+        if taken:
+            claimed.append(pk)
+    return claimed
+
+
+def retry_delay(attempts):
+    """Délai avant la tentative suivante (exponentiel, avec une part aléatoire)"""
+    delay = min(jobs_setting('RETRY_MAX_DELAY'), jobs_setting('RETRY_BASE_DELAY') * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(1, 1.25))
+
+
+def _finish(job, fields):
+    try:
+        with transaction.atomic():
+            job.save(update_fields=fields)
+    except IntegrityError:
+        # Une tâche de même clé est déjà en attente : elle refera le travail
+        job.state = Job.STATES.FAILED
+        job.save(update_fields=fields)
+
+
+def fail(job, error, now=None):
+    """Enregistre l'échec d'une tentative : nouvelle tentative différée ou échec définitif"""
+    now = now or timezone.now()
+    job.error = error
+    job.finished_at = now
+    if job.attempts < job.max_attempts:
+        job.state = Job.STATES.PENDING
+        job.run_at = now + retry_delay(job.attempts)
+    else:
+        job.state = Job.STATES.FAILED
+    _finish(job, ['state', 'error', 'finished_at', 'run_at'])
+
+
+def beat(job_id, now=None):
+    """Renouvelle le signe de vie d'une tâche en cours ; retourne False si elle n'est plus en cours"""
+    return bool(Job.objects.filter(pk=job_id, state=Job.STATES.RUNNING).update(heartbeat_at=now or timezone.now()))
+
+
+class Heartbeat(threading.Thread):
+    """Thread renouvelant le signe de vie d'une tâche tant qu'elle s'exécute"""
+
+    def __init__(self, job_id):
+        super().__init__(name=f'job-heartbeat-{job_id}', daemon=True)
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(jobs_setting('HEARTBEAT_INTERVAL')):
+                try:
+                    beat(self.job_id)
+                except DatabaseError:
+                    # Base momentanément verrouillée : nouvel essai au battement suivant
+                    pass
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def execute(job_id):
+    """Exécute une tâche réservée ; retourne son nouvel état"""
+    job = Job.objects.get(pk=job_id)
+    func = TASKS.get(job.task)
+    try:
+        if func is None:
+            raise UnknownTask(f'Tâche inconnue : {job.task}')
+        heartbeat = Heartbeat(job_id)
+        heartbeat.start()
+        try:
+            result = func(**job.params)
+        finally:
+            heartbeat.stop()
+    except Exception as exc:
+        fail(job, f'{type(exc).__name__}: {exc}')
+    else:
+        job.state = Job.STATES.DONE
+        job.result = result
+        job.error = ''
+        job.finished_at = timezone.now()
+        job.save(update_fields=['state', 'result', 'error', 'finished_at'])
+    return job.state
+
+
+def retry_failed(queryset, now=None):
+    """Remet en file, avec un compteur de tentatives remis à zéro, les tâches échouées de ``queryset``"""
+    now = now or timezone.now()
+    count = 0
+    for job in queryset.filter(state=Job.STATES.FAILED):
+        job.state = Job.STATES.PENDING
+        job.attempts = 0
+        job.run_at = now
+        _finish(job, ['state', 'attempts', 'run_at'])
+        count += job.state == Job.STATES.PENDING
+    return count
+
+
+def requeue_stale(now=None):
+    """Remet en attente (ou en échec) les tâches sans signe de vie, abandonnées par un worker arrêté"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=jobs_setting('STALE_AFTER'))
+    stale = Job.objects.filter(state=Job.STATES.RUNNING, heartbeat_at__lt=cutoff)
+    count = 0
+    for job in stale:
+        fail(job, f'Abandonnée par le worker {job.worker}', now)
+        count += 1
+    return count
+
+
+def schedule_periodic(now=None):
+    """Met en file les tâches périodiques arrivées à échéance ; retourne leurs noms"""
+    now = now or timezone.now()
+    scheduled = []
+    for name, entry in jobs_setting('PERIODIC').items():
+        dedup_key = f'periodic:{name}'
+        last = (
+            Job.objects.filter(task=name, dedup_key=dedup_key)
+            .aggregate(last=Max('created_at'))['last']
+        )
+        if last is None or last <= now - timedelta(seconds=entry['every']):
+            enqueue(name, entry.get('params'), dedup_key=dedup_key, run_at=now)
+            scheduled.append(name)
+    return scheduled
+
+
+def prune(now=None):
+    """Supprime les tâches terminées ou échouées sorties de la rétention"""
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=jobs_setting('RETENTION_DAYS'))
+    deleted, _ = Job.objects.filter(
+        state__in=[Job.STATES.DONE, Job.STATES.FAILED], finished_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def queue_stats(now=None, window=timedelta(hours=1)):
+    """Profondeur de la file par tâche et latences des tâches démarrées sur ``window``"""
+    now = now or timezone.now()
+    depth = {}
+    rows = (
+        Job.objects.filter(state__in=[Job.STATES.PENDING, Job.STATES.RUNNING])
+        .values_list('task', 'state').annotate(n=Count('id')).order_by()
+    )
+    for name, state, n in rows:
+        depth.setdefault(name, {'pending': 0, 'running': 0})[state] = n
+    oldest = (
+        Job.objects.filter(state=Job.STATES.PENDING, run_at__lte=now)
+        .aggregate(oldest=Min('run_at'))['oldest']
+    )
+
+    waits, durations = [], []
+    recent = Job.objects.filter(started_at__gte=now - window).values_list('run_at', 'started_at', 'finished_at', 'state')
+    for run_at, started_at, finished_at, state in recent:
+        waits.append((started_at - run_at).total_seconds())
+        if state == Job.STATES.DONE and finished_at is not None:
+            durations.append((finished_at - started_at).total_seconds())
+
+    def summary(values):
+        if not values:
+            return None
+        return {'avg': sum(values) / len(values), 'max': max(values), 'count': len(values)}
+
+    return {
+        'depth': depth,
+        'ready': Job.objects.filter(state=Job.STATES.PENDING, run_at__lte=now).count(),
+        'oldest_ready_age': (now - oldest).total_seconds() if oldest else None,
+        'failed': Job.objects.filter(state=Job.STATES.FAILED).count(),
+        'wait': summary(waits),
+        'duration': summary(durations),
+    }
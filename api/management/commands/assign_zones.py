@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Idea
+from api.spatial import get_locator, invalidate
+
+
+class Command(BaseCommand):
+    help = 'Réaffecte chaque idée à la zone contenant sa position (ou à la plus proche)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Nombre d\'idées lues par lot')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Affiche les changements sans les appliquer')
+
+    def handle(self, *args, **options):
+        invalidate()
+        locator = get_locator()
+        batch_size = options['batch_size']
+        last_pk = 0
+        checked = 0
+        moved = 0
+        lookup_time = 0.0
+
+        while True:
+            rows = list(
+                Idea.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'latitude', 'longitude', 'zone_id')[:batch_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            checked += len(rows)
+
+            start = time.perf_counter()
+            zone_ids = locator.locate_many([(latitude, longitude) for _, latitude, longitude, _ in rows])
+            lookup_time += time.perf_counter() - start
+
+            changes = {
+                pk: zone_id
+                for (pk, _, _, current), zone_id in zip(rows, zone_ids)
+                if zone_id is not None and zone_id != current
+            }
+            moved += len(changes)
+            if options['dry_run'] or not changes:
+                continue
+            # Sauvegarde par idée : les statistiques dérivées suivent le déplacement
+            with transaction.atomic():
+                for idea in Idea.objects.filter(pk__in=changes):
+                    idea.zone_id = changes[idea.pk]
+                    idea.save(update_fields=['zone', 'updated_at'])
+
+        per_point = lookup_time / checked * 1e6 if checked else 0
+        verb = 'à réaffecter' if options['dry_run'] else 'réaffectée(s)'
+        self.stdout.write(self.style.SUCCESS(
+            f'{checked} idée(s) vérifiée(s), {moved} {verb} ({per_point:.1f} µs par position)'
+        ))
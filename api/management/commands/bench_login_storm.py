@@ -0,0 +1,95 @@
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+
+User = get_user_model()
+
+BENCH_EMAIL = 'bench-login@example.com'
+BENCH_PASSWORD = 'bench-password-123'
+
+
+class Command(BaseCommand):
+    help = 'Mesure la latence des lectures d\'idées pendant une rafale de connexions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help='Durée de chaque phase en secondes')
+        parser.add_argument('--logins', type=int, default=16,
+                            help='Nombre de threads effectuant des connexions')
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Nombre de threads lisant /api/ideas/')
+
+    def handle(self, *args, **options):
+        if not User.objects.filter(email=BENCH_EMAIL).exists():
+            User.objects.create_user(username='bench-login', email=BENCH_EMAIL, password=BENCH_PASSWORD)
+
+        duration = options['duration']
+        baseline = self._run(duration, options['readers'], 0)
+        storm = self._run(duration, options['readers'], options['logins'])
+
+        self._report('Sans rafale', baseline)
+        self._report(f'Rafale de {options["logins"]} threads de connexion', storm)
+
+    def _run(self, duration, readers, logins):
+        stop = threading.Event()
+        read_latencies = []
+        login_statuses = []
+        lock = threading.Lock()
+
+        def reader():
+            client = Client(HTTP_HOST='localhost')
+            while not stop.is_set():
+                start = time.perf_counter()
+                client.get('/api/ideas/')
+                elapsed = time.perf_counter() - start
+                with lock:
+                    read_latencies.append(elapsed)
+            connections.close_all()
+
+        def login():
+            client = Client(HTTP_HOST='localhost')
+            while not stop.is_set():
+                # Adresse aléatoire : simule une rafale distribuée non limitée par IP
+                response = client.post(
+                    '/api/auth/login/',
+                    {'email': BENCH_EMAIL, 'password': BENCH_PASSWORD},
+                    content_type='application/json',
+                    REMOTE_ADDR=f'10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}',
+                )
+                with lock:
+                    login_statuses.append(response.status_code)
+            connections.close_all()
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=login) for _ in range(logins)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return read_latencies, login_statuses
+
+    def _report(self, label, result):
+        read_latencies, login_statuses = result
+        self.stdout.write(self.style.MIGRATE_HEADING(label))
+        if read_latencies:
+            ordered = sorted(read_latencies)
+            p95 = ordered[int(len(ordered) * 0.95) - 1] if len(ordered) > 1 else ordered[0]
+            self.stdout.write(
+                f'  lectures : {len(ordered)} requêtes, '
+                f'médiane {statistics.median(ordered) * 1000:.1f} ms, '
+                f'p95 {p95 * 1000:.1f} ms'
+            )
+        if login_statuses:
+            by_status = {}
+            for code in login_statuses:
+                by_status[code] = by_status.get(code, 0) + 1
+            detail = ', '.join(f'{code}: {count}' for code, count in sorted(by_status.items()))
+            self.stdout.write(f'  connexions : {len(login_statuses)} ({detail})')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from api.models import Idea
+from api.similarity import duplicate_groups
+
+
+class Command(BaseCommand):
+    help = 'Liste les groupes d\'idées quasi identiques sur tout le corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Nombre d\'idées lues par lot')
+        parser.add_argument('--rebuild-index', action='store_true',
+                            help='Réécrit aussi l\'index de similarité')
+
+    def handle(self, *args, **options):
+        groups = duplicate_groups(options['batch_size'], options['rebuild_index'])
+        titles = dict(
+            Idea.objects.filter(pk__in=[pk for group in groups for pk in group]).values_list('pk', 'title')
+        )
+        for group in groups:
+            self.stdout.write(f'{len(group)} idées : ' + ', '.join(f'#{pk} « {titles[pk]} »' for pk in group))
+        self.stdout.write(self.style.SUCCESS(f'{len(groups)} groupe(s) de doublons possibles'))
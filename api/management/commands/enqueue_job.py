@@ -0,0 +1,32 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Met une tâche de fond en file (exécutée par run_worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task', help='Nom de la tâche (voir api/tasks.py)')
+        parser.add_argument('--params', default='{}', help='Paramètres de la tâche (objet JSON)')
+        parser.add_argument('--dedup-key', default=None,
+                            help='Clé de déduplication : réutilise la tâche en attente de même clé')
+        parser.add_argument('--delay', type=int, default=0, help='Secondes avant la première exécution')
+
+    def handle(self, *args, **options):
+        try:
+            params = json.loads(options['params'])
+        except ValueError as exc:
+            raise CommandError(f'--params : JSON invalide ({exc})')
+        if not isinstance(params, dict):
+            raise CommandError('--params : un objet JSON est attendu')
+        run_at = timezone.now() + timedelta(seconds=options['delay'])
+        try:
+            job = jobs.enqueue(options['task'], params, dedup_key=options['dedup_key'], run_at=run_at)
+        except jobs.UnknownTask as exc:
+            raise CommandError(f'{exc} (disponibles : {", ".join(sorted(jobs.TASKS))})')
+        self.stdout.write(self.style.SUCCESS(f'Tâche {job.pk} ({job.task}) en file pour {job.run_at:%Y-%m-%d %H:%M:%S}'))
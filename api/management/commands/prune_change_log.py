@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api import changelog
+
+
+class Command(BaseCommand):
+    help = 'Supprime les tombstones du journal de synchronisation sortis de la rétention'
+
+    def handle(self, *args, **options):
+        deleted = changelog.prune()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} tombstone(s) supprimé(s)'))
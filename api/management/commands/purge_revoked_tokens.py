@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from api.tasks import purge_revoked_tokens
+
+
+class Command(BaseCommand):
+    help = 'Supprime les jetons révoqués déjà expirés'
+
+    def handle(self, *args, **options):
+        deleted = purge_revoked_tokens()
+        self.stdout.write(
+            self.style.SUCCESS(f'{deleted} jeton(s) révoqué(s) expiré(s) supprimé(s)')
+        )
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from api import activity
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit les tranches d\'activité et purge les tranches horaires expirées'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Ne reconstruire que les N derniers jours')
+        parser.add_argument('--prune-only', action='store_true',
+                            help='Purger les tranches horaires expirées sans reconstruire')
+
+    def handle(self, *args, **options):
+        if not options['prune_only']:
+            since = None
+            if options['days'] is not None:
+                since = timezone.now() - timedelta(days=options['days'])
+            count = activity.rebuild(since)
+            self.stdout.write(f'{count} tranche(s) reconstruite(s)')
+
+        deleted = activity.prune_hourly()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} tranche(s) horaire(s) expirée(s) supprimée(s)'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from api import stats
+
+
+class Command(BaseCommand):
+    help = 'Reconstruit ou vérifie les statistiques matérialisées par zone'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Vérifie la cohérence sans rien modifier')
+        parser.add_argument('--zone', type=int, action='append', dest='zones',
+                            help='Limiter à une zone (option répétable)')
+
+    def handle(self, *args, **options):
+        zone_ids = options['zones']
+        if options['check']:
+            mismatches = stats.check(zone_ids)
+            for (zone_id, category, status), (stored, expected) in sorted(mismatches.items()):
+                self.stdout.write(
+                    f'Zone {zone_id} / {category} / {status} : stocké {stored}, attendu {expected}'
+                )
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} ligne(s) incohérente(s)')
+            self.stdout.write(self.style.SUCCESS('Statistiques cohérentes'))
+            return
+
+        count = stats.rebuild(zone_ids)
+        self.stdout.write(self.style.SUCCESS(f'{count} ligne(s) de statistiques reconstruite(s)'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from api.tasks import refresh_idea_scores
+
+
+class Command(BaseCommand):
+    help = 'Recalcule par lots les scores de classement (atténuation du score « hot »)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Nombre d\'idées mises à jour par requête')
+        parser.add_argument('--max-age-days', type=int, default=None,
+                            help='Ne recalculer que les idées plus récentes que ce nombre de jours')
+
+    def handle(self, *args, **options):
+        updated = refresh_idea_scores(options['max_age_days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Scores recalculés pour {updated} idée(s)'))
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import jobs
+
+
+class Command(BaseCommand):
+    help = 'Exécute les tâches de fond de la file en base (voir api/jobs.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Processus d\'exécution (0 : dans ce processus ; JOBS["PROCESSES"] par défaut)')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Attente entre deux scrutations de la file vide (secondes)')
+        parser.add_argument('--burst', action='store_true',
+                            help='S\'arrêter dès que la file ne contient plus de tâche prête')
+        parser.add_argument('--no-periodic', action='store_true',
+                            help='Ne pas mettre en file les tâches périodiques (JOBS["PERIODIC"])')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        processes = options['processes']
+        if processes is None:
+            processes = jobs.jobs_setting('PROCESSES')
+        poll_interval = options['poll_interval'] or jobs.jobs_setting('POLL_INTERVAL')
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        executor = None
+        if processes > 0:
+            # Processus forkés : ils héritent du code chargé ; aucune connexion ouverte ne doit être partagée
+            executor = ProcessPoolExecutor(
+                processes, mp_context=multiprocessing.get_context('fork'),
+                initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN),
+            )
+        self.stdout.write(f'Worker {self.worker} : {processes or 1} processus, tâches {", ".join(sorted(jobs.TASKS))}')
+
+        running = {}
+        done = 0
+        try:
+            while not self.stopping:
+                jobs.requeue_stale()
+                if not options['no_periodic']:
+                    jobs.schedule_periodic()
+                free = max(processes, 1) - len(running)
+                claimed = jobs.claim(self.worker, free) if free else []
+                if executor is None:
+                    for job_id in claimed:
+                        self._report(job_id, jobs.execute(job_id))
+                        done += 1
+                elif claimed:
+                    connections.close_all()
+                    for job_id in claimed:
+                        running[executor.submit(jobs.execute, job_id)] = job_id
+                if running:
+                    finished, _ = wait(running, timeout=0 if claimed else poll_interval, return_when=FIRST_COMPLETED)
+                    done += self._collect(running, finished)
+                elif not claimed:
+                    if options['burst']:
+                        break
+                    time.sleep(poll_interval)
+        finally:
+            if executor is not None:
+                # Arrêt propre : les tâches en cours se terminent
+                done += self._collect(running, wait(running).done)
+                executor.shutdown()
+        self.stdout.write(self.style.SUCCESS(f'{done} tâche(s) exécutée(s)'))
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _collect(self, running, finished):
+        for future in finished:
+            job_id = running.pop(future)
+            try:
+                self._report(job_id, future.result())
+            except Exception as exc:
+                # Processus d'exécution interrompu : la tâche sera remise en file (STALE_AFTER)
+                self.stderr.write(f'Tâche {job_id} : {type(exc).__name__}: {exc}')
+        return len(finished)
+
+    def _report(self, job_id, state):
+        if self.verbosity >= 2:
+            self.stdout.write(f'Tâche {job_id} : {state}')
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api import stats, votes
+from api.models import Comment, Idea, Vote, Zone
+from api.ranking import compute_scores
+
+User = get_user_model()
+
+STRESS_PREFIX = 'stress-votes'
+
+
+class Command(BaseCommand):
+    help = 'Vérifie les votes sous accès concurrents (votes, inversions et retraits simultanés)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Nombre de threads votant en parallèle')
+        parser.add_argument('--users', type=int, default=4,
+                            help='Nombre d\'utilisateurs partagés par les threads')
+        parser.add_argument('--operations', type=int, default=200,
+                            help='Opérations par thread')
+        parser.add_argument('--keep', action='store_true',
+                            help='Conserver les données créées pour le test')
+
+    def handle(self, *args, **options):
+        zone, idea, comment, users = self._setup(options['users'])
+        try:
+            errors, elapsed, done = self._run(idea, comment, users, options['threads'], options['operations'])
+            self.stdout.write(f'{done} opérations en {elapsed:.2f} s ({done / elapsed:.0f}/s)')
+            problems = self._verify(zone, idea)
+            for name, count in errors.most_common():
+                self.stdout.write(self.style.ERROR(f'  {name} : {count}'))
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(f'  {problem}'))
+            if errors or problems:
+                raise CommandError(f'{sum(errors.values())} erreur(s), {len(problems)} incohérence(s)')
+            self.stdout.write(self.style.SUCCESS('Aucune erreur, compteurs exacts'))
+        finally:
+            if not options['keep']:
+                zone.delete()
+                User.objects.filter(username__startswith=STRESS_PREFIX).delete()
+
+    def _setup(self, user_count):
+        zone = Zone.objects.create(name=STRESS_PREFIX, zone_type='street', latitude=0, longitude=0)
+        users = [
+            User.objects.create_user(
+                username=f'{STRESS_PREFIX}-{index}-{time.time_ns()}',
+                email=f'{STRESS_PREFIX}-{index}-{time.time_ns()}@example.com',
+                password=None,
+            )
+            for index in range(user_count)
+        ]
+        idea = Idea.objects.create(
+            title=STRESS_PREFIX, description=STRESS_PREFIX, category=Idea.CATEGORIES.TRANSPORT,
+            latitude=0, longitude=0, author=users[0], zone=zone,
+        )
+        comment = Comment.objects.create(idea=idea, user=users[0], content=STRESS_PREFIX)
+        return zone, idea, comment, users
+
+    def _run(self, idea, comment, users, thread_count, operations):
+        errors = Counter()
+        done = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(thread_count)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            start_barrier.wait()
+            count = 0
+            for _ in range(operations):
+                user = rng.choice(users)
+                action = rng.random()
+                try:
+                    if action < 0.35:
+                        votes.cast(idea, user, rng.random() < 0.5)
+                    elif action < 0.5:
+                        votes.retract(idea, user)
+                    elif action < 0.85:
+                        votes.cast_comment_vote(comment, user, rng.random() < 0.5)
+                    else:
+                        votes.retract_comment_vote(comment, user)
+                    count += 1
+                except Exception as exc:
+                    with lock:
+                        errors[type(exc).__name__] += 1
+            with lock:
+                done.append(count)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(thread_count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors, time.perf_counter() - started, sum(done)
+
+    def _verify(self, zone, idea):
+        problems = []
+        idea.refresh_from_db()
+        positive = Vote.objects.filter(idea=idea, is_positive=True).count()
+        negative = Vote.objects.filter(idea=idea, is_positive=False).count()
+        stored = (idea.vote_count, idea.positive_votes, idea.negative_votes)
+        expected = (positive + negative, positive, negative)
+        if stored != expected:
+            problems.append(f'Compteurs de l\'idée : stockés {stored}, attendus {expected}')
+        # hot_score dépend de l'heure du calcul : seuls les scores stables sont comparés
+        expected_scores = compute_scores(positive, negative, idea.created_at)
+        if any(abs(getattr(idea, field) - expected_scores[field]) > 1e-9
+               for field in ('wilson_score', 'controversy_score')):
+            problems.append('Scores de classement non recalculés')
+        for (zone_id, category, status), (stored, expected) in stats.check([zone.pk]).items():
+            problems.append(f'ZoneStat {category}/{status} : stocké {stored}, attendu {expected}')
+        return problems
@@ -0,0 +1,189 @@
+"""Données compactes de la carte des idées.
+
+Pour afficher des dizaines de milliers d'épingles, ``/api/ideas/map/``
+renvoie les idées d'une emprise sous forme de colonnes parallèles plutôt
+qu'une liste d'objets :
+
+- ``id``, ``lat``, ``lng`` : entiers codés en delta (chaque valeur est
+  l'écart avec la précédente) ; les coordonnées sont quantifiées à
+  ``PRECISION`` décimales (``valeur / 10 ** precision``) ;
+- ``category``, ``status`` : indices dans les tables ``categories`` et
+  ``statuses`` ;
+- ``votes`` : nombre total de votes.
+
+Les idées sont triées selon une courbe de Morton (Z-order) : des idées
+voisines se suivent, ce qui garde les deltas de coordonnées petits.
+
+La variante binaire (``?format=bin``) contient les mêmes colonnes :
+en-tête ``<4sBBIB`` (``b'IMAP'``, version, précision, nombre d'idées,
+tronqué), tables de libellés (nombre puis chaînes UTF-8 préfixées par leur
+longueur, sur un octet), colonnes ``id``/``lat``/``lng`` en varints zigzag,
+``category`` et ``status`` sur un octet, ``votes`` en varints zigzag.
+"""
+import struct
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .deletion import visible_ideas
+from .models import Idea
+
+DEFAULTS = {
+    # Décimales conservées pour les coordonnées (5 ≈ 1 m)
+    'PRECISION': 5,
+    # Nombre maximal d'idées renvoyées ; au-delà, les plus votées sont retenues
+    'MAX_POINTS': 200_000,
+}
+
+MAGIC = b'IMAP'
+VERSION = 1
+HEADER = struct.Struct('<4sBBIB')
+
+# Filtres acceptés en plus de l'emprise
+FILTERS = ('category', 'status')
+
+# Bits de la courbe de Morton par axe
+_MORTON_BITS = 16
+_SPREAD = [
+    sum(((byte >> bit) & 1) << (2 * bit) for bit in range(8))
+    for byte in range(256)
+]
+
+
+def map_setting(name):
+    return getattr(settings, 'MAP', {}).get(name, DEFAULTS[name])
+
+
+def parse_bbox(value):
+    """Emprise ``ouest,sud,est,nord`` en degrés ; lève ValueError si invalide"""
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError("bbox attendu sous la forme ouest,sud,est,nord")
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError("bbox hors limites ou vide")
+    return west, south, east, north
+
+
+def filter_ideas(bbox, filters=None):
+    """Idées de l'emprise, filtrées par catégorie et/ou statut"""
+    west, south, east, north = bbox
+    ideas = visible_ideas(Idea.objects.filter(latitude__range=(south, north), longitude__range=(west, east)))
+    for name, value in (filters or {}).items():
+        if name in FILTERS and value:
+            ideas = ideas.filter(**{name: value})
+    return ideas
+
+
+def load_rows(bbox, filters=None, max_points=None):
+    """Lignes (id, lat, lng, catégorie, statut, votes) et indicateur de troncature"""
+    max_points = max_points or map_setting('MAX_POINTS')
+    rows = list(
+        filter_ideas(bbox, filters)
+        .order_by('-vote_count', 'id')
+        .values_list('id', 'latitude', 'longitude', 'category', 'status', 'vote_count')[:max_points + 1]
+    )
+    return rows[:max_points], len(rows) > max_points
+
+
+def _morton(x, y):
+    code = 0
+    for shift in (0, 8):
+        code |= (_SPREAD[(x >> shift) & 0xFF] | (_SPREAD[(y >> shift) & 0xFF] << 1)) << (2 * shift)
+    return code
+
+
+def _codes(values, labels):
+    """Indices des valeurs dans la table ``labels`` (complétée des valeurs hors choix)"""
+    codes = {label: code for code, label in enumerate(labels)}
+    for value in sorted(set(values) - codes.keys()):
+        codes[value] = len(codes)
+    return [codes[value] for value in values], list(codes)
+
+
+def _deltas(values):
+    return [value - previous for previous, value in zip((0, *values), values)]
+
+
+def build_columns(rows, truncated=False, precision=None):
+    """Charge utile en colonnes (voir la docstring du module)"""
+    precision = map_setting('PRECISION') if precision is None else precision
+    scale = 10 ** precision
+    columns = [(), (), (), (), (), ()]
+    if rows:
+        ids, latitudes, longitudes, categories, statuses, votes = zip(*rows)
+        latitudes = [round(latitude * scale) for latitude in latitudes]
+        longitudes = [round(longitude * scale) for longitude in longitudes]
+        # Tri Z-order sur une grille ramenée à _MORTON_BITS bits par axe
+        min_lat, min_lng = min(latitudes), min(longitudes)
+        span = max(max(latitudes) - min_lat, max(longitudes) - min_lng)
+        shift = max(span.bit_length() - _MORTON_BITS, 0)
+        keys = [
+            _morton((longitude - min_lng) >> shift, (latitude - min_lat) >> shift)
+            for latitude, longitude in zip(latitudes, longitudes)
+        ]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        columns = [
+            [column[index] for index in order]
+            for column in (ids, latitudes, longitudes, categories, statuses, votes)
+        ]
+    ids, latitudes, longitudes, categories, statuses, votes = columns
+    category_codes, category_labels = _codes(categories, Idea.CATEGORIES.values)
+    status_codes, status_labels = _codes(statuses, Idea.STATUS.values)
+    return {
+        'count': len(ids),
+        'truncated': truncated,
+        'precision': precision,
+        'categories': category_labels,
+        'statuses': status_labels,
+        'id': _deltas(ids),
+        'lat': _deltas(latitudes),
+        'lng': _deltas(longitudes),
+        'category': category_codes,
+        'status': status_codes,
+        'votes': list(votes),
+    }
+
+
+def _varints(values, out):
+    """Ajoute des entiers signés en varints zigzag (LEB128)"""
+    for value in values:
+        value = (value << 1) ^ (value >> 63)
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def _labels(labels, out):
+    out.append(len(labels))
+    for label in labels:
+        encoded = label.encode()
+        out.append(len(encoded))
+        out += encoded
+
+
+def encode_binary(payload):
+    """Variante binaire d'une charge utile en colonnes"""
+    out = bytearray(HEADER.pack(MAGIC, VERSION, payload['precision'], payload['count'], payload['truncated']))
+    _labels(payload['categories'], out)
+    _labels(payload['statuses'], out)
+    for column in ('id', 'lat', 'lng'):
+        _varints(payload[column], out)
+    out += bytes(payload['category'])
+    out += bytes(payload['status'])
+    _varints(payload['votes'], out)
+    return bytes(out)
+
+
+class MapBinaryRenderer(BaseRenderer):
+    """Rendu binaire de la carte (``?format=bin``) ; les erreurs restent en JSON"""
+    media_type = 'application/vnd.ma-rue-ideale.map'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and 'votes' in data:
+            return encode_binary(data)
+        return JSONRenderer().render(data)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_idea_category_alter_idea_latitude_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idea',
+            name='latitude',
+            field=models.DecimalField(decimal_places=20, max_digits=25),
+        ),
+        migrations.AlterField(
+            model_name='idea',
+            name='longitude',
+            field=models.DecimalField(decimal_places=20, max_digits=25),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:38
+
+import math
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+# Copie figée des formules de api/ranking.py à la date de la migration
+def compute_scores(up, down, created_at, now):
+    age_hours = max((now - created_at).total_seconds() / 3600, 0)
+    hot = (up - down) / (age_hours + 2.0) ** 1.5
+    n = up + down
+    if n == 0:
+        wilson = 0.0
+    else:
+        z, p = 1.96, up / n
+        margin = z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)
+        wilson = (p + z * z / (2 * n) - margin) / (1 + z * z / n)
+    controversy = (up + down) ** (min(up, down) / max(up, down)) if up > 0 and down > 0 else 0.0
+    return {'hot_score': hot, 'wilson_score': wilson, 'controversy_score': controversy}
+
+
+def compute_existing_scores(apps, schema_editor):
+    Idea = apps.get_model('api', 'Idea')
+    now = timezone.now()
+    ideas = []
+    for idea in Idea.objects.only('positive_votes', 'negative_votes', 'created_at').iterator():
+        for field, value in compute_scores(idea.positive_votes, idea.negative_votes, idea.created_at, now).items():
+            setattr(idea, field, value)
+        ideas.append(idea)
+    Idea.objects.bulk_update(ideas, ['hot_score', 'wilson_score', 'controversy_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idea',
+            name='controversy_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='idea',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='idea',
+            name='wilson_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['-hot_score', '-id'], name='idea_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['-wilson_score', '-id'], name='idea_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['-controversy_score', '-id'], name='idea_controversial_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['zone', '-hot_score', '-id'], name='idea_zone_hot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['zone', '-wilson_score', '-id'], name='idea_zone_top_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['zone', '-controversy_score', '-id'], name='idea_zone_controversial_idx'),
+        ),
+        migrations.RunPython(compute_existing_scores, migrations.RunPython.noop),
+    ]
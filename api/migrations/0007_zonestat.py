@@ -0,0 +1,89 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def build_zone_stats(apps, schema_editor):
+    Idea = apps.get_model('api', 'Idea')
+    Vote = apps.get_model('api', 'Vote')
+    Comment = apps.get_model('api', 'Comment')
+    ZoneStat = apps.get_model('api', 'ZoneStat')
+
+    comment_counts = dict(Comment.objects.values_list('idea_id').annotate(n=Count('id')).order_by())
+    ideas = []
+    for idea in Idea.objects.only('comment_count').iterator():
+        idea.comment_count = comment_counts.get(idea.pk, 0)
+        ideas.append(idea)
+    Idea.objects.bulk_update(ideas, ['comment_count'], batch_size=500)
+
+    rows = {}
+
+    def row(key):
+        return rows.setdefault(key, {'idea_count': 0, 'positive_votes': 0, 'negative_votes': 0, 'comment_count': 0})
+
+    for item in Idea.objects.values('zone_id', 'category', 'status').annotate(n=Count('id')).order_by():
+        row((item['zone_id'], item['category'], item['status']))['idea_count'] = item['n']
+    votes = (
+        Vote.objects.values('idea__zone_id', 'idea__category', 'idea__status')
+        .annotate(up=Count('id', filter=Q(is_positive=True)), down=Count('id', filter=Q(is_positive=False)))
+        .order_by()
+    )
+    for item in votes:
+        counters = row((item['idea__zone_id'], item['idea__category'], item['idea__status']))
+        counters['positive_votes'] = item['up']
+        counters['negative_votes'] = item['down']
+    comments = Comment.objects.values('idea__zone_id', 'idea__category', 'idea__status').annotate(n=Count('id')).order_by()
+    for item in comments:
+        row((item['idea__zone_id'], item['idea__category'], item['idea__status']))['comment_count'] = item['n']
+
+    ZoneStat.objects.bulk_create(
+        [
+            ZoneStat(zone_id=zone_id, category=category, status=status, **counters)
+            for (zone_id, category, status), counters in rows.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_idea_ranking_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ZoneStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('amenagement', 'Aménagement'), ('environnement', 'Environnement'), ('transport', 'Transport'), ('social', 'Social')])),
+                ('status', models.CharField(choices=[('proposed', 'Proposée'), ('under_review', "En cours d'examen"), ('approved', 'Approuvée'), ('rejected', 'Rejetée'), ('implemented', 'Implémentée')])),
+                ('idea_count', models.IntegerField(default=0)),
+                ('positive_votes', models.IntegerField(default=0)),
+                ('negative_votes', models.IntegerField(default=0)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='idea',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['zone', '-vote_count', '-id'], name='idea_zone_active_idx'),
+        ),
+        migrations.AddField(
+            model_name='zonestat',
+            name='zone',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='api.zone'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='zonestat',
+            unique_together={('zone', 'category', 'status')},
+        ),
+        migrations.RunPython(build_zone_stats, migrations.RunPython.noop),
+    ]
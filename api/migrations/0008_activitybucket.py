@@ -0,0 +1,96 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:43
+
+import django.db.models.deletion
+import django.utils.timezone
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import TruncDay, TruncHour
+
+
+def backfill_comment_vote_dates(apps, schema_editor):
+    # Date inconnue : on retient celle du commentaire voté
+    Comment = apps.get_model('api', 'Comment')
+    CommentVote = apps.get_model('api', 'CommentVote')
+    CommentVote.objects.update(
+        created_at=Subquery(Comment.objects.filter(pk=OuterRef('comment_id')).values('created_at')[:1])
+    )
+
+
+def build_activity_buckets(apps, schema_editor):
+    Idea = apps.get_model('api', 'Idea')
+    Vote = apps.get_model('api', 'Vote')
+    Comment = apps.get_model('api', 'Comment')
+    CommentVote = apps.get_model('api', 'CommentVote')
+    ActivityBucket = apps.get_model('api', 'ActivityBucket')
+
+    now = django.utils.timezone.now()
+    retention = timedelta(days=getattr(settings, 'ACTIVITY_HOURLY_RETENTION_DAYS', 2))
+    cutoff = django.utils.timezone.localtime(now - retention).replace(minute=0, second=0, microsecond=0)
+    sources = [
+        ('ideas', Idea.objects.all(), 'zone_id', 'category'),
+        ('votes', Vote.objects.all(), 'idea__zone_id', 'idea__category'),
+        ('comments', Comment.objects.all(), 'idea__zone_id', 'idea__category'),
+        ('comment_votes', CommentVote.objects.all(), 'comment__idea__zone_id', 'comment__idea__category'),
+    ]
+    rows = {}
+    for field, queryset, zone_field, category_field in sources:
+        for granularity, trunc, subset in (
+            ('day', TruncDay, queryset),
+            ('hour', TruncHour, queryset.filter(created_at__gte=cutoff)),
+        ):
+            grouped = (
+                subset.annotate(bucket=trunc('created_at'))
+                .values('bucket', zone_field, category_field)
+                .annotate(n=Count('id'))
+                .order_by()
+            )
+            for row in grouped:
+                key = (granularity, row['bucket'], row[zone_field], row[category_field])
+                rows.setdefault(key, {})[field] = row['n']
+
+    ActivityBucket.objects.bulk_create(
+        [
+            ActivityBucket(granularity=granularity, bucket_start=bucket_start,
+                           zone_id=zone_id, category=category, **counters)
+            for (granularity, bucket_start, zone_id, category), counters in rows.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_zonestat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commentvote',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='ActivityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Heure'), ('day', 'Jour')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('category', models.CharField(choices=[('amenagement', 'Aménagement'), ('environnement', 'Environnement'), ('transport', 'Transport'), ('social', 'Social')])),
+                ('ideas', models.IntegerField(default=0)),
+                ('votes', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('comment_votes', models.IntegerField(default=0)),
+                ('zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_buckets', to='api.zone')),
+            ],
+            options={
+                'unique_together': {('granularity', 'bucket_start', 'zone', 'category')},
+            },
+        ),
+        migrations.RunPython(backfill_comment_vote_dates, migrations.RunPython.noop),
+        migrations.RunPython(build_activity_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_activitybucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zone',
+            name='geometry',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
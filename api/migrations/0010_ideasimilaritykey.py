@@ -0,0 +1,77 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:48
+
+import hashlib
+import random
+import re
+import unicodedata
+import zlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Copie figée de la signature de api/similarity.py à la date de la migration
+STOP_WORDS = frozenset(
+    'a au aux avec ce ces dans de des du en et il la le les leur mais ne nous '
+    'on ou par pas plus pour qu que qui sa se ses son sur un une vos votre'.split()
+)
+PRIME = (1 << 61) - 1
+_random = random.Random(20250623)
+PERMUTATIONS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(16 * 4)]
+
+
+def shingles(title, description):
+    text = unicodedata.normalize('NFKD', f'{title} {description}').encode('ascii', 'ignore').decode().lower()
+    text = ' '.join(word for word in re.findall(r'[a-z0-9]+', text) if word not in STOP_WORDS)[:1000]
+    if len(text) <= 4:
+        return {text} if text else set()
+    return {text[i:i + 4] for i in range(len(text) - 3)}
+
+
+def minhash(shingle_set):
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingle_set]
+    if not hashes:
+        return []
+    return [min([(a * h + b) % PRIME for h in hashes]) for a, b in PERMUTATIONS]
+
+
+def band_keys(signature):
+    keys = []
+    for band in range(len(signature) // 4):
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(band.to_bytes(2, 'big'))
+        for value in signature[band * 4:(band + 1) * 4]:
+            digest.update(value.to_bytes(8, 'big'))
+        keys.append(int.from_bytes(digest.digest(), 'big', signed=True))
+    return keys
+
+
+def index_existing_ideas(apps, schema_editor):
+    Idea = apps.get_model('api', 'Idea')
+    IdeaSimilarityKey = apps.get_model('api', 'IdeaSimilarityKey')
+    keys = []
+    for pk, title, description in Idea.objects.values_list('pk', 'title', 'description').iterator():
+        keys.extend(
+            IdeaSimilarityKey(idea_id=pk, key=key)
+            for key in band_keys(minhash(shingles(title, description)))
+        )
+    IdeaSimilarityKey.objects.bulk_create(keys, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_zone_geometry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdeaSimilarityKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.BigIntegerField(db_index=True)),
+                ('idea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarity_keys', to='api.idea')),
+            ],
+        ),
+        migrations.RunPython(index_existing_ideas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-19 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_ideasimilaritykey'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-created_at'], name='comment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentvote',
+            index=models.Index(fields=['-created_at'], name='commentvote_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['-created_at'], name='idea_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-date_joined'], name='user_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['-created_at'], name='vote_created_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:01
+
+from django.db import migrations, models
+
+
+def log_existing_objects(apps, schema_editor):
+    ChangeLog = apps.get_model('api', 'ChangeLog')
+    sources = [
+        ('zone', 'Zone', []),
+        ('idea', 'Idea', []),
+        ('comment', 'Comment', ['idea_id']),
+        ('vote', 'Vote', ['idea_id', 'user_id']),
+    ]
+    for kind, model_name, extra in sources:
+        rows = apps.get_model('api', model_name).objects.order_by('pk').values('pk', *extra)
+        ChangeLog.objects.bulk_create(
+            (
+                ChangeLog(kind=kind, object_id=row['pk'], idea_id=row.get('idea_id'), user_id=row.get('user_id'))
+                for row in rows.iterator()
+            ),
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_moderationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('zone', 'Zone'), ('idea', 'Idée'), ('comment', 'Commentaire'), ('vote', 'Vote')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('idea_id', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deleted', 'changed_at'], name='changelog_tombstone_idx')],
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(log_existing_objects, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:10
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_changelog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idea',
+            name='latitude',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AlterField(
+            model_name='idea',
+            name='longitude',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AlterField(
+            model_name='zone',
+            name='latitude',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AlterField(
+            model_name='zone',
+            name='longitude',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['latitude', 'longitude'], name='idea_position_idx'),
+        ),
+    ]
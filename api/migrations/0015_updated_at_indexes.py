@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_float_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['updated_at'], name='comment_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['updated_at'], name='idea_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['zone', 'updated_at'], name='idea_zone_updated_idx'),
+        ),
+    ]
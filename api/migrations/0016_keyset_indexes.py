@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['idea', '-created_at'], name='comment_idea_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['idea', '-created_at'], name='vote_idea_created_idx'),
+        ),
+    ]
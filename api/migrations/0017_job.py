@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:04
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('task', models.CharField(max_length=100)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('state', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('done', 'Terminée'), ('failed', 'Échouée')], default='pending', max_length=10)),
+                ('dedup_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['state', 'run_at'], name='job_ready_idx'), models.Index(fields=['task', '-created_at'], name='job_task_created_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('state', 'pending')), fields=('dedup_key',), name='job_pending_dedup_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_job'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='zone',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='moderationjob',
+            name='action',
+            field=models.CharField(choices=[('status', 'Changement de statut'), ('zone', 'Changement de zone'), ('delete', 'Suppression'), ('purge_zone', "Suppression d'une zone"), ('purge_user', "Suppression d'un utilisateur")], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='user_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='zone',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='zone_deleted_idx'),
+        ),
+    ]
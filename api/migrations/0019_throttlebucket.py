@@ -0,0 +1,20 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleBucket',
+            fields=[
+                ('key', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('full_at', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-19 21:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_heartbeats(apps, schema_editor):
+    # Tâches en cours lors de la migration : leur démarrage tient lieu de signe de vie
+    Job = apps.get_model('api', 'Job')
+    Job.objects.filter(state='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_throttlebucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
+
+from .ranking import compute_scores
+
+LATITUDE_VALIDATORS = [MinValueValidator(-90), MaxValueValidator(90)]
+LONGITUDE_VALIDATORS = [MinValueValidator(-180), MaxValueValidator(180)]
 
 
 class User(AbstractUser):
@@ -11,10 +20,19 @@ class User(AbstractUser):
     is_anonymous = models.BooleanField(default=False) # type: ignore
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Suppression demandée : masqué, données purgées en tâche de fond (api/deletion.py)
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 
+    class Meta(AbstractUser.Meta):
+        swappable = 'AUTH_USER_MODEL'
+        indexes = [
+            models.Index(fields=['-date_joined'], name='user_joined_idx'),
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='user_deleted_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -29,14 +47,30 @@ class Zone(models.Model):
 
     name = models.CharField(max_length=200)
     zone_type = models.CharField(max_length=20, choices=ZONE_TYPES)
-    latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    latitude = models.FloatField(validators=LATITUDE_VALIDATORS)
+    longitude = models.FloatField(validators=LONGITUDE_VALIDATORS)
+    # Contour GeoJSON (Polygon ou MultiPolygon, coordonnées [longitude, latitude])
+    geometry = models.JSONField(null=True, blank=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Suppression demandée : masquée, données purgées en tâche de fond (api/deletion.py)
+    deleted_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='zone_deleted_idx'),
+        ]
+
+    def clean(self):
+        # Import local : api.spatial dépend de ce module
+        from .spatial import validate_geometry
+        if self.geometry is not None:
+            try:
+                validate_geometry(self.geometry)
+            except ValueError as exc:
+                raise ValidationError({'geometry': f'Géométrie GeoJSON invalide : {exc}'})
 
     def __str__(self):
         # Use get_zone_type_display if available, else fallback to zone_type
@@ -67,9 +101,9 @@ class Idea(models.Model):
     category = models.CharField(choices=CATEGORIES)
     status = models.CharField(choices=STATUS, default=STATUS.PROPOSED)
     
-    # Géolocalisation
-    latitude = models.DecimalField(max_digits=25, decimal_places=20)
-    longitude = models.DecimalField(max_digits=25, decimal_places=20)
+    # Géolocalisation (degrés décimaux)
+    latitude = models.FloatField(validators=LATITUDE_VALIDATORS)
+    longitude = models.FloatField(validators=LONGITUDE_VALIDATORS)
     
     # Relations
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ideas')
@@ -83,20 +117,64 @@ class Idea(models.Model):
     vote_count = models.IntegerField(default=0)
     positive_votes = models.IntegerField(default=0)
     negative_votes = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+
+    # Scores de classement précalculés (voir api/ranking.py)
+    hot_score = models.FloatField(default=0)
+    wilson_score = models.FloatField(default=0)
+    controversy_score = models.FloatField(default=0)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-hot_score', '-id'], name='idea_hot_idx'),
+            models.Index(fields=['-wilson_score', '-id'], name='idea_top_idx'),
+            models.Index(fields=['-controversy_score', '-id'], name='idea_controversial_idx'),
+            models.Index(fields=['zone', '-hot_score', '-id'], name='idea_zone_hot_idx'),
+            models.Index(fields=['zone', '-wilson_score', '-id'], name='idea_zone_top_idx'),
+            models.Index(fields=['zone', '-controversy_score', '-id'], name='idea_zone_controversial_idx'),
+            models.Index(fields=['zone', '-vote_count', '-id'], name='idea_zone_active_idx'),
+            models.Index(fields=['-created_at'], name='idea_created_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='idea_position_idx'),
+            # Validateurs des requêtes conditionnelles (api/conditional.py)
+            models.Index(fields=['updated_at'], name='idea_updated_idx'),
+            models.Index(fields=['zone', 'updated_at'], name='idea_zone_updated_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    def refresh_scores(self, now=None):
+        """Recalcule les scores de classement à partir des compteurs de votes"""
+        created_at = self.created_at or timezone.now()
+        for field, value in compute_scores(self.positive_votes, self.negative_votes, created_at, now).items():
+            setattr(self, field, value)
+
     def update_vote_stats(self):
-        """Met à jour les statistiques de vote"""
-        votes = self.votes.all() # type: ignore
-        self.vote_count = votes.count()
-        self.positive_votes = votes.filter(is_positive=True).count()
-        self.negative_votes = votes.filter(is_positive=False).count()
-        self.save()
+        """Recompte les votes de l'idée.
+
+        Les compteurs sont réécrits par un seul ``UPDATE`` à sous-requêtes, qui
+        verrouille la ligne jusqu'à la fin de la transaction : un vote concurrent
+        ne peut pas se glisser entre le comptage et l'écriture.
+        """
+        votes = Vote.objects.filter(idea=OuterRef('pk')).order_by().values('idea')
+
+        def count(**filters):
+            return Coalesce(Subquery(votes.filter(**filters).annotate(n=Count('pk')).values('n')), 0)
+
+        ideas = Idea.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            ideas.update(
+                vote_count=count(), positive_votes=count(is_positive=True), negative_votes=count(is_positive=False),
+            )
+            self.vote_count, self.positive_votes, self.negative_votes = ideas.values_list(
+                'vote_count', 'positive_votes', 'negative_votes'
+            ).get()
+            self.refresh_scores()
+            self.save(update_fields=[
+                'vote_count', 'positive_votes', 'negative_votes',
+                'hot_score', 'wilson_score', 'controversy_score', 'updated_at',
+            ])
 
 class Vote(models.Model):
     """Vote sur une idée"""
@@ -108,6 +186,11 @@ class Vote(models.Model):
     class Meta:
         unique_together = ['idea', 'user']
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='vote_created_idx'),
+            # Votes d'une idée paginés par curseur (/api/ideas/{id}/votes/)
+            models.Index(fields=['idea', '-created_at'], name='vote_idea_created_idx'),
+        ]
 
     def __str__(self):
         vote_type = "positif" if self.is_positive else "négatif"
@@ -126,6 +209,14 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='comment_created_idx'),
+            models.Index(fields=['updated_at'], name='comment_updated_idx'),
+            # Commentaires d'une idée paginés par curseur (/api/ideas/{id}/comments/)
+            models.Index(fields=['idea', '-created_at'], name='comment_idea_created_idx'),
+        ]
+
     def __str__(self):
         return f"Commentaire de {self.user.username} sur {self.idea.title}"
 
@@ -134,10 +225,178 @@ class CommentVote(models.Model):
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name='votes')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comment_votes')
     is_positive = models.BooleanField()  # True = vote positif, False = vote négatif
+    created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ['comment', 'user']
+        indexes = [models.Index(fields=['-created_at'], name='commentvote_created_idx')]
 
     def __str__(self):
         vote_type = "positif" if self.is_positive else "négatif"
         return f"Vote {vote_type} de {self.user.username} sur {self.comment.idea.title}"
+
+class ZoneStat(models.Model):
+    """Agrégat matérialisé des idées d'une zone, par catégorie et statut"""
+    zone = models.ForeignKey(Zone, on_delete=models.CASCADE, related_name='stats')
+    category = models.CharField(choices=Idea.CATEGORIES)
+    status = models.CharField(choices=Idea.STATUS)
+    idea_count = models.IntegerField(default=0)
+    positive_votes = models.IntegerField(default=0)
+    negative_votes = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['zone', 'category', 'status']
+
+    def __str__(self):
+        return f"{self.zone_id} / {self.category} / {self.status}"
+
+class ActivityBucket(models.Model):
+    """Compteurs d'activité par tranche de temps, zone et catégorie"""
+    class GRANULARITY(models.TextChoices):
+        HOUR = 'hour', 'Heure'
+        DAY = 'day', 'Jour'
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY)
+    bucket_start = models.DateTimeField()
+    zone = models.ForeignKey(Zone, on_delete=models.CASCADE, related_name='activity_buckets')
+    category = models.CharField(choices=Idea.CATEGORIES)
+    ideas = models.IntegerField(default=0)
+    votes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    comment_votes = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['granularity', 'bucket_start', 'zone', 'category']
+
+    def __str__(self):
+        return f"{self.granularity} {self.bucket_start:%Y-%m-%d %H:%M} / {self.zone_id} / {self.category}"
+
+class IdeaSimilarityKey(models.Model):
+    """Clé LSH d'une bande de la signature MinHash d'une idée (voir api/similarity.py)"""
+    idea = models.ForeignKey(Idea, on_delete=models.CASCADE, related_name='similarity_keys')
+    key = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"{self.idea_id} / {self.key}"
+
+class ModerationJob(models.Model):
+    """Opération de modération groupée (idées, suppression d'une zone ou d'un utilisateur) et sa progression"""
+    class ACTIONS(models.TextChoices):
+        STATUS = 'status', 'Changement de statut'
+        ZONE = 'zone', 'Changement de zone'
+        DELETE = 'delete', 'Suppression'
+        PURGE_ZONE = 'purge_zone', 'Suppression d\'une zone'
+        PURGE_USER = 'purge_user', 'Suppression d\'un utilisateur'
+
+    class STATES(models.TextChoices):
+        PENDING = 'pending', 'En attente'
+        RUNNING = 'running', 'En cours'
+        DONE = 'done', 'Terminée'
+        FAILED = 'failed', 'Échouée'
+
+    action = models.CharField(max_length=10, choices=ACTIONS)
+    params = models.JSONField(default=dict)
+    state = models.CharField(max_length=10, choices=STATES, default=STATES.PENDING)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    affected = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='moderation_jobs', null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.get_action_display()} ({self.processed}/{self.total})"
+
+class Job(models.Model):
+    """Tâche de fond de la file d'attente en base (voir api/jobs.py)"""
+    class STATES(models.TextChoices):
+        PENDING = 'pending', 'En attente'
+        RUNNING = 'running', 'En cours'
+        DONE = 'done', 'Terminée'
+        FAILED = 'failed', 'Échouée'
+
+    id = models.BigAutoField(primary_key=True)
+    task = models.CharField(max_length=100)
+    params = models.JSONField(default=dict, blank=True)
+    state = models.CharField(max_length=10, choices=STATES, default=STATES.PENDING)
+    # Une seule tâche en attente par clé de déduplication
+    dedup_key = models.CharField(max_length=255, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Exécution au plus tôt (planification, délai avant nouvelle tentative)
+    run_at = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Dernier signe de vie du worker pendant l'exécution (tâches abandonnées)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['state', 'run_at'], name='job_ready_idx'),
+            models.Index(fields=['task', '-created_at'], name='job_task_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(state='pending'), name='job_pending_dedup_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.get_state_display()})"
+
+class ChangeLog(models.Model):
+    """Dernière modification connue d'un objet synchronisé (voir api/changelog.py)"""
+    class KINDS(models.TextChoices):
+        ZONE = 'zone', 'Zone'
+        IDEA = 'idea', 'Idée'
+        COMMENT = 'comment', 'Commentaire'
+        VOTE = 'vote', 'Vote'
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.BigIntegerField()
+    # Idée parente (commentaires, votes) et propriétaire (votes, synchronisés pour lui seul)
+    idea_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+    user_id = models.BigIntegerField(null=True, blank=True)
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['kind', 'object_id']
+        indexes = [models.Index(fields=['deleted', 'changed_at'], name='changelog_tombstone_idx')]
+
+    def __str__(self):
+        action = 'suppression' if self.deleted else 'modification'
+        return f"{self.kind} {self.object_id} ({action})"
+
+class RevokedToken(models.Model):
+    """Jeton JWT révoqué (déconnexion, rotation)"""
+    jti = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='revoked_tokens', null=True, blank=True)
+    token_type = models.CharField(max_length=20)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.token_type} {self.jti}"
+
+
+class ThrottleBucket(models.Model):
+    """Seau à jetons d'un client pour une portée de limitation (voir api/throttling.py)"""
+    key = models.CharField(max_length=255, primary_key=True)
+    # Instant théorique (timestamp) auquel le seau sera de nouveau plein
+    full_at = models.FloatField()
+
+    def __str__(self):
+        return self.key
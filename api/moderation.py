@@ -0,0 +1,286 @@
+"""Modération groupée des idées.
+
+Les changements de statut, de zone et les suppressions portant sur de
+nombreuses idées sont appliqués par lots de ``CHUNK_SIZE`` avec des
+``UPDATE``/``DELETE`` ensemblistes, sans charger ni sauvegarder chaque idée.
+Les suppressions sont des ``DELETE`` SQL directs, enfants avant parents, qui
+ne passent ni par le collecteur de Django ni par les signaux : chaque lot
+retire lui-même sa contribution de ``ZoneStat`` et ``ActivityBucket``,
+recalcule les compteurs des idées touchées et consigne ses modifications
+dans le journal de synchronisation, comme le font les récepteurs de
+``api/signals.py`` ; les cartes de chaleur en cache sont périmées après
+chaque lot. Les opérations sont exécutées en tâche de fond (``run_worker``)
+et leur progression est enregistrée dans ``ModerationJob`` après chaque lot
+(validé séparément).
+
+Les purges de zones et d'utilisateurs (voir ``api/deletion.py``) suivent le
+même principe : leurs votes de commentaires, votes, commentaires puis idées
+sont supprimés par lots, les compteurs des idées des autres utilisateurs
+recalculés pour chaque lot, puis le sujet lui-même est supprimé.
+"""
+from django.db import connections, router, transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import activity, changelog, heatmap, jobs, stats, votes
+from .models import Comment, CommentVote, Idea, IdeaSimilarityKey, ModerationJob, User, Vote, Zone
+
+# Nombre d'idées traitées par transaction
+CHUNK_SIZE = 500
+
+# Suppressions d'utilisateurs et de zones (voir api/deletion.py)
+PURGE_ACTIONS = (ModerationJob.ACTIONS.PURGE_ZONE, ModerationJob.ACTIONS.PURGE_USER)
+
+# Filtres acceptés pour désigner les idées concernées
+SELECTION_FILTERS = {
+    'category': 'category',
+    'status': 'status',
+    'zone': 'zone_id',
+    'author': 'author_id',
+}
+
+
+def selection(params):
+    """Idées désignées par les paramètres d'une opération (``ids`` et/ou ``filters``)"""
+    ideas = Idea.objects.all()
+    if params.get('ids') is not None:
+        ideas = ideas.filter(pk__in=params['ids'])
+    for name, value in (params.get('filters') or {}).items():
+        ideas = ideas.filter(**{SELECTION_FILTERS[name]: value})
+    return ideas
+
+
+def _delete_rows(model, column, values, subquery=None):
+    """``DELETE`` direct des lignes de ``model`` dont ``column`` est dans ``values`` ; retourne leur nombre.
+
+    Avec ``subquery`` (modèle parent, colonne), ``values`` filtre cette colonne
+    du parent et ``column`` est la clé étrangère de ``model`` vers ce parent.
+    """
+    using = router.db_for_write(model)
+    quote = connections[using].ops.quote_name
+    placeholders = ', '.join(['%s'] * len(values))
+    if subquery is not None:
+        parent, parent_column = subquery
+        placeholders = (
+            f'SELECT {quote(parent._meta.pk.column)} FROM {quote(parent._meta.db_table)} '
+            f'WHERE {quote(parent_column)} IN ({placeholders})'
+        )
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({placeholders})',
+            list(values),
+        )
+        return cursor.rowcount
+
+
+def _negate(counters):
+    return {field: -value for field, value in counters.items()}
+
+
+def change_status(idea_ids, status):
+    """Change le statut d'un lot d'idées ; retourne le nombre d'idées modifiées"""
+    ideas = Idea.objects.filter(pk__in=idea_ids).exclude(status=status)
+    changed_ids = list(ideas.values_list('pk', flat=True))
+    if not changed_ids:
+        return 0
+    rows = stats.grouped_counters(ideas)
+    changed = Idea.objects.filter(pk__in=changed_ids).update(status=status, updated_at=timezone.now())
+    for (zone_id, category, previous), counters in rows.items():
+        stats.apply_delta(zone_id, category, previous, **_negate(counters))
+        stats.apply_delta(zone_id, category, status, **counters)
+    changelog.record_many(changelog.IDEA, changed_ids)
+    return changed
+
+
+def change_zone(idea_ids, zone_id):
+    """Déplace un lot d'idées (et leur activité) vers une autre zone"""
+    ideas = Idea.objects.filter(pk__in=idea_ids).exclude(zone_id=zone_id)
+    moved_ids = list(ideas.values_list('pk', flat=True))
+    if not moved_ids:
+        return 0
+    rows = stats.grouped_counters(ideas)
+    buckets = activity.compute_rows(idea_ids=moved_ids)
+    changed = Idea.objects.filter(pk__in=moved_ids).update(zone_id=zone_id, updated_at=timezone.now())
+    for (previous, category, status), counters in rows.items():
+        stats.apply_delta(previous, category, status, **_negate(counters))
+        stats.apply_delta(zone_id, category, status, **counters)
+    activity.apply_rows(buckets, sign=-1)
+    activity.apply_rows(buckets, zone_id=zone_id)
+    changelog.record_many(changelog.IDEA, moved_ids)
+    return changed
+
+
+def delete_ideas(idea_ids):
+    """Supprime un lot d'idées et leurs dépendances sans passer par le collecteur"""
+    ideas = Idea.objects.filter(pk__in=idea_ids)
+    rows = stats.grouped_counters(ideas)
+    buckets = activity.compute_rows(idea_ids=idea_ids)
+    # Enfants d'abord : les DELETE directs ne gèrent pas la cascade
+    _delete_rows(CommentVote, 'comment_id', idea_ids, subquery=(Comment, 'idea_id'))
+    _delete_rows(Comment, 'idea_id', idea_ids)
+    _delete_rows(Vote, 'idea_id', idea_ids)
+    _delete_rows(IdeaSimilarityKey, 'idea_id', idea_ids)
+    deleted = _delete_rows(Idea, 'id', idea_ids)
+    for key, counters in rows.items():
+        stats.apply_delta(*key, **_negate(counters))
+    activity.apply_rows(buckets, sign=-1)
+    changelog.forget_children(idea_ids)
+    changelog.record_many(changelog.IDEA, idea_ids, deleted=True)
+    return deleted
+
+
+def delete_comment_votes(vote_ids):
+    """Supprime un lot de votes de commentaires"""
+    comment_votes = CommentVote.objects.filter(pk__in=vote_ids)
+    idea_ids = list(Idea.objects.filter(comments__votes__in=vote_ids).values_list('pk', flat=True).distinct())
+    buckets = activity.count_rows('comment_votes', comment_votes)
+    deleted = _delete_rows(CommentVote, 'id', vote_ids)
+    activity.apply_rows(buckets, sign=-1)
+    # Votes affichés avec les commentaires des idées
+    Idea.objects.filter(pk__in=idea_ids).update(updated_at=timezone.now())
+    changelog.record_many(changelog.IDEA, idea_ids)
+    return deleted
+
+
+def delete_votes(vote_ids):
+    """Supprime un lot de votes et recalcule les compteurs des idées concernées"""
+    idea_votes = Vote.objects.filter(pk__in=vote_ids)
+    rows = list(idea_votes.values_list('pk', 'idea_id', 'user_id'))
+    counters = list(
+        idea_votes.values('idea__zone_id', 'idea__category', 'idea__status')
+        .annotate(up=Count('id', filter=Q(is_positive=True)), down=Count('id', filter=Q(is_positive=False)))
+        .order_by()
+    )
+    buckets = activity.count_rows('votes', idea_votes)
+    deleted = _delete_rows(Vote, 'id', vote_ids)
+    for row in counters:
+        stats.apply_delta(
+            row['idea__zone_id'], row['idea__category'], row['idea__status'],
+            positive_votes=-row['up'], negative_votes=-row['down'],
+        )
+    activity.apply_rows(buckets, sign=-1)
+    votes.recount(Idea.objects.filter(pk__in={idea_id for _, idea_id, _ in rows}))
+    changelog.record_many(
+        changelog.VOTE, [pk for pk, _, _ in rows], deleted=True,
+        idea_ids={pk: idea_id for pk, idea_id, _ in rows}, user_ids={pk: user_id for pk, _, user_id in rows},
+    )
+    return deleted
+
+
+def delete_comments(comment_ids):
+    """Supprime un lot de commentaires (et leurs votes) et recalcule le nombre de commentaires des idées"""
+    comments = Comment.objects.filter(pk__in=comment_ids)
+    rows = list(comments.values_list('pk', 'idea_id'))
+    counters = list(
+        comments.values('idea__zone_id', 'idea__category', 'idea__status').annotate(n=Count('id')).order_by()
+    )
+    comment_votes = CommentVote.objects.filter(comment_id__in=comment_ids)
+    buckets = activity.count_rows('comments', comments)
+    activity.count_rows('comment_votes', comment_votes, buckets)
+    _delete_rows(CommentVote, 'comment_id', comment_ids)
+    deleted = _delete_rows(Comment, 'id', comment_ids)
+    for row in counters:
+        stats.apply_delta(row['idea__zone_id'], row['idea__category'], row['idea__status'], comment_count=-row['n'])
+    activity.apply_rows(buckets, sign=-1)
+    idea_ids = {idea_id for _, idea_id in rows}
+    remaining = (
+        Comment.objects.filter(idea=OuterRef('pk')).order_by()
+        .values('idea').annotate(n=Count('id')).values('n')
+    )
+    Idea.objects.filter(pk__in=idea_ids).update(
+        comment_count=Coalesce(Subquery(remaining), 0), updated_at=timezone.now()
+    )
+    changelog.record_many(changelog.COMMENT, [pk for pk, _ in rows], deleted=True, idea_ids=dict(rows))
+    changelog.record_many(changelog.IDEA, idea_ids)
+    return deleted
+
+
+def purge_steps(job):
+    """Étapes d'une purge : (lignes restantes, suppression d'un lot), enfants d'abord"""
+    if job.action == ModerationJob.ACTIONS.PURGE_ZONE:
+        return [(Idea.objects.filter(zone_id=job.params['zone']), delete_ideas)]
+    user_id = job.params['user']
+    return [
+        (CommentVote.objects.filter(user_id=user_id), delete_comment_votes),
+        (Vote.objects.filter(user_id=user_id), delete_votes),
+        (Comment.objects.filter(user_id=user_id), delete_comments),
+        (Idea.objects.filter(author_id=user_id), delete_ideas),
+    ]
+
+
+def purge_subject(job):
+    """Supprime le sujet d'une purge, une fois ses données supprimées par lots"""
+    if job.action == ModerationJob.ACTIONS.PURGE_ZONE:
+        Zone.objects.filter(pk=job.params['zone']).delete()
+    else:
+        User.objects.filter(pk=job.params['user']).delete()
+
+
+def purge(job, chunk_size=CHUNK_SIZE):
+    """Purge un utilisateur ou une zone lot par lot (reprend là où une exécution précédente s'est arrêtée)"""
+    steps = purge_steps(job)
+    job.total = job.processed + sum(rows.count() for rows, _ in steps)
+    job.save(update_fields=['total'])
+    for rows, delete_chunk in steps:
+        while True:
+            chunk = list(rows.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not chunk:
+                break
+            with transaction.atomic():
+                job.affected += delete_chunk(chunk)
+                job.processed += len(chunk)
+                job.save(update_fields=['processed', 'affected'])
+                transaction.on_commit(heatmap.invalidate)
+    with transaction.atomic():
+        purge_subject(job)
+
+
+def apply_chunk(action, idea_ids, params):
+    if action == ModerationJob.ACTIONS.STATUS:
+        return change_status(idea_ids, params['status'])
+    if action == ModerationJob.ACTIONS.ZONE:
+        return change_zone(idea_ids, params['zone'])
+    return delete_ideas(idea_ids)
+
+
+def moderate(job, chunk_size=CHUNK_SIZE):
+    """Applique une opération aux idées sélectionnées, lot par lot"""
+    idea_ids = list(selection(job.params).order_by('pk').values_list('pk', flat=True))
+    job.total = len(idea_ids)
+    job.save(update_fields=['total'])
+    for start in range(0, len(idea_ids), chunk_size):
+        chunk = idea_ids[start:start + chunk_size]
+        with transaction.atomic():
+            job.affected += apply_chunk(job.action, chunk, job.params)
+            job.processed += len(chunk)
+            job.save(update_fields=['processed', 'affected'])
+            transaction.on_commit(heatmap.invalidate)
+
+
+def run(job, chunk_size=CHUNK_SIZE):
+    """Exécute une opération lot par lot en enregistrant sa progression"""
+    job.state = ModerationJob.STATES.RUNNING
+    job.save(update_fields=['state'])
+    try:
+        if job.action in PURGE_ACTIONS:
+            purge(job, chunk_size)
+        else:
+            moderate(job, chunk_size)
+    except Exception as exc:
+        job.state = ModerationJob.STATES.FAILED
+        job.error = str(exc)
+    else:
+        job.state = ModerationJob.STATES.DONE
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['state', 'error', 'finished_at'])
+    return job
+
+
+def start(action, params, user=None):
+    """Crée une opération de modération groupée et la met en file (exécutée par ``run_worker``)"""
+    with transaction.atomic():
+        job = ModerationJob.objects.create(action=action, params=params, created_by=user)
+        jobs.enqueue('moderation', {'moderation_job': job.pk})
+    return job
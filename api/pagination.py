@@ -0,0 +1,125 @@
+"""Pagination des grandes tables.
+
+``CachedCountPaginator`` mémorise le nombre total de résultats d'une requête
+dans le cache par défaut pendant ``PAGINATION_COUNT_CACHE_TIMEOUT`` secondes :
+le ``COUNT(*)`` d'une table volumineuse n'est exécuté qu'une fois par période
+et par combinaison de filtres, pas à chaque page affichée.
+
+``CountlessPageNumberPagination`` (pagination de l'API) lit ``page_size + 1``
+lignes pour savoir s'il existe une page suivante, sans ``COUNT(*)``. Le total
+est lu dans des compteurs maintenus quand la vue en fournit
+(``paginated_count``), sinon dans le cache ci-dessus ; ``?count=false`` le
+supprime (``count`` vaut alors ``null``).
+
+``KeysetPagination`` pagine par curseur (``created_at`` décroissant) les
+sous-ressources d'une idée (votes, commentaires) : chaque page est lue sur
+l'index ``(idea, created_at)`` quelle que soit sa profondeur.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def count_cache_timeout():
+    return getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+
+
+def count_cache_key(queryset):
+    """Clé de cache du nombre de résultats d'un queryset (modèle + SQL + paramètres)"""
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f'{queryset.model._meta.label}|{sql}|{params!r}'.encode()).hexdigest()
+    return f'pagination:count:{digest}'
+
+
+def cached_count(queryset):
+    """Nombre de résultats du queryset, mémorisé dans le cache"""
+    key = count_cache_key(queryset)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, count_cache_timeout())
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator dont le nombre total de résultats est mis en cache"""
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        # Le tri n'influe pas sur le nombre : une seule entrée par jeu de filtres
+        return cached_count(self.object_list.order_by())
+
+
+class CountlessPageNumberPagination(PageNumberPagination):
+    """Pagination par numéro de page sans ``COUNT(*)`` à chaque page"""
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        try:
+            self.number = int(request.query_params.get(self.page_query_param, 1))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_page_message)
+        if self.number < 1:
+            raise NotFound(self.invalid_page_message)
+
+        offset = (self.number - 1) * page_size
+        # Une ligne de plus que la page : existence de la page suivante
+        rows = list(queryset[offset:offset + page_size + 1])
+        if not rows and self.number > 1:
+            raise NotFound(self.invalid_page_message)
+        self.has_next = len(rows) > page_size
+        self.count = self.get_count(queryset, view) if self.wants_count(request) else None
+        return rows[:page_size]
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() not in ('false', '0', 'no')
+
+    def get_count(self, queryset, view):
+        """Total lu dans les compteurs maintenus de la vue, sinon dans le cache"""
+        count = getattr(view, 'paginated_count', lambda queryset: None)(queryset)
+        return cached_count(queryset.order_by()) if count is None else count
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class KeysetPagination(CursorPagination):
+    """Pagination par curseur, du plus récent au plus ancien"""
+    ordering = ('-created_at', '-id')
+
+    def first_page(self, queryset, request, url):
+        """Première page et lien vers la suivante, construit sur ``url`` (réponse d'une autre ressource)"""
+        page = self.paginate_queryset(queryset, request)
+        self.base_url = url
+        return page, self.get_next_link()
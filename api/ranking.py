@@ -0,0 +1,83 @@
+"""Scores de classement des idées.
+
+Les scores sont précalculés dans des colonnes indexées de ``Idea`` :
+
+- ``hot_score`` : score des votes (pour - contre) atténué par l'âge de l'idée,
+  recalculé à chaque vote et périodiquement (commande ``refresh_idea_scores``) ;
+- ``wilson_score`` : borne inférieure de l'intervalle de Wilson sur la
+  proportion de votes positifs (classement « top ») ;
+- ``controversy_score`` : volume de votes pondéré par l'équilibre pour/contre.
+
+Le recalcul périodique ne touche pas ``updated_at`` (les scores ne font pas
+partie des représentations) : il renouvelle la version des scores, lue par
+les validateurs des listes triées par score. La version est conservée dans
+le cache ``ranking``, en base, pour être partagée par le worker et les
+serveurs.
+"""
+import math
+import time
+
+from django.core.cache import caches
+from django.utils import timezone
+
+# Exposant d'atténuation du score « hot » (plus élevé = oubli plus rapide)
+HOT_GRAVITY = 1.5
+# Décalage en heures évitant la division par zéro pour les idées récentes
+HOT_AGE_OFFSET = 2.0
+# Quantile de la loi normale pour un intervalle de confiance à 95 %
+WILSON_Z = 1.96
+
+ORDERINGS = {
+    'hot': ('-hot_score', '-id'),
+    'top': ('-wilson_score', '-id'),
+    'controversial': ('-controversy_score', '-id'),
+    'recent': ('-created_at',),
+}
+
+SCORES_VERSION_KEY = 'ranking:scores-version'
+
+
+def scores_version():
+    """Version des scores recalculés (None avant le premier recalcul)"""
+    return caches['ranking'].get(SCORES_VERSION_KEY)
+
+
+def scores_refreshed():
+    """Périme les listes triées par score (après un recalcul des scores)"""
+    caches['ranking'].set(SCORES_VERSION_KEY, time.time_ns(), None)
+
+
+def hot_score(up, down, created_at, now=None):
+    """Score des votes atténué par l'âge (en heures)"""
+    now = now or timezone.now()
+    age_hours = max((now - created_at).total_seconds() / 3600, 0)
+    return (up - down) / (age_hours + HOT_AGE_OFFSET) ** HOT_GRAVITY
+
+
+def wilson_score(up, down, z=WILSON_Z):
+    """Borne inférieure de Wilson de la proportion de votes positifs"""
+    n = up + down
+    if n == 0:
+        return 0.0
+    p = up / n
+    denominator = 1 + z * z / n
+    centre = p + z * z / (2 * n)
+    margin = z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)
+    return (centre - margin) / denominator
+
+
+def controversy_score(up, down):
+    """Volume de votes pondéré par l'équilibre entre pour et contre"""
+    if up <= 0 or down <= 0:
+        return 0.0
+    balance = min(up, down) / max(up, down)
+    return (up + down) ** balance
+
+
+def compute_scores(up, down, created_at, now=None):
+    """Retourne les trois scores sous forme de dictionnaire de champs"""
+    return {
+        'hot_score': hot_score(up, down, created_at, now),
+        'wilson_score': wilson_score(up, down),
+        'controversy_score': controversy_score(up, down),
+    }
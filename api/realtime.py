@@ -0,0 +1,172 @@
+"""Diffusion en temps réel des votes et commentaires (Server-Sent Events).
+
+Un courtier en mémoire, un par processus, relaie les événements vers les
+abonnés connectés au flux ``/api/stream/``. Les canaux sont ``idea:<id>`` et
+``zone:<id>``.
+
+- Les changements de compteurs (votes, commentaires) d'une idée sont
+  regroupés : au plus une mise à jour par idée et par intervalle
+  ``COALESCE_INTERVAL``. Toutes les idées modifiées pendant l'intervalle
+  sont relues en une seule requête, quel que soit le nombre d'abonnés.
+- Les nouveaux commentaires sont diffusés tels quels, sans relecture.
+
+Les événements sont publiés après validation de la transaction
+(``transaction.on_commit``). Chaque processus ne relaie que les écritures
+qu'il a lui-même traitées.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from .models import Idea
+
+DEFAULTS = {
+    # Intervalle de regroupement des mises à jour de compteurs (secondes)
+    'COALESCE_INTERVAL': 0.25,
+    # Commentaire envoyé aux clients inactifs pour garder la connexion ouverte (secondes)
+    'KEEPALIVE_INTERVAL': 15,
+    # Événements en attente par abonné ; au-delà, les plus anciens sont abandonnés
+    'QUEUE_SIZE': 100,
+}
+
+COUNT_FIELDS = ['id', 'zone_id', 'vote_count', 'positive_votes', 'negative_votes', 'comment_count']
+
+
+def realtime_setting(name):
+    return getattr(settings, 'REALTIME', {}).get(name, DEFAULTS[name])
+
+
+def format_event(event, data):
+    """Message SSE (``event:`` + ``data:`` JSON)"""
+    return f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+
+class Subscription:
+    """File d'événements d'un client, alimentée depuis n'importe quel thread"""
+
+    def __init__(self, channels, loop, maxsize):
+        self.channels = frozenset(channels)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+
+    def push(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # Boucle fermée : le client est parti
+            pass
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    """Courtier publication/abonnement du processus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._pending = set()
+        self._timer = None
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels, asyncio.get_running_loop(), realtime_setting('QUEUE_SIZE'))
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def has_subscribers(self, channel):
+        return channel in self._subscribers
+
+    def publish(self, channels, event, data):
+        """Diffuse un événement une seule fois à chaque abonné de l'un des canaux"""
+        with self._lock:
+            targets = set()
+            for channel in channels:
+                targets.update(self._subscribers.get(channel, ()))
+        if not targets:
+            return
+        message = format_event(event, data)
+        for subscription in targets:
+            subscription.push(message)
+
+    def idea_changed(self, idea_id):
+        """Signale un changement de compteurs (diffusé au prochain regroupement)"""
+        with self._lock:
+            self._pending.add(idea_id)
+            if self._timer is None:
+                self._timer = threading.Timer(realtime_setting('COALESCE_INTERVAL'), self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Relit en une requête les idées modifiées et diffuse leurs compteurs"""
+        with self._lock:
+            idea_ids, self._pending, self._timer = self._pending, set(), None
+            any_zone = any(channel.startswith('zone:') for channel in self._subscribers)
+        if not any_zone:
+            idea_ids = {pk for pk in idea_ids if self.has_subscribers(f'idea:{pk}')}
+        if not idea_ids:
+            return
+        try:
+            rows = list(Idea.objects.filter(pk__in=idea_ids).values(*COUNT_FIELDS))
+        finally:
+            # Thread du minuteur : ne pas laisser de connexion ouverte
+            connection.close()
+        for row in rows:
+            self.publish([f"idea:{row['id']}", f"zone:{row['zone_id']}"], 'counts', row)
+
+
+broker = Broker()
+
+
+def notify_counts(idea_id):
+    """Programme la diffusion des compteurs d'une idée après la transaction"""
+    transaction.on_commit(lambda: broker.idea_changed(idea_id))
+
+
+def notify_comment(comment, zone_id):
+    """Programme la diffusion d'un nouveau commentaire après la transaction"""
+    data = {
+        'id': comment.pk,
+        'idea': comment.idea_id,
+        'user': {'id': comment.user_id, 'username': comment.user.username},
+        'content': comment.content,
+        'created_at': comment.created_at,
+    }
+    channels = [f'idea:{comment.idea_id}', f'zone:{zone_id}']
+    transaction.on_commit(lambda: broker.publish(channels, 'comment', data))
+
+
+async def event_stream(subscription):
+    """Générateur SSE d'un abonné (désabonné à la déconnexion)"""
+    keepalive = realtime_setting('KEEPALIVE_INTERVAL')
+    try:
+        yield f"retry: {int(keepalive * 1000)}\n\n"
+        while True:
+            try:
+                yield await subscription.get(keepalive)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,129 @@
+"""Révocation des jetons JWT.
+
+Les JTI révoqués sont enregistrés durablement dans la table ``RevokedToken``.
+Chaque processus garde en mémoire un filtre de Bloom de ces JTI, rafraîchi
+incrémentalement (uniquement les lignes ajoutées depuis le dernier
+rafraîchissement), ce qui évite une requête SQL à chaque appel authentifié :
+seul un résultat positif du filtre est confirmé en base.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .models import RevokedToken
+
+
+class BloomFilter:
+    """Filtre de Bloom minimal (double hachage sur un digest blake2b)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevokedTokenFilter:
+    """Filtre en mémoire des JTI révoqués, synchronisé avec ``RevokedToken``"""
+
+    def __init__(self, capacity=None, error_rate=None, refresh_interval=None):
+        config = getattr(settings, 'TOKEN_REVOCATION', {})
+        self.initial_capacity = capacity or config.get('FILTER_CAPACITY', 100_000)
+        self.error_rate = error_rate or config.get('FILTER_ERROR_RATE', 0.001)
+        self.refresh_interval = (
+            refresh_interval if refresh_interval is not None
+            else config.get('REFRESH_INTERVAL', 5.0)
+        )
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(self.initial_capacity, self.error_rate)
+        self._last_id = 0
+        self._last_refresh = None
+
+    def refresh(self, force=False):
+        """Charge les JTI révoqués depuis le dernier rafraîchissement"""
+        now = time.monotonic()
+        if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and self._last_refresh is not None and now - self._last_refresh < self.refresh_interval:
+                return
+            rows = list(
+                RevokedToken.objects.filter(id__gt=self._last_id)
+                .order_by('id')
+                .values_list('id', 'jti')
+            )
+            if self._bloom.count + len(rows) > self._bloom.capacity:
+                self._rebuild()
+            else:
+                for row_id, jti in rows:
+                    self._bloom.add(jti)
+                if rows:
+                    self._last_id = rows[-1][0]
+            self._last_refresh = now
+
+    def _rebuild(self):
+        """Reconstruit le filtre à partir des jetons encore valides"""
+        # Borne lue avant la lecture : un JTI révoqué pendant la reconstruction
+        # sera repris par le rafraîchissement suivant
+        last_id = RevokedToken.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        rows = list(
+            RevokedToken.objects.filter(id__lte=last_id, expires_at__gt=timezone.now())
+            .order_by('id')
+            .values_list('id', 'jti')
+        )
+        bloom = BloomFilter(max(self.initial_capacity, 2 * len(rows)), self.error_rate)
+        for row_id, jti in rows:
+            bloom.add(jti)
+        self._bloom = bloom
+        self._last_id = last_id
+
+    def add(self, jti):
+        """Ajoute un JTI localement, sans attendre le prochain rafraîchissement"""
+        with self._lock:
+            self._bloom.add(jti)
+
+    def is_revoked(self, jti):
+        """Vérifie si un JTI est révoqué (requête SQL uniquement sur un positif du filtre)"""
+        self.refresh()
+        if jti not in self._bloom:
+            return False
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+
+revoked_tokens = RevokedTokenFilter()
+
+
+def revoke_token(token, user=None):
+    """Révoque durablement un jeton simplejwt (AccessToken ou RefreshToken)"""
+    jti = token[jwt_settings.JTI_CLAIM]
+    RevokedToken.objects.get_or_create(
+        jti=jti,
+        defaults={
+            'user': user,
+            'token_type': token.get(jwt_settings.TOKEN_TYPE_CLAIM, ''),
+            'expires_at': datetime_from_epoch(token['exp']),
+        }
+    )
+    revoked_tokens.add(jti)
@@ -1,5 +1,33 @@
+from django.db.models import Count, F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
-from .models import User, Zone, Idea, Vote, Comment, CommentVote
+from rest_framework.reverse import reverse
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .fragments import FragmentCacheMixin, FragmentListSerializer
+from .hashing import password_hashing
+from .models import User, Zone, Idea, Vote, Comment, CommentVote, ModerationJob
+from .moderation import PURGE_ACTIONS, SELECTION_FILTERS
+from .pagination import KeysetPagination
+from .revocation import revoke_token, revoked_tokens
+from .spatial import coordinate_precision, locate_zone, validate_geometry
+
+
+class CoordinateField(serializers.FloatField):
+    """Coordonnée en degrés décimaux, arrondie à ``COORDINATE_PRECISION`` décimales"""
+
+    def to_representation(self, value):
+        return round(value, coordinate_precision())
+
+
+def position(obj):
+    """Position ``{lat, lng}`` d'une idée"""
+    precision = coordinate_precision()
+    return {
+        'lat': round(obj.latitude, precision),
+        'lng': round(obj.longitude, precision)
+    }
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -10,6 +38,15 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Sérialiseur minimal des utilisateurs référencés (section ``included``)"""
+    name = serializers.CharField(source='get_full_name', read_only=True)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'name']
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """Sérialiseur pour l'inscription des utilisateurs"""
     password = serializers.CharField(write_only=True)
@@ -26,12 +63,77 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data.pop('password_confirm')
-        user = User.objects.create_user(**validated_data)
+        password = validated_data.pop('password')
+        # Même normalisation que create_user, mais hachage dans le pool borné
+        user = User(**validated_data)
+        user.username = User.normalize_username(user.username)
+        user.email = User.objects.normalize_email(user.email)
+        user.password = password_hashing.make_password(password)
+        user.save()
         return user
 
-class ZoneSerializer(serializers.ModelSerializer):
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """Sérialiseur de rafraîchissement refusant les jetons révoqués"""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if revoked_tokens.is_revoked(refresh[jwt_settings.JTI_CLAIM]):
+            raise InvalidToken({'detail': 'Ce jeton a été révoqué', 'code': 'token_revoked'})
+        data = super().validate(attrs)
+        if jwt_settings.ROTATE_REFRESH_TOKENS and jwt_settings.BLACKLIST_AFTER_ROTATION:
+            # L'ancien jeton de rafraîchissement ne doit plus être utilisable
+            revoke_token(refresh)
+        return data
+
+
+def attach_idea_counts(zones):
+    """Renseigne en une requête le nombre d'idées de zones (lu par ZoneSerializer)"""
+    zones = [zone for zone in zones if zone is not None]
+    counts = dict(
+        Idea.objects.filter(zone__in={zone.pk for zone in zones})
+        .values_list('zone_id').annotate(n=Count('id')).order_by()
+    )
+    for zone in zones:
+        zone._idea_count = counts.get(zone.pk, 0)
+
+
+# Commentaires les plus récents repris dans chaque idée d'une liste (les suivants : /api/ideas/{id}/comments/)
+LIST_COMMENTS = 3
+
+
+def attach_recent_comments(ideas, limit=LIST_COMMENTS):
+    """Renseigne ``recent_comments`` (les ``limit`` plus récents, avec le décompte de leurs votes) en deux requêtes"""
+    ideas = [idea for idea in ideas if not hasattr(idea, 'recent_comments')]
+    if not ideas:
+        return
+    ranked = Comment.objects.select_related('user').annotate(rank=Window(
+        RowNumber(), partition_by=F('idea_id'), order_by=(F('created_at').desc(), F('id').desc()),
+    )).filter(rank__lte=limit).order_by('-created_at', '-id')
+    prefetch_related_objects(ideas, Prefetch('comments', queryset=ranked, to_attr='recent_comments'))
+    attach_comment_vote_stats(comment for idea in ideas for comment in idea.recent_comments)
+
+
+def attach_comment_vote_stats(comments):
+    """Renseigne en une requête le décompte des votes de commentaires (lu par CommentSummarySerializer)"""
+    comments = list(comments)
+    counts = {}
+    rows = (
+        CommentVote.objects.filter(comment__in=[comment.pk for comment in comments])
+        .values_list('comment_id', 'is_positive').annotate(n=Count('id')).order_by()
+    )
+    for comment_id, is_positive, n in rows:
+        counts[comment_id, is_positive] = n
+    for comment in comments:
+        up, down = counts.get((comment.pk, True), 0), counts.get((comment.pk, False), 0)
+        comment._vote_stats = {'total': up + down, 'up': up, 'down': down}
+
+
+class ZoneSerializer(FragmentCacheMixin, serializers.ModelSerializer):
     """Sérialiseur pour les zones géographiques"""
+    fragment_volatile = ('idea_count',)
     zone_type_display = serializers.CharField(source='get_zone_type_display', read_only=True)
+    latitude = CoordinateField(min_value=-90, max_value=90)
+    longitude = CoordinateField(min_value=-180, max_value=180)
     idea_count = serializers.SerializerMethodField()
 
     class Meta:
@@ -39,9 +141,31 @@ class ZoneSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'zone_type', 'zone_type_display', 'latitude', 'longitude', 
                  'description', 'created_at', 'idea_count']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = FragmentListSerializer
+
+    def prepare_volatile(self, zones):
+        attach_idea_counts(zone for zone in zones if not hasattr(zone, '_idea_count'))
 
     def get_idea_count(self, obj):
-        return obj.ideas.count()
+        # Valeur précalculée pour un ensemble de zones (voir attach_idea_counts)
+        count = getattr(obj, '_idea_count', None)
+        return obj.ideas.count() if count is None else count
+
+
+class ZoneDetailSerializer(ZoneSerializer):
+    """Sérialiseur des zones avec leur contour géographique"""
+
+    class Meta(ZoneSerializer.Meta):
+        fields = ZoneSerializer.Meta.fields + ['geometry']
+
+    def validate_geometry(self, value):
+        if value is None:
+            return value
+        try:
+            validate_geometry(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(f"Géométrie GeoJSON invalide : {exc}")
+        return value
 
 
 class VoteSerializer(serializers.ModelSerializer):
@@ -80,9 +204,27 @@ class CommentVoteSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user']
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class MyVoteMixin:
+    """Champ ``my_vote`` lu dans les votes préchargés du contexte (``my_votes``).
+
+    Sans votes préchargés (utilisateur anonyme), ``my_vote`` vaut ``None``
+    sans aucune requête.
+    """
+    my_vote_kind = None
+
+    def get_my_vote(self, obj):
+        """Vote de l'utilisateur connecté sur cet objet"""
+        votes = self.context.get('my_votes')
+        if votes is None:
+            return None
+        return votes[self.my_vote_kind].get(obj.pk)
+
+
+class CommentSerializer(MyVoteMixin, serializers.ModelSerializer):
     """Sérialiseur pour les commentaires"""
+    my_vote_kind = 'comments'
     user = serializers.SerializerMethodField()
+    my_vote = serializers.SerializerMethodField()
     votes = CommentVoteSerializer(many=True, read_only=True)
 
     def get_user(self, obj: Comment):
@@ -96,22 +238,22 @@ class CommentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Comment
         fields = ['id', 'idea', 'user', 'content', 
-                 'created_at', 'updated_at', 'votes']
+                 'created_at', 'updated_at', 'votes', 'my_vote']
         read_only_fields = ['id', 'user', 'created_at', 'updated_at', 'votes']
 
-    def get_user_vote(self, obj):
-        """Récupère le vote de l'utilisateur connecté sur ce commentaire"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                vote = obj.votes.get(user=request.user)
-                return {
-                    'id': vote.id,
-                    'is_positive': vote.is_positive
-                }
-            except CommentVote.DoesNotExist:
-                return None
-        return None
+
+class CommentSummarySerializer(CommentSerializer):
+    """Sérialiseur des commentaires avec le décompte de leurs votes (sans la liste des votes)"""
+    votesStats = serializers.SerializerMethodField()
+
+    def get_votesStats(self, obj: Comment):
+        # Valeur précalculée pour une page de commentaires (voir attach_comment_vote_stats)
+        if not hasattr(obj, '_vote_stats'):
+            attach_comment_vote_stats([obj])
+        return obj._vote_stats
+
+    class Meta(CommentSerializer.Meta):
+        fields = ['id', 'idea', 'user', 'content', 'created_at', 'updated_at', 'votesStats', 'my_vote']
 
 
 class CommentCreateSerializer(serializers.ModelSerializer):
@@ -126,13 +268,20 @@ class CommentCreateSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class IdeaSerializer(serializers.ModelSerializer):
-    """Sérialiseur pour les idées"""
-    votes = VoteSerializer(many=True, read_only=True)
-    comments = CommentSerializer(many=True, read_only=True)
+class IdeaSerializer(MyVoteMixin, serializers.ModelSerializer):
+    """Sérialiseur du détail des idées : statistiques et première page de commentaires.
+
+    Les votes et les commentaires suivants sont paginés par curseur
+    (``/api/ideas/{id}/votes/``, ``/api/ideas/{id}/comments/``) : la taille
+    de la réponse ne dépend pas de la popularité de l'idée.
+    """
+    my_vote_kind = 'ideas'
+    comments = serializers.SerializerMethodField()
+    comments_next = serializers.SerializerMethodField()
     position = serializers.SerializerMethodField()
     votesStats = serializers.SerializerMethodField()
     author = serializers.SerializerMethodField()
+    my_vote = serializers.SerializerMethodField()
     zone = ZoneSerializer(read_only=True)
 
     def get_author(self, obj: Idea):
@@ -143,10 +292,7 @@ class IdeaSerializer(serializers.ModelSerializer):
         }
 
     def get_position(self, obj : Idea):
-        return {
-            'lat': obj.latitude,
-            'lng': obj.longitude
-        }
+        return position(obj)
     
     def get_votesStats(self, obj: Idea):
         """Récupère les statistiques de vote pour l'idée"""
@@ -156,12 +302,30 @@ class IdeaSerializer(serializers.ModelSerializer):
             'down': obj.negative_votes
         }
 
+    def comment_page(self, obj: Idea):
+        """Première page des commentaires et lien vers la suivante (lus une fois par idée)"""
+        if not hasattr(obj, '_comment_page'):
+            request = self.context['request']
+            url = reverse('idea-comments', args=[obj.pk], request=request)
+            comments, next_link = KeysetPagination().first_page(obj.comments.select_related('user'), request, url)
+            attach_comment_vote_stats(comments)
+            obj._comment_page = comments, next_link
+        return obj._comment_page
+
+    def get_comments(self, obj: Idea):
+        comments, _ = self.comment_page(obj)
+        return CommentSummarySerializer(comments, many=True, context=self.context).data
+
+    def get_comments_next(self, obj: Idea):
+        _, next_link = self.comment_page(obj)
+        return next_link
+
     class Meta:
         model = Idea
         fields = ['id', 'title', 'description', 'category', 'status', 
                 'position', 'author', 'zone', 'created_at', 'votesStats', 
-                'votes', 'comments']
-        read_only_fields = ['id', 'author', 'created_at', 'votes', 'comments']
+                'comment_count', 'comments', 'comments_next', 'my_vote']
+        read_only_fields = ['id', 'author', 'created_at', 'comment_count']
 
 
 class IdeaCreateSerializer(serializers.ModelSerializer):
@@ -169,22 +333,34 @@ class IdeaCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Idea
         fields = ['title', 'description', 'category', 'latitude', 'longitude', 'zone']
+        extra_kwargs = {'zone': {'required': False, 'queryset': Zone.objects.filter(deleted_at__isnull=True)}}
+
+    def validate(self, attrs):
+        # Sans zone explicite, la zone est déduite de la position
+        if not attrs.get('zone'):
+            zone_id = locate_zone(attrs['latitude'], attrs['longitude'])
+            if zone_id is None:
+                raise serializers.ValidationError({'zone': "Aucune zone ne correspond à cette position."})
+            attrs['zone_id'] = zone_id
+        return attrs
 
     def create(self, validated_data):
         validated_data['author'] = self.context['request'].user
         return super().create(validated_data)
 
 
-class IdeaListSerializer(serializers.ModelSerializer):
-    """Sérialiseur simplifié pour la liste des idées"""
+class IdeaListSerializer(FragmentCacheMixin, MyVoteMixin, serializers.ModelSerializer):
+    """Sérialiseur simplifié pour la liste des idées (assemblée à partir de fragments en cache)"""
+    my_vote_kind = 'ideas'
+    # La zone (nombre d'idées) change sans que l'idée soit modifiée : lue dans ses propres fragments
+    fragment_volatile = ('my_vote', 'zone')
     position = serializers.SerializerMethodField()
     author = serializers.SerializerMethodField()
     votesStats = serializers.SerializerMethodField()
+    my_vote = serializers.SerializerMethodField()
     zone = ZoneSerializer(read_only=True)
-    comments = CommentSerializer(many=True, read_only=True)
-
-
-
+    comments = serializers.SerializerMethodField()
+    comment_serializer_class = CommentSummarySerializer
 
     def get_author(self, obj: Idea):
         """Récupère les informations de l'auteur de l'idée"""
@@ -194,10 +370,7 @@ class IdeaListSerializer(serializers.ModelSerializer):
         }
     
     def get_position(self, obj: Idea):
-        return {
-            'lat': obj.latitude,
-            'lng': obj.longitude
-        }
+        return position(obj)
     
     def get_votesStats(self, obj: Idea):
         """Récupère les statistiques de vote pour l'idée"""
@@ -207,8 +380,169 @@ class IdeaListSerializer(serializers.ModelSerializer):
             'down': obj.negative_votes
         }
 
+    def get_comments(self, obj: Idea):
+        """Derniers commentaires de l'idée, avec le décompte de leurs votes"""
+        attach_recent_comments([obj])
+        return self.comment_serializer_class(obj.recent_comments, many=True, context=self.context).data
 
     class Meta:
         model = Idea
         fields = ['id', 'title', 'description', 'category', 'status', 'author', 'position',
-                 'zone','votesStats', 'comments', 'created_at',] 
\ No newline at end of file
+                 'zone','votesStats', 'comment_count', 'comments', 'created_at', 'my_vote']
+        list_serializer_class = FragmentListSerializer
+
+    def prepare_fragments(self, ideas):
+        prefetch_related_objects(ideas, 'author')
+        attach_recent_comments(ideas)
+
+    def prepare_volatile(self, ideas):
+        prefetch_related_objects(ideas, 'zone')
+
+    def personalize(self, data):
+        # Les fragments sont rendus sans les votes de l'utilisateur connecté
+        votes = self.context.get('my_votes')
+        if votes is not None:
+            for comment in data['comments']:
+                comment['my_vote'] = votes['comments'].get(comment['id'])
+
+
+class CommentCompactSerializer(CommentSummarySerializer):
+    """Commentaire dont l'auteur est une simple référence (``user_id``)"""
+    user = None
+
+    class Meta(CommentSummarySerializer.Meta):
+        fields = ['id', 'idea', 'user_id', 'content', 'created_at', 'updated_at', 'votesStats', 'my_vote']
+
+
+class IdeaCompactSerializer(IdeaListSerializer):
+    """Idée d'un document composé : zone et auteurs référencés par identifiant.
+
+    Les objets référencés sont renvoyés une seule fois dans la section
+    ``included`` de la réponse (voir ``api/compound.py``).
+    """
+    fragment_volatile = ('my_vote',)
+    author = None
+    zone = None
+    comment_serializer_class = CommentCompactSerializer
+
+    class Meta(IdeaListSerializer.Meta):
+        fields = ['id', 'title', 'description', 'category', 'status', 'author_id', 'position',
+                  'zone_id', 'votesStats', 'comment_count', 'comments', 'created_at', 'my_vote']
+
+    def prepare_fragments(self, ideas):
+        attach_recent_comments(ideas)
+
+    def prepare_volatile(self, ideas):
+        pass
+
+
+class ZoneSyncSerializer(serializers.ModelSerializer):
+    """Sérialiseur compact des zones pour la synchronisation"""
+    latitude = CoordinateField(read_only=True)
+    longitude = CoordinateField(read_only=True)
+
+    class Meta:
+        model = Zone
+        fields = ['id', 'name', 'zone_type', 'latitude', 'longitude', 'geometry',
+                  'description', 'updated_at']
+
+
+class IdeaSyncSerializer(serializers.ModelSerializer):
+    """Sérialiseur compact des idées pour la synchronisation (sans votes ni commentaires)"""
+    position = serializers.SerializerMethodField()
+    author = serializers.SerializerMethodField()
+    votesStats = serializers.SerializerMethodField()
+
+    def get_author(self, obj: Idea):
+        return {
+            'id': obj.author_id,
+            'username': obj.author.username,
+        }
+
+    def get_position(self, obj: Idea):
+        return position(obj)
+
+    def get_votesStats(self, obj: Idea):
+        return {
+            'total': obj.vote_count,
+            'up': obj.positive_votes,
+            'down': obj.negative_votes
+        }
+
+    class Meta:
+        model = Idea
+        fields = ['id', 'title', 'description', 'category', 'status', 'position', 'author',
+                  'zone', 'votesStats', 'comment_count', 'created_at', 'updated_at']
+
+
+class CommentSyncSerializer(serializers.ModelSerializer):
+    """Sérialiseur compact des commentaires pour la synchronisation"""
+    user = serializers.SerializerMethodField()
+
+    def get_user(self, obj: Comment):
+        return {
+            'id': obj.user_id,
+            'username': obj.user.username,
+        }
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'idea', 'user', 'content', 'created_at', 'updated_at']
+
+
+class VoteSyncSerializer(serializers.ModelSerializer):
+    """Sérialiseur compact des votes de l'utilisateur pour la synchronisation"""
+    class Meta:
+        model = Vote
+        fields = ['id', 'idea', 'is_positive', 'created_at']
+
+
+class ModerationFiltersSerializer(serializers.Serializer):
+    """Filtres de sélection des idées d'une opération de modération"""
+    category = serializers.ChoiceField(choices=Idea.CATEGORIES.choices, required=False)
+    status = serializers.ChoiceField(choices=Idea.STATUS.choices, required=False)
+    zone = serializers.IntegerField(min_value=1, required=False)
+    author = serializers.IntegerField(min_value=1, required=False)
+
+    def to_internal_value(self, data):
+        if isinstance(data, dict):
+            unknown = set(data) - set(SELECTION_FILTERS)
+            if unknown:
+                raise serializers.ValidationError(f"Filtres possibles : {', '.join(SELECTION_FILTERS)}")
+        return dict(super().to_internal_value(data))
+
+
+class ModerationJobSerializer(serializers.ModelSerializer):
+    """Sérialiseur des opérations de modération groupée"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, write_only=True)
+    filters = ModerationFiltersSerializer(required=False, write_only=True)
+    status = serializers.ChoiceField(choices=Idea.STATUS.choices, required=False, write_only=True)
+    zone = serializers.PrimaryKeyRelatedField(
+        queryset=Zone.objects.filter(deleted_at__isnull=True), required=False, write_only=True
+    )
+    # Purges de zones et d'utilisateurs : lancées par leur suppression (api/deletion.py)
+    action = serializers.ChoiceField(choices=[
+        choice for choice in ModerationJob.ACTIONS.choices if choice[0] not in PURGE_ACTIONS
+    ])
+
+    class Meta:
+        model = ModerationJob
+        fields = ['id', 'action', 'ids', 'filters', 'status', 'zone', 'params', 'state',
+                  'total', 'processed', 'affected', 'error', 'created_at', 'finished_at']
+        read_only_fields = ['id', 'params', 'state', 'total', 'processed', 'affected',
+                            'error', 'created_at', 'finished_at']
+
+    def validate(self, attrs):
+        if 'ids' not in attrs and not attrs.get('filters'):
+            raise serializers.ValidationError("Indiquez des identifiants (ids) ou des filtres.")
+        params = {'ids': attrs.get('ids'), 'filters': attrs.get('filters', {})}
+        if attrs['action'] == ModerationJob.ACTIONS.STATUS:
+            if 'status' not in attrs:
+                raise serializers.ValidationError({'status': "Statut requis pour cette action."})
+            params['status'] = attrs['status']
+        elif attrs['action'] == ModerationJob.ACTIONS.ZONE:
+            if 'zone' not in attrs:
+                raise serializers.ValidationError({'zone': "Zone requise pour cette action."})
+            params['zone'] = attrs['zone'].pk
+        return {'action': attrs['action'], 'params': params}
+
@@ -0,0 +1,369 @@
+"""Maintenance incrémentale des compteurs dérivés.
+
+Les idées, votes et commentaires mettent à jour ``Idea.comment_count``, les
+agrégats ``ZoneStat`` et les tranches d'activité ``ActivityBucket`` à chaque
+écriture. Lors d'une suppression en cascade, l'objet parent (idée, zone)
+retire sa contribution en une seule fois : les enfants supprimés avec lui
+sont ignorés.
+
+Les enregistrements d'idées tiennent aussi à jour l'index de similarité
+(``api/similarity.py``) et ceux de zones invalident l'index spatial. Les
+votes et commentaires sont enfin relayés aux flux temps réel
+(``api/realtime.py``) et toutes ces écritures sont consignées dans le journal
+de synchronisation (``api/changelog.py``). Les écritures sur les idées et les
+votes, comme le masquage d'une zone ou d'un auteur supprimé, périment enfin
+les cartes de chaleur en cache (``api/heatmap.py``).
+
+Toute écriture qui change la représentation d'une idée (commentaires, votes
+de commentaires, nom d'un auteur) avance son ``updated_at``, qui versionne
+les fragments sérialisés en cache (``api/fragments.py``).
+"""
+import threading
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import activity, changelog, heatmap, realtime, similarity, spatial, stats
+from .models import Comment, CommentVote, Idea, User, Vote, Zone
+
+_deleting = threading.local()
+
+
+def _deleting_set(name):
+    if not hasattr(_deleting, name):
+        setattr(_deleting, name, set())
+    return getattr(_deleting, name)
+
+
+def is_deleting(model_name, pk):
+    """Indique si l'objet est en cours de suppression (cascade en cours)"""
+    return pk in _deleting_set(model_name)
+
+
+def _idea_key(idea_id):
+    return Idea.objects.filter(pk=idea_id).values_list('zone_id', 'category', 'status').first()
+
+
+# Idées
+
+def _loaded_idea_key(instance):
+    # Lecture via __dict__ : ne pas déclencher le chargement des champs différés
+    values = instance.__dict__
+    if all(name in values for name in ('zone_id', 'category', 'status')):
+        return (values['zone_id'], values['category'], values['status'])
+    return None
+
+
+@receiver(post_init, sender=Idea)
+def remember_idea_key(sender, instance, **kwargs):
+    instance._stats_key = _loaded_idea_key(instance)
+
+
+@receiver(post_save, sender=Idea)
+def update_stats_on_idea_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    key = (instance.zone_id, instance.category, instance.status)
+    previous = instance._stats_key
+    if created:
+        stats.apply_delta(*key, **stats.idea_counters(instance))
+        activity.record(instance.zone_id, instance.category, instance.created_at, ideas=1)
+    elif previous is not None and key != previous:
+        # Changement de zone, catégorie ou statut : la contribution est déplacée
+        counters = stats.idea_counters(instance)
+        stats.apply_delta(*previous, **{field: -value for field, value in counters.items()})
+        stats.apply_delta(*key, **counters)
+        if key[:2] != previous[:2]:
+            contribution = activity.idea_contribution(instance.pk, instance.created_at)
+            activity.apply_contribution(contribution, previous[0], previous[1], sign=-1)
+            activity.apply_contribution(contribution, instance.zone_id, instance.category)
+    instance._stats_key = key
+
+
+@receiver(pre_delete, sender=Idea)
+def mark_idea_deleting(sender, instance, **kwargs):
+    _deleting_set('idea').add(instance.pk)
+    if not is_deleting('zone', instance.zone_id):
+        # Calculée avant la cascade, tant que votes et commentaires existent
+        instance._activity_contribution = activity.idea_contribution(instance.pk, instance.created_at)
+
+
+@receiver(post_delete, sender=Idea)
+def update_stats_on_idea_delete(sender, instance, **kwargs):
+    _deleting_set('idea').discard(instance.pk)
+    if is_deleting('zone', instance.zone_id):
+        return
+    key = instance._stats_key or (instance.zone_id, instance.category, instance.status)
+    counters = stats.idea_counters(instance)
+    stats.apply_delta(*key, **{field: -value for field, value in counters.items()})
+    contribution = getattr(instance, '_activity_contribution', None)
+    if contribution:
+        activity.apply_contribution(contribution, key[0], key[1], sign=-1)
+
+
+@receiver(post_save, sender=Idea)
+def update_similarity_index(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # Les sauvegardes partielles (votes, zone) ne touchent pas au texte
+    if created or update_fields is None or {'title', 'description'} & set(update_fields):
+        similarity.index_idea(instance)
+
+
+# Zones
+
+@receiver(post_save, sender=Zone)
+def invalidate_zone_index_on_save(sender, instance, **kwargs):
+    spatial.invalidate()
+
+
+@receiver(pre_delete, sender=Zone)
+def mark_zone_deleting(sender, instance, **kwargs):
+    _deleting_set('zone').add(instance.pk)
+
+
+@receiver(post_delete, sender=Zone)
+def unmark_zone_deleting(sender, instance, **kwargs):
+    _deleting_set('zone').discard(instance.pk)
+    spatial.invalidate()
+
+
+# Votes
+
+@receiver(post_init, sender=Vote)
+def remember_vote_state(sender, instance, **kwargs):
+    instance._loaded_is_positive = instance.__dict__.get('is_positive') if instance.pk else None
+
+
+@receiver(post_save, sender=Vote)
+def update_stats_on_vote_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else instance._loaded_is_positive
+    if previous != instance.is_positive:
+        key = _idea_key(instance.idea_id)
+        if key:
+            stats.apply_delta(
+                *key,
+                positive_votes=int(bool(instance.is_positive)) - int(previous is True),
+                negative_votes=int(not instance.is_positive) - int(previous is False),
+            )
+            if created:
+                activity.record(key[0], key[1], instance.created_at, votes=1)
+    instance._loaded_is_positive = instance.is_positive
+
+
+@receiver(post_delete, sender=Vote)
+def update_stats_on_vote_delete(sender, instance, **kwargs):
+    if is_deleting('idea', instance.idea_id):
+        return
+    # Les compteurs de l'idée doivent aussi suivre les suppressions en cascade (utilisateur)
+    field = 'positive_votes' if instance.is_positive else 'negative_votes'
+    Idea.objects.filter(pk=instance.idea_id).update(
+        vote_count=F('vote_count') - 1, **{field: F(field) - 1}, updated_at=timezone.now()
+    )
+    key = _idea_key(instance.idea_id)
+    if key:
+        stats.apply_delta(*key, **{field: -1})
+        activity.record(key[0], key[1], instance.created_at, votes=-1)
+
+
+# Commentaires
+
+@receiver(post_save, sender=Comment)
+def update_stats_on_comment_save(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    Idea.objects.filter(pk=instance.idea_id).update(
+        comment_count=F('comment_count') + 1, updated_at=timezone.now()
+    )
+    key = _idea_key(instance.idea_id)
+    if key:
+        stats.apply_delta(*key, comment_count=1)
+        activity.record(key[0], key[1], instance.created_at, comments=1)
+
+
+@receiver(post_delete, sender=Comment)
+def update_stats_on_comment_delete(sender, instance, **kwargs):
+    if is_deleting('idea', instance.idea_id):
+        return
+    Idea.objects.filter(pk=instance.idea_id).update(
+        comment_count=F('comment_count') - 1, updated_at=timezone.now()
+    )
+    key = _idea_key(instance.idea_id)
+    if key:
+        stats.apply_delta(*key, comment_count=-1)
+        activity.record(key[0], key[1], instance.created_at, comments=-1)
+
+
+# Votes de commentaires
+
+def _comment_idea_key(comment_id):
+    return (
+        Comment.objects.filter(pk=comment_id)
+        .values_list('idea_id', 'idea__zone_id', 'idea__category')
+        .first()
+    )
+
+
+@receiver(post_save, sender=CommentVote)
+def update_activity_on_comment_vote_save(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    key = _comment_idea_key(instance.comment_id)
+    if key:
+        activity.record(key[1], key[2], instance.created_at, comment_votes=1)
+
+
+@receiver(post_delete, sender=CommentVote)
+def update_activity_on_comment_vote_delete(sender, instance, **kwargs):
+    key = _comment_idea_key(instance.comment_id)
+    if key and not is_deleting('idea', key[0]):
+        activity.record(key[1], key[2], instance.created_at, comment_votes=-1)
+
+
+# Fragments sérialisés (api/fragments.py)
+
+NAME_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def touch_ideas(ideas):
+    """Avance ``updated_at`` d'idées dont la représentation a changé"""
+    ideas.update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Comment)
+def touch_idea_on_comment_edit(sender, instance, created, raw=False, **kwargs):
+    # Création : updated_at avancé avec le nombre de commentaires
+    if not raw and not created:
+        touch_ideas(Idea.objects.filter(pk=instance.idea_id))
+
+
+@receiver(post_save, sender=CommentVote)
+@receiver(post_delete, sender=CommentVote)
+def touch_idea_on_comment_vote(sender, instance, raw=False, **kwargs):
+    if not raw:
+        touch_ideas(Idea.objects.filter(comments=instance.comment_id))
+
+
+@receiver(post_init, sender=User)
+def remember_user_names(sender, instance, **kwargs):
+    instance._loaded_names = tuple(instance.__dict__.get(name) for name in NAME_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def touch_ideas_on_user_rename(sender, instance, created, raw=False, **kwargs):
+    names = tuple(getattr(instance, name) for name in NAME_FIELDS)
+    if not raw and not created and names != instance._loaded_names:
+        # Nom affiché avec ses idées, commentaires et votes
+        touch_ideas(Idea.objects.filter(
+            Q(author=instance) | Q(votes__user=instance)
+            | Q(comments__user=instance) | Q(comments__votes__user=instance)
+        ))
+    instance._loaded_names = names
+
+
+# Temps réel
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def notify_vote(sender, instance, raw=False, **kwargs):
+    if not raw and not is_deleting('idea', instance.idea_id):
+        realtime.notify_counts(instance.idea_id)
+
+
+@receiver(post_save, sender=Comment)
+def notify_comment_created(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    realtime.notify_comment(instance, instance.idea.zone_id)
+    realtime.notify_counts(instance.idea_id)
+
+
+@receiver(post_delete, sender=Comment)
+def notify_comment_deleted(sender, instance, **kwargs):
+    if not is_deleting('idea', instance.idea_id):
+        realtime.notify_counts(instance.idea_id)
+
+
+# Cartes de chaleur
+
+@receiver(post_save, sender=Idea)
+@receiver(post_delete, sender=Idea)
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def invalidate_heatmaps(sender, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(heatmap.invalidate)
+
+
+@receiver(post_save, sender=Zone)
+@receiver(post_save, sender=User)
+def invalidate_heatmaps_on_soft_delete(sender, instance, raw=False, **kwargs):
+    # Zone ou auteur masqués (api/deletion.py) : leurs idées quittent les grilles
+    if not raw and instance.deleted_at is not None:
+        transaction.on_commit(heatmap.invalidate)
+
+
+# Journal de synchronisation
+
+@receiver(post_save, sender=Zone)
+def log_zone_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        changelog.record(changelog.ZONE, instance.pk)
+
+
+@receiver(post_delete, sender=Zone)
+def log_zone_delete(sender, instance, **kwargs):
+    changelog.record(changelog.ZONE, instance.pk, deleted=True)
+
+
+@receiver(post_save, sender=Idea)
+def log_idea_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        changelog.record(changelog.IDEA, instance.pk)
+
+
+@receiver(post_delete, sender=Idea)
+def log_idea_delete(sender, instance, **kwargs):
+    changelog.forget_children([instance.pk])
+    changelog.record(changelog.IDEA, instance.pk, deleted=True)
+
+
+@receiver(post_save, sender=Comment)
+def log_comment_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changelog.record(changelog.COMMENT, instance.pk, idea_id=instance.idea_id)
+    if created:
+        # Nombre de commentaires de l'idée
+        changelog.record(changelog.IDEA, instance.idea_id)
+
+
+@receiver(post_delete, sender=Comment)
+def log_comment_delete(sender, instance, **kwargs):
+    if is_deleting('idea', instance.idea_id):
+        return
+    changelog.record(changelog.COMMENT, instance.pk, deleted=True, idea_id=instance.idea_id)
+    changelog.record(changelog.IDEA, instance.idea_id)
+
+
+@receiver(post_save, sender=Vote)
+def log_vote_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        changelog.record(changelog.VOTE, instance.pk, idea_id=instance.idea_id, user_id=instance.user_id)
+
+
+@receiver(post_delete, sender=Vote)
+def log_vote_delete(sender, instance, **kwargs):
+    if is_deleting('idea', instance.idea_id):
+        return
+    changelog.record(
+        changelog.VOTE, instance.pk, deleted=True, idea_id=instance.idea_id, user_id=instance.user_id
+    )
+    # Compteurs de votes de l'idée
+    changelog.record(changelog.IDEA, instance.idea_id)
+
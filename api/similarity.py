@@ -0,0 +1,242 @@
+"""Détection des idées quasi identiques.
+
+Le titre et la description d'une idée sont normalisés (minuscules, sans
+accents ni mots vides) puis découpés en shingles de caractères. Une signature
+MinHash de ces shingles est répartie en bandes (LSH) : chaque bande donne une
+clé stockée dans ``IdeaSimilarityKey``. Deux idées partageant au moins une clé
+sont candidates ; les candidates de même catégorie et proches
+géographiquement sont ensuite vérifiées par l'indice de Jaccard exact.
+"""
+import hashlib
+import math
+import random
+import re
+import unicodedata
+import zlib
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from .deletion import visible_ideas
+from .models import Idea, IdeaSimilarityKey
+from .spatial import radius_box
+
+# Taille des shingles (caractères)
+SHINGLE_SIZE = 4
+# Longueur maximale du texte normalisé pris en compte (borne le coût du MinHash)
+MAX_TEXT_LENGTH = 1000
+# Signature MinHash : BANDS bandes de ROWS valeurs (seuil LSH ≈ (1/BANDS)^(1/ROWS) ≈ 0,5)
+BANDS = 16
+ROWS = 4
+# Nombre maximal de doublons possibles renvoyés
+MAX_RESULTS = 5
+# Paires candidates vérifiées par lot (une requête par lot) dans duplicate_groups
+VERIFY_BATCH_SIZE = 500
+
+STOP_WORDS = frozenset(
+    'a au aux avec ce ces dans de des du en et il la le les leur mais ne nous '
+    'on ou par pas plus pour qu que qui sa se ses son sur un une vos votre'.split()
+)
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(20250623)
+PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME))
+    for _ in range(BANDS * ROWS)
+]
+
+
+def similarity_threshold():
+    return getattr(settings, 'IDEA_DUPLICATE_THRESHOLD', 0.5)
+
+
+def search_radius_km():
+    return getattr(settings, 'IDEA_DUPLICATE_RADIUS_KM', 1.0)
+
+
+def normalize(text):
+    """Texte en minuscules, sans accents, ponctuation ni mots vides"""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower()
+    words = [word for word in re.findall(r'[a-z0-9]+', text) if word not in STOP_WORDS]
+    return ' '.join(words)
+
+
+def shingles(title, description=''):
+    """Ensemble des shingles de caractères d'une idée"""
+    text = normalize(f'{title} {description}')[:MAX_TEXT_LENGTH]
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    """Signature MinHash (BANDS * ROWS valeurs) d'un ensemble de shingles"""
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingle_set]
+    if not hashes:
+        return []
+    return [min([(a * h + b) % _MERSENNE_PRIME for h in hashes]) for a, b in PERMUTATIONS]
+
+
+def band_keys(signature):
+    """Clés LSH (entiers 64 bits signés) des bandes d'une signature"""
+    keys = []
+    for band in range(len(signature) // ROWS):
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(band.to_bytes(2, 'big'))
+        for value in signature[band * ROWS:(band + 1) * ROWS]:
+            digest.update(value.to_bytes(8, 'big'))
+        keys.append(int.from_bytes(digest.digest(), 'big', signed=True))
+    return keys
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def index_idea(idea):
+    """Met à jour les clés LSH d'une idée"""
+    keys = band_keys(minhash(shingles(idea.title, idea.description)))
+    with transaction.atomic():
+        IdeaSimilarityKey.objects.filter(idea_id=idea.pk).delete()
+        IdeaSimilarityKey.objects.bulk_create(IdeaSimilarityKey(idea_id=idea.pk, key=key) for key in keys)
+
+
+def find_similar(title, description, category, latitude, longitude, exclude=None, limit=MAX_RESULTS):
+    """Idées proches et de même catégorie dont le texte est quasi identique"""
+    reference = shingles(title, description)
+    keys = band_keys(minhash(reference))
+    if not keys:
+        return []
+    lat_range, lng_range = radius_box(latitude, longitude, search_radius_km())
+    candidates = (
+        visible_ideas(Idea.objects.all()).filter(
+            pk__in=IdeaSimilarityKey.objects.filter(key__in=keys).values('idea_id'),
+            category=category,
+            latitude__range=lat_range,
+            longitude__range=lng_range,
+        )
+        .values('id', 'title', 'description', 'status', 'zone_id', 'vote_count')
+    )
+    if exclude is not None:
+        candidates = candidates.exclude(pk=exclude)
+
+    threshold = similarity_threshold()
+    matches = []
+    for candidate in candidates:
+        score = jaccard(reference, shingles(candidate['title'], candidate['description']))
+        if score >= threshold:
+            matches.append({
+                'id': candidate['id'],
+                'title': candidate['title'],
+                'status': candidate['status'],
+                'zone': candidate['zone_id'],
+                'vote_count': candidate['vote_count'],
+                'similarity': round(score, 3),
+            })
+    matches.sort(key=lambda match: (-match['similarity'], match['id']))
+    return matches[:limit]
+
+
+def find_similar_to(idea, limit=MAX_RESULTS):
+    """Doublons possibles d'une idée existante"""
+    return find_similar(
+        idea.title, idea.description, idea.category, idea.latitude, idea.longitude,
+        exclude=idea.pk, limit=limit,
+    )
+
+
+def _distance_km(first, second):
+    lat1, lng1 = first
+    lat2, lng2 = second
+    dx = (lng2 - lng1) * 111 * math.cos(math.radians((lat1 + lat2) / 2))
+    dy = (lat2 - lat1) * 111
+    return math.hypot(dx, dy)
+
+
+def _candidate_pairs(buckets, keys_by_idea):
+    """Paires d'idées partageant une bande, chacune produite une seule fois"""
+    for (category, key), members in buckets.items():
+        if len(members) < 2:
+            continue
+        band = keys_by_idea[members[0]].index(key)
+        for i, first in enumerate(members):
+            first_keys = keys_by_idea[first]
+            for second in members[i + 1:]:
+                # Paire déjà produite par une bande précédente
+                if any(a == b for a, b in zip(first_keys[:band], keys_by_idea[second][:band])):
+                    continue
+                yield first, second
+
+
+def _verified_pairs(pairs, threshold, radius):
+    """Paires de ``pairs`` quasi identiques, textes relus en base par lots"""
+    pairs = iter(pairs)
+    while batch := list(islice(pairs, VERIFY_BATCH_SIZE)):
+        rows = visible_ideas(Idea.objects.all()).filter(
+            pk__in={pk for pair in batch for pk in pair}
+        ).values_list('pk', 'title', 'description', 'latitude', 'longitude')
+        ideas = {
+            pk: (shingles(title, description), (latitude, longitude))
+            for pk, title, description, latitude, longitude in rows
+        }
+        for first, second in batch:
+            if first not in ideas or second not in ideas:
+                continue
+            (first_set, first_position), (second_set, second_position) = ideas[first], ideas[second]
+            if _distance_km(first_position, second_position) > radius:
+                continue
+            if jaccard(first_set, second_set) >= threshold:
+                yield first, second
+
+
+def duplicate_groups(batch_size=1000, rebuild_index=False):
+    """Groupes d'idées quasi identiques sur tout le corpus.
+
+    Seules les clés de bandes de chaque idée sont conservées en mémoire ; les
+    paires candidates (même catégorie, au moins une bande commune) sont
+    vérifiées comme dans ``find_similar``, après relecture de leurs textes en
+    base. Retourne une liste de groupes [(id, id, ...)] et, si
+    ``rebuild_index``, réécrit la table des clés au passage.
+    """
+    buckets = {}
+    keys_by_idea = {}
+    last_pk = 0
+    while True:
+        rows = list(
+            Idea.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'title', 'description', 'category')[:batch_size]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+        new_keys = []
+        for pk, title, description, category in rows:
+            keys = keys_by_idea[pk] = band_keys(minhash(shingles(title, description)))
+            for key in keys:
+                buckets.setdefault((category, key), []).append(pk)
+                new_keys.append(IdeaSimilarityKey(idea_id=pk, key=key))
+        if rebuild_index:
+            with transaction.atomic():
+                IdeaSimilarityKey.objects.filter(idea_id__in=[row[0] for row in rows]).delete()
+                IdeaSimilarityKey.objects.bulk_create(new_keys, batch_size=500)
+
+    # Union-find des paires vérifiées
+    parent = {}
+
+    def find(pk):
+        while parent.get(pk, pk) != pk:
+            pk = parent[pk]
+        return pk
+
+    pairs = _candidate_pairs(buckets, keys_by_idea)
+    for first, second in _verified_pairs(pairs, similarity_threshold(), search_radius_km()):
+        parent.setdefault(first, first)
+        parent[find(second)] = find(first)
+
+    groups = {}
+    for pk in list(parent):
+        groups.setdefault(find(pk), set()).add(pk)
+    return sorted(tuple(sorted(group)) for group in groups.values())
@@ -0,0 +1,265 @@
+"""Index spatial des zones.
+
+Les zones peuvent porter une géométrie GeoJSON (``Polygon`` ou
+``MultiPolygon``, coordonnées ``[longitude, latitude]``). Un R-tree construit
+en mémoire (chargement STR) permet de retrouver la zone contenant un point ;
+à défaut, la zone dont le centre est le plus proche est retenue.
+
+L'index est reconstruit à la demande : après toute écriture sur une zone du
+processus courant, et au plus tard après ``ZONE_INDEX_TTL`` secondes pour
+prendre en compte les modifications faites par d'autres processus.
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Zone
+
+logger = logging.getLogger(__name__)
+
+# Nombre maximal d'entrées par nœud du R-tree
+NODE_CAPACITY = 16
+
+
+def geometry_polygons(geometry):
+    """Liste des polygones (liste d'anneaux [(x, y), ...]) d'une géométrie GeoJSON"""
+    if not geometry:
+        return []
+    kind = geometry.get('type')
+    coordinates = geometry.get('coordinates') or []
+    if kind == 'Polygon':
+        polygons = [coordinates]
+    elif kind == 'MultiPolygon':
+        polygons = coordinates
+    else:
+        raise ValueError(f'Type de géométrie non supporté : {kind}')
+    return [[[(float(x), float(y)) for x, y, *_ in ring] for ring in polygon] for polygon in polygons]
+
+
+def validate_geometry(geometry):
+    """Vérifie qu'une géométrie GeoJSON est un polygone exploitable (ValueError sinon)"""
+    try:
+        polygons = geometry_polygons(geometry)
+    except (TypeError, AttributeError) as exc:
+        raise ValueError(f'Structure GeoJSON inattendue ({exc})') from exc
+    if not polygons:
+        raise ValueError('Géométrie vide')
+    for polygon in polygons:
+        if not polygon or any(len(ring) < 4 for ring in polygon):
+            raise ValueError('Chaque anneau doit contenir au moins 4 positions')
+        for ring in polygon:
+            for x, y in ring:
+                if not (-180 <= x <= 180 and -90 <= y <= 90):
+                    raise ValueError('Coordonnées hors limites (attendu [longitude, latitude])')
+
+
+def ring_contains(x, y, ring):
+    """Test du point dans un anneau (lancer de rayon)"""
+    inside = False
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
+
+
+def polygon_contains(x, y, polygon):
+    """Point dans un polygone (premier anneau extérieur, suivants = trous)"""
+    exterior, *holes = polygon
+    return ring_contains(x, y, exterior) and not any(ring_contains(x, y, hole) for hole in holes)
+
+
+def ring_area(ring):
+    area = 0.0
+    x1, y1 = ring[-1]
+    for x2, y2 in ring:
+        area += x1 * y2 - x2 * y1
+        x1, y1 = x2, y2
+    return abs(area) / 2
+
+
+def bounding_box(polygons):
+    xs = [x for polygon in polygons for x, _ in polygon[0]]
+    ys = [y for polygon in polygons for _, y in polygon[0]]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+class RTree:
+    """R-tree statique chargé par tri STR (Sort-Tile-Recursive)"""
+
+    def __init__(self, entries, capacity=NODE_CAPACITY):
+        # entries : [(bbox, item)] avec bbox = (min_x, min_y, max_x, max_y)
+        self.capacity = capacity
+        level = [(bbox, item) for bbox, item in entries]
+        self.root = None
+        if not level:
+            return
+        is_leaf = True
+        while True:
+            nodes = self._pack(level, is_leaf)
+            if len(nodes) == 1:
+                self.root = nodes[0]
+                break
+            level = nodes
+            is_leaf = False
+
+    def _pack(self, entries, is_leaf):
+        capacity = self.capacity
+        slice_count = max(int(math.ceil(math.sqrt(math.ceil(len(entries) / capacity)))), 1)
+        slice_size = slice_count * capacity
+        entries = sorted(entries, key=lambda entry: entry[0][0] + entry[0][2])
+        nodes = []
+        for start in range(0, len(entries), slice_size):
+            vertical = sorted(entries[start:start + slice_size], key=lambda entry: entry[0][1] + entry[0][3])
+            for offset in range(0, len(vertical), capacity):
+                children = vertical[offset:offset + capacity]
+                bbox = (
+                    min(child[0][0] for child in children),
+                    min(child[0][1] for child in children),
+                    max(child[0][2] for child in children),
+                    max(child[0][3] for child in children),
+                )
+                nodes.append((bbox, (is_leaf, children)))
+        return nodes
+
+    def search(self, x, y):
+        """Éléments dont la boîte englobante contient le point"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            bbox, (is_leaf, children) = stack.pop()
+            if not (bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]):
+                continue
+            for child in children:
+                child_bbox = child[0]
+                if child_bbox[0] <= x <= child_bbox[2] and child_bbox[1] <= y <= child_bbox[3]:
+                    if is_leaf:
+                        found.append(child[1])
+                    else:
+                        stack.append(child)
+        return found
+
+    def nearest(self, x, y, x_scale=1.0):
+        """Élément le plus proche du point (parcours best-first)"""
+        if self.root is None:
+            return None
+
+        def distance(bbox):
+            dx = max(bbox[0] - x, 0, x - bbox[2]) * x_scale
+            dy = max(bbox[1] - y, 0, y - bbox[3])
+            return dx * dx + dy * dy
+
+        counter = 0
+        heap = [(distance(self.root[0]), counter, False, self.root)]
+        while heap:
+            _, _, is_item, entry = heapq.heappop(heap)
+            if is_item:
+                return entry
+            is_leaf, children = entry[1]
+            for child in children:
+                counter += 1
+                heapq.heappush(heap, (distance(child[0]), counter, is_leaf, child[1] if is_leaf else child))
+        return None
+
+
+class ZoneLocator:
+    """Recherche de la zone contenant un point (ou de la plus proche)"""
+
+    def __init__(self, zones):
+        # zones : itérable de (id, latitude, longitude, géométrie)
+        polygon_entries = []
+        centroid_entries = []
+        self.polygons = {}
+        self.areas = {}
+        for zone_id, latitude, longitude, geometry in zones:
+            centroid_entries.append(((float(longitude), float(latitude)) * 2, zone_id))
+            if not geometry:
+                continue
+            try:
+                validate_geometry(geometry)
+            except ValueError as exc:
+                # Géométrie enregistrée sans validation : la zone n'est localisée que par son centre
+                logger.warning('Géométrie de la zone %s ignorée : %s', zone_id, exc)
+                continue
+            polygons = geometry_polygons(geometry)
+            if polygons:
+                self.polygons[zone_id] = polygons
+                self.areas[zone_id] = sum(ring_area(polygon[0]) for polygon in polygons)
+                polygon_entries.append((bounding_box(polygons), zone_id))
+        self.polygon_tree = RTree(polygon_entries)
+        self.centroid_tree = RTree(centroid_entries)
+
+    def containing(self, latitude, longitude):
+        """Zone la plus petite dont la géométrie contient le point, ou None"""
+        x, y = float(longitude), float(latitude)
+        matches = [
+            zone_id for zone_id in self.polygon_tree.search(x, y)
+            if any(polygon_contains(x, y, polygon) for polygon in self.polygons[zone_id])
+        ]
+        if not matches:
+            return None
+        # Zones imbriquées (rue dans un quartier) : la plus précise l'emporte
+        return min(matches, key=lambda zone_id: self.areas[zone_id])
+
+    def locate(self, latitude, longitude):
+        """Zone contenant le point, sinon zone au centre le plus proche"""
+        zone_id = self.containing(latitude, longitude)
+        if zone_id is not None:
+            return zone_id
+        x_scale = math.cos(math.radians(float(latitude)))
+        return self.centroid_tree.nearest(float(longitude), float(latitude), x_scale)
+
+    def locate_many(self, points):
+        """Zones des points [(latitude, longitude), ...]"""
+        return [self.locate(latitude, longitude) for latitude, longitude in points]
+
+
+_locator = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_locator():
+    """Index des zones du processus, reconstruit si invalidé ou expiré"""
+    global _locator, _built_at
+    ttl = getattr(settings, 'ZONE_INDEX_TTL', 300)
+    locator = _locator
+    if locator is not None and time.monotonic() - _built_at < ttl:
+        return locator
+    with _lock:
+        if _locator is None or time.monotonic() - _built_at >= ttl:
+            zones = Zone.objects.filter(deleted_at__isnull=True)
+            _locator = ZoneLocator(zones.values_list('id', 'latitude', 'longitude', 'geometry'))
+            _built_at = time.monotonic()
+        return _locator
+
+
+def invalidate():
+    """Force la reconstruction de l'index au prochain appel"""
+    global _locator
+    _locator = None
+
+
+def coordinate_precision():
+    """Nombre de décimales des coordonnées renvoyées par l'API"""
+    return getattr(settings, 'COORDINATE_PRECISION', 6)
+
+
+def radius_box(latitude, longitude, radius_km):
+    """Plages (latitude, longitude) d'un carré de ``radius_km`` autour d'un point"""
+    latitude, longitude = float(latitude), float(longitude)
+    lat_delta = radius_km / 111
+    lng_delta = radius_km / (111 * max(math.cos(math.radians(latitude)), 0.01))
+    return (latitude - lat_delta, latitude + lat_delta), (longitude - lng_delta, longitude + lng_delta)
+
+
+def locate_zone(latitude, longitude):
+    """Identifiant de la zone d'un point (None s'il n'existe aucune zone)"""
+    return get_locator().locate(latitude, longitude)
@@ -0,0 +1,180 @@
+"""Statistiques matérialisées par zone.
+
+La table ``ZoneStat`` contient une ligne par (zone, catégorie, statut) avec
+les compteurs d'idées, de votes et de commentaires. Elle est maintenue
+incrémentalement par les signaux (voir ``api/signals.py``) et peut être
+reconstruite ou vérifiée avec la commande ``rebuild_zone_stats``.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Idea, Vote, Comment, ZoneStat
+
+COUNTER_FIELDS = ['idea_count', 'positive_votes', 'negative_votes', 'comment_count']
+
+# Nombre d'idées les plus actives renvoyées par zone
+MOST_ACTIVE_LIMIT = 5
+
+
+def upsert_counters(model, lookup, deltas, create=True):
+    """Ajoute des deltas aux compteurs de la ligne ``lookup`` (créée si besoin)"""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    updates = {field: F(field) + value for field, value in deltas.items()}
+    if any(field.name == 'updated_at' for field in model._meta.fields):
+        updates['updated_at'] = timezone.now()
+    if model.objects.filter(**lookup).update(**updates) or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Ligne créée entre-temps par une autre requête
+        model.objects.filter(**lookup).update(**updates)
+
+
+def apply_delta(zone_id, category, status, **deltas):
+    """Ajoute des deltas aux compteurs d'une ligne ZoneStat"""
+    upsert_counters(ZoneStat, {'zone_id': zone_id, 'category': category, 'status': status}, deltas)
+
+
+def idea_counters(idea):
+    """Contribution d'une idée aux compteurs de sa ligne"""
+    return {
+        'idea_count': 1,
+        'positive_votes': idea.positive_votes,
+        'negative_votes': idea.negative_votes,
+        'comment_count': idea.comment_count,
+    }
+
+
+def grouped_counters(ideas):
+    """Contribution cumulée d'un ensemble d'idées, par ligne {(zone, catégorie, statut): compteurs}"""
+    rows = (
+        ideas.values('zone_id', 'category', 'status')
+        .annotate(
+            idea_count=Count('id'),
+            positive_votes=Sum('positive_votes'),
+            negative_votes=Sum('negative_votes'),
+            comment_count=Sum('comment_count'),
+        )
+        .order_by()
+    )
+    return {
+        (row['zone_id'], row['category'], row['status']): {field: row[field] for field in COUNTER_FIELDS}
+        for row in rows
+    }
+
+
+def compute_rows(zone_ids=None):
+    """Recalcule les agrégats depuis les tables sources"""
+    ideas = Idea.objects.all()
+    votes = Vote.objects.all()
+    comments = Comment.objects.all()
+    if zone_ids is not None:
+        ideas = ideas.filter(zone_id__in=zone_ids)
+        votes = votes.filter(idea__zone_id__in=zone_ids)
+        comments = comments.filter(idea__zone_id__in=zone_ids)
+
+    rows = defaultdict(lambda: dict.fromkeys(COUNTER_FIELDS, 0))
+    for row in ideas.values('zone_id', 'category', 'status').annotate(n=Count('id')).order_by():
+        rows[(row['zone_id'], row['category'], row['status'])]['idea_count'] = row['n']
+    vote_rows = (
+        votes.values('idea__zone_id', 'idea__category', 'idea__status')
+        .annotate(up=Count('id', filter=Q(is_positive=True)), down=Count('id', filter=Q(is_positive=False)))
+        .order_by()
+    )
+    for row in vote_rows:
+        key = (row['idea__zone_id'], row['idea__category'], row['idea__status'])
+        rows[key]['positive_votes'] = row['up']
+        rows[key]['negative_votes'] = row['down']
+    comment_rows = (
+        comments.values('idea__zone_id', 'idea__category', 'idea__status')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    for row in comment_rows:
+        rows[(row['idea__zone_id'], row['idea__category'], row['idea__status'])]['comment_count'] = row['n']
+    return rows
+
+
+def stored_rows(zone_ids=None):
+    """Agrégats actuellement stockés dans ZoneStat"""
+    queryset = ZoneStat.objects.all()
+    if zone_ids is not None:
+        queryset = queryset.filter(zone_id__in=zone_ids)
+    rows = {}
+    for row in queryset.values('zone_id', 'category', 'status', *COUNTER_FIELDS):
+        key = (row.pop('zone_id'), row.pop('category'), row.pop('status'))
+        rows[key] = row
+    return rows
+
+
+def check(zone_ids=None):
+    """Retourne les écarts {clé: (stocké, attendu)} entre ZoneStat et les sources"""
+    expected = compute_rows(zone_ids)
+    stored = stored_rows(zone_ids)
+    empty = dict.fromkeys(COUNTER_FIELDS, 0)
+    mismatches = {}
+    for key in set(expected) | set(stored):
+        current = stored.get(key, empty)
+        wanted = expected.get(key, empty)
+        if current != wanted:
+            mismatches[key] = (current, wanted)
+    return mismatches
+
+
+@transaction.atomic
+def rebuild(zone_ids=None):
+    """Reconstruit ZoneStat (et Idea.comment_count) depuis les tables sources"""
+    rows = compute_rows(zone_ids)
+    existing = ZoneStat.objects.all()
+    ideas = Idea.objects.all()
+    if zone_ids is not None:
+        existing = existing.filter(zone_id__in=zone_ids)
+        ideas = ideas.filter(zone_id__in=zone_ids)
+    existing.delete()
+    ZoneStat.objects.bulk_create(
+        [
+            ZoneStat(zone_id=zone_id, category=category, status=status, **counters)
+            for (zone_id, category, status), counters in rows.items()
+        ],
+        batch_size=500,
+    )
+
+    counts = dict(
+        Comment.objects.filter(idea__in=ideas).values_list('idea_id').annotate(n=Count('id')).order_by()
+    )
+    stale = [
+        Idea(pk=pk, comment_count=counts.get(pk, 0))
+        for pk, comment_count in ideas.values_list('pk', 'comment_count')
+        if comment_count != counts.get(pk, 0)
+    ]
+    Idea.objects.bulk_update(stale, ['comment_count'], batch_size=500)
+    return len(rows)
+
+
+def summarize(rows):
+    """Assemble les lignes ZoneStat d'une zone en un document de tableau de bord"""
+    summary = {
+        'idea_count': 0,
+        'by_category': {},
+        'by_status': {},
+        'votes': {'total': 0, 'up': 0, 'down': 0},
+        'comment_count': 0,
+    }
+    for row in rows:
+        if not row.idea_count:
+            continue
+        summary['idea_count'] += row.idea_count
+        summary['by_category'][row.category] = summary['by_category'].get(row.category, 0) + row.idea_count
+        summary['by_status'][row.status] = summary['by_status'].get(row.status, 0) + row.idea_count
+        summary['votes']['up'] += row.positive_votes
+        summary['votes']['down'] += row.negative_votes
+        summary['comment_count'] += row.comment_count
+    summary['votes']['total'] = summary['votes']['up'] + summary['votes']['down']
+    return summary
@@ -0,0 +1,109 @@
+"""Tâches de fond exécutées par ``run_worker`` (voir api/jobs.py).
+
+Chaque tâche reprend un recalcul jusque-là lancé à la main par une commande
+``manage.py`` ; son résultat (nombre de lignes traitées…) est conservé dans
+``Job.result``.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from . import activity, changelog, jobs, moderation, similarity, stats, votes
+from .jobs import task
+from .models import Idea, ModerationJob, RevokedToken
+from .ranking import compute_scores, scores_refreshed
+from .throttling import TokenBucketThrottle
+
+
+@task
+def refresh_idea_scores(max_age_days=None, batch_size=500):
+    """Recalcule par lots les scores de classement (atténuation du score « hot »)"""
+    now = timezone.now()
+    queryset = Idea.objects.order_by('pk')
+    if max_age_days is not None:
+        queryset = queryset.filter(created_at__gte=now - timedelta(days=max_age_days))
+
+    fields = ['hot_score', 'wilson_score', 'controversy_score']
+    updated = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk)
+            .values_list('pk', 'positive_votes', 'negative_votes', 'created_at')[:batch_size]
+        )
+        if not rows:
+            break
+        ideas = []
+        for pk, up, down, created_at in rows:
+            ideas.append(Idea(pk=pk, **compute_scores(up, down, created_at, now)))
+        Idea.objects.bulk_update(ideas, fields)
+        updated += len(ideas)
+        last_pk = rows[-1][0]
+    scores_refreshed()
+    return updated
+
+
+@task
+def reconcile_vote_counts(batch_size=500):
+    """Corrige les compteurs de votes des idées (et ZoneStat de leurs zones)"""
+    return votes.reconcile(batch_size)
+
+
+@task
+def rebuild_zone_stats(zones=None):
+    """Reconstruit les statistiques matérialisées de zones (toutes par défaut)"""
+    return stats.rebuild(zones)
+
+
+@task
+def rebuild_activity(days=None, prune_only=False):
+    """Reconstruit les tranches d'activité et purge les tranches horaires expirées"""
+    rebuilt = 0
+    if not prune_only:
+        since = timezone.now() - timedelta(days=days) if days is not None else None
+        rebuilt = activity.rebuild(since)
+    return {'rebuilt': rebuilt, 'pruned': activity.prune_hourly()}
+
+
+@task(max_attempts=2)
+def rebuild_similarity_index(batch_size=1000):
+    """Réécrit l'index de détection des doublons ; retourne le nombre de groupes trouvés"""
+    return len(similarity.duplicate_groups(batch_size, rebuild_index=True))
+
+
+@task(name='moderation', max_attempts=1)
+def run_moderation(moderation_job):
+    """Applique une opération de modération groupée lancée par l'API ou l'administration"""
+    job = moderation.run(ModerationJob.objects.get(pk=moderation_job))
+    return {'state': job.state, 'processed': job.processed, 'affected': job.affected}
+
+
+@task
+def purge_subject(moderation_job):
+    """Purge par lots une zone ou un utilisateur supprimé (voir api/deletion.py)"""
+    job = moderation.run(ModerationJob.objects.get(pk=moderation_job))
+    if job.state == ModerationJob.STATES.FAILED:
+        # Nouvelle tentative différée : la purge reprend là où elle s'est arrêtée
+        raise RuntimeError(job.error)
+    return {'processed': job.processed, 'affected': job.affected}
+
+
+@task
+def prune_change_log():
+    return changelog.prune()
+
+
+@task
+def purge_revoked_tokens():
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+@task
+def prune_throttle_buckets():
+    return TokenBucketThrottle.prune()
+
+
+@task
+def prune_jobs():
+    return jobs.prune()
@@ -1,3 +1,1659 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import random
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import (
+    activity, changelog, deletion, heatmap, idempotency, jobs, mapdata, moderation, similarity, stats, tasks, votes,
+)
+from .hashing import BoundedHashingExecutor, HashingCapacityExceeded
+from .models import (
+    ActivityBucket, ChangeLog, Comment, CommentVote, Idea, Job, ModerationJob, RevokedToken, ThrottleBucket, User, Vote,
+    Zone, ZoneStat,
+)
+from .realtime import broker
+from .revocation import BloomFilter, RevokedTokenFilter
+from .serializers import LIST_COMMENTS, IdeaListSerializer
+from .spatial import ZoneLocator
+from .throttling import TokenBucketThrottle
+from .views import vote_context
+
+
+def create_user(username='alice', password='motdepasse123!', **extra):
+    return User.objects.create_user(username=username, email=f'{username}@example.fr', password=password, **extra)
+
+
+def create_zone(name='Centre', latitude=48.85, longitude=2.35, **extra):
+    return Zone.objects.create(name=name, zone_type='neighborhood', latitude=latitude, longitude=longitude, **extra)
+
+
+def create_idea(author, zone, title='Idée', latitude=48.85, longitude=2.35, **extra):
+    extra.setdefault('category', 'transport')
+    extra.setdefault('description', 'Description')
+    return Idea.objects.create(
+        title=title, latitude=latitude, longitude=longitude,
+        author=author, zone=zone, **extra
+    )
+
+
+def square(longitude, latitude, size):
+    """Polygone GeoJSON carré de coin sud-ouest (longitude, latitude)"""
+    return {'type': 'Polygon', 'coordinates': [[
+        [longitude, latitude], [longitude + size, latitude], [longitude + size, latitude + size],
+        [longitude, latitude + size], [longitude, latitude],
+    ]]}
+
+
+def run_jobs():
+    """Exécute les tâches de fond prêtes, comme ``run_worker --burst`` ; retourne leur nombre"""
+    done = 0
+    while claimed := jobs.claim('tests', 10):
+        for job_id in claimed:
+            jobs.execute(job_id)
+        done += len(claimed)
+    return done
+
+
+def login(client, user, password='motdepasse123!'):
+    """Connecte ``client`` et retourne les jetons"""
+    response = client.post('/api/auth/login/', {'email': user.email, 'password': password}, format='json')
+    tokens = response.data['tokens']
+    client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+    return tokens
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.tokens = login(self.client, self.user)
+
+    def test_authentication_costs_one_query(self):
+        self.client.get('/api/users/me/')  # chargement du filtre
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        response = self.client.post('/api/auth/logout/', {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+        response = APIClient().post('/api/auth/token/refresh/', {'refresh': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_logout_rejects_refresh_token_of_another_user(self):
+        other = login(APIClient(), create_user('bob'))
+        response = self.client.post('/api/auth/logout/', {'refresh': other['refresh']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_revocation_during_rebuild_is_picked_up(self):
+        expires_at = timezone.now() + timedelta(hours=1)
+        for jti in ('a', 'b'):
+            RevokedToken.objects.create(jti=jti, token_type='access', expires_at=expires_at)
+        revoked = RevokedTokenFilter(capacity=1, refresh_interval=0)
+
+        def revoke_meanwhile(*args):
+            # Révocation enregistrée par un autre processus pendant la reconstruction
+            RevokedToken.objects.get_or_create(jti='pendant', token_type='access', expires_at=expires_at)
+            return BloomFilter(*args)
+
+        with mock.patch('api.revocation.BloomFilter', side_effect=revoke_meanwhile):
+            revoked.refresh(force=True)
+        self.assertTrue(revoked.is_revoked('a'))
+        self.assertTrue(revoked.is_revoked('pendant'))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(str(i))
+        self.assertTrue(all(str(i) in bloom for i in range(1000)))
+        false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+        self.assertLess(false_positives, 300)
+
+
+class ThrottlingTests(TestCase):
+    def test_login_bucket_empties_then_refills(self):
+        user = create_user()
+        client = APIClient()
+        credentials = {'email': user.email, 'password': 'motdepasse123!'}
+        now = time.time()
+        # Horloge figée : les hachages ne laissent pas le seau se recharger
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: now):
+            codes = [client.post('/api/auth/login/', credentials, format='json').status_code for _ in range(11)]
+            self.assertEqual(codes, [200] * 10 + [429])
+            response = client.post('/api/auth/login/', credentials, format='json')
+            self.assertIn('Retry-After', response)
+        self.assertEqual(ThrottleBucket.objects.count(), 1)
+
+        # Un jeton rechargé toutes les 6 s pour 10/min
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: now + 6.5):
+            codes = [client.post('/api/auth/login/', credentials, format='json').status_code for _ in range(2)]
+        self.assertEqual(codes, [200, 429])
+
+    def test_vote_routes_share_one_bucket(self):
+        user = create_user(password=None)
+        idea = create_idea(user, create_zone())
+        comment = Comment.objects.create(idea=idea, user=user, content='Bien')
+        client = APIClient()
+        client.force_authenticate(user)
+        now = time.time()
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: now):
+            for i in range(30):
+                client.post(f'/api/ideas/{idea.pk}/vote/', {'is_positive': i % 2 == 0}, format='json')
+            vote = {'idea': idea.pk, 'is_positive': True}
+            self.assertEqual(client.post('/api/votes/', vote, format='json').status_code, 429)
+            comment_vote = {'comment': comment.pk, 'is_positive': True}
+            self.assertEqual(client.post('/api/comment-votes/', comment_vote, format='json').status_code, 429)
+            # Les lectures restent libres
+            self.assertEqual(client.get('/api/votes/').status_code, 200)
+        self.assertFalse(CommentVote.objects.exists())
+
+    def test_prune_removes_full_buckets(self):
+        ThrottleBucket.objects.create(key='plein', full_at=time.time() - 1)
+        ThrottleBucket.objects.create(key='entame', full_at=time.time() + 60)
+        self.assertEqual(TokenBucketThrottle.prune(), 1)
+        self.assertEqual(list(ThrottleBucket.objects.values_list('key', flat=True)), ['entame'])
+
+
+class HashingTests(TestCase):
+    def test_saturated_pool_fails_without_waiting(self):
+        executor = BoundedHashingExecutor(max_workers=1, max_pending=0, retry_after=3)
+        started, release = threading.Event(), threading.Event()
+
+        def slow_hash():
+            started.set()
+            release.wait(5)
+            return 'hash'
+
+        thread = threading.Thread(target=executor.run, args=[slow_hash])
+        thread.start()
+        started.wait(5)
+        begin = time.monotonic()
+        with self.assertRaises(HashingCapacityExceeded) as raised:
+            executor.run(slow_hash)
+        self.assertLess(time.monotonic() - begin, 0.1)
+        self.assertEqual(raised.exception.wait, 3)
+        release.set()
+        thread.join()
+        self.assertEqual(executor.run(lambda: 'hash'), 'hash')
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        self.zone = create_zone()
+        self.voters = [create_user(f'votant{i}', password=None) for i in range(6)]
+        author = create_user(password=None)
+        self.liked = create_idea(author, self.zone, 'Appréciée')
+        self.disputed = create_idea(author, self.zone, 'Disputée')
+        self.ignored = create_idea(author, self.zone, 'Ignorée')
+        for voter in self.voters:
+            votes.cast(self.liked, voter, True)
+        for i, voter in enumerate(self.voters):
+            votes.cast(self.disputed, voter, i % 2 == 0)
+
+    def titles(self, ordering):
+        response = APIClient().get(f'/api/ideas/?ordering={ordering}')
+        self.assertEqual(response.status_code, 200)
+        return [idea['title'] for idea in response.data['results']]
+
+    def test_orderings_use_precomputed_scores(self):
+        self.assertEqual(self.titles('top'), ['Appréciée', 'Disputée', 'Ignorée'])
+        self.assertEqual(self.titles('controversial')[0], 'Disputée')
+        self.assertEqual(self.titles('hot')[0], 'Appréciée')
+        self.assertEqual(APIClient().get('/api/ideas/?ordering=nope').status_code, 400)
+
+    def test_votes_refresh_scores(self):
+        for voter in self.voters:
+            votes.cast(self.liked, voter, False)
+        self.assertEqual(self.titles('top')[-1], 'Appréciée')
+        idea = Idea.objects.get(pk=self.liked.pk)
+        self.assertEqual(idea.wilson_score, 0)
+        self.assertLess(idea.hot_score, 0)
+
+
+class ZoneStatsTests(TestCase):
+    def setUp(self):
+        self.alice = create_user(password=None)
+        self.bob = create_user('bob', password=None)
+        self.centre = create_zone()
+        self.port = create_zone('Port')
+
+    def test_rollup_follows_every_change(self):
+        first = create_idea(self.alice, self.centre)
+        second = create_idea(self.alice, self.centre, category='social')
+        third = create_idea(self.bob, self.port)
+        Vote.objects.create(idea=first, user=self.alice, is_positive=True)
+        vote = Vote.objects.create(idea=first, user=self.bob, is_positive=True)
+        vote.is_positive = False
+        vote.save()
+        Vote.objects.create(idea=third, user=self.alice, is_positive=True)
+        Comment.objects.create(idea=first, user=self.alice, content='Commentaire')
+        Comment.objects.create(idea=third, user=self.alice, content='Commentaire')
+        self.assertEqual(stats.check(), {})
+
+        first.refresh_from_db()
+        first.zone, first.status = self.port, 'approved'
+        first.save()
+        self.assertEqual(stats.check(), {})
+        Vote.objects.get(idea=third, user=self.alice).delete()
+        self.assertEqual(stats.check(), {})
+        second.delete()
+        self.assertEqual(stats.check(), {})
+        self.port.delete()
+        self.assertEqual(stats.check(), {})
+
+    def test_zone_stats_endpoint_reads_the_rollup(self):
+        idea = create_idea(self.alice, self.centre)
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        client.post(f'/api/ideas/{idea.id}/vote/', {'is_positive': True}, format='json')
+        client.post(f'/api/ideas/{idea.id}/comments/', {'content': 'Commentaire'}, format='json')
+        self.assertEqual(stats.check(), {})
+        with self.assertNumQueries(4):
+            self.assertEqual(client.get(f'/api/zones/{self.centre.id}/stats/').status_code, 200)
+
+    def test_rebuild_repairs_the_rollup(self):
+        create_idea(self.alice, self.centre)
+        ZoneStat.objects.all().delete()
+        self.assertNotEqual(stats.check(), {})
+        stats.rebuild()
+        self.assertEqual(stats.check(), {})
+
+
+class ActivityTests(TestCase):
+    def assertBucketsMatchSources(self):
+        stored = {
+            (bucket.granularity, bucket.bucket_start, bucket.zone_id, bucket.category):
+                {field: getattr(bucket, field) for field in activity.COUNTER_FIELDS}
+            for bucket in ActivityBucket.objects.all()
+            if any(getattr(bucket, field) for field in activity.COUNTER_FIELDS)
+        }
+        self.assertEqual(stored, activity.compute_rows())
+
+    def test_buckets_follow_every_change(self):
+        alice, bob = create_user(password=None), create_user('bob', password=None)
+        centre, port = create_zone(), create_zone('Port')
+        first = create_idea(alice, centre)
+        second = create_idea(bob, port, category='social')
+        Vote.objects.create(idea=first, user=alice, is_positive=True)
+        Vote.objects.create(idea=second, user=alice, is_positive=True)
+        comment = Comment.objects.create(idea=first, user=bob, content='Commentaire')
+        CommentVote.objects.create(comment=comment, user=alice, is_positive=True)
+        self.assertBucketsMatchSources()
+
+        first.refresh_from_db()
+        first.category, first.zone = 'social', port
+        first.save()
+        self.assertBucketsMatchSources()
+        bob.delete()
+        self.assertBucketsMatchSources()
+        first.delete()
+        self.assertBucketsMatchSources()
+        activity.rebuild()
+        self.assertBucketsMatchSources()
+
+    def test_timeseries_endpoint(self):
+        alice = create_user(password=None)
+        zone = create_zone()
+        idea = create_idea(alice, zone, category='social')
+        Vote.objects.create(idea=idea, user=alice, is_positive=True)
+
+        response = APIClient().get('/api/stats/timeseries/', {'interval': 'hour'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(point['votes'] for point in response.data['results']), 1)
+        response = APIClient().get('/api/stats/timeseries/', {'interval': 'week', 'zone': zone.id, 'category': 'social'})
+        self.assertEqual([point['ideas'] for point in response.data['results']], [1])
+        response = APIClient().get('/api/stats/timeseries/', {'interval': 'week', 'category': 'transport'})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(APIClient().get('/api/stats/timeseries/', {'interval': 'mois'}).status_code, 400)
+        self.assertEqual(APIClient().get('/api/stats/timeseries/', {'start': 'hier'}).status_code, 400)
+
+
+class ZoneLocatorTests(TestCase):
+    def test_smallest_containing_polygon_wins(self):
+        size, count = 0.001, 20
+        zones = [
+            (i * count + j + 1, 48.8 + (j + 0.5) * size, 2.3 + (i + 0.5) * size,
+             square(2.3 + i * size, 48.8 + j * size, size))
+            for i in range(count) for j in range(count)
+        ]
+        # Zone englobant toute la grille : jamais retenue à l'intérieur d'une case
+        zones.append((0, 48.81, 2.31, square(2.3, 48.8, count * size)))
+        locator = ZoneLocator(zones)
+        points = [(48.8 + random.random() * count * size, 2.3 + random.random() * count * size) for _ in range(500)]
+        for (latitude, longitude), zone_id in zip(points, locator.locate_many(points)):
+            i, j = int((longitude - 2.3) / size), int((latitude - 48.8) / size)
+            self.assertEqual(zone_id, i * count + j + 1)
+        # Hors de tout polygone : zone au centre le plus proche
+        self.assertEqual(locator.locate(48.7, 2.3005), 1)
+
+    def test_ideas_are_assigned_to_their_polygon(self):
+        user = create_user(password=None)
+        polygon = create_zone(geometry=square(2.34, 48.84, 0.02))
+        point = create_zone('Port', latitude=48.95, longitude=2.45)
+        client = APIClient()
+        client.force_authenticate(user)
+        payload = {'title': 'Idée', 'description': 'Description', 'category': 'transport'}
+        response = client.post('/api/ideas/', {**payload, 'latitude': 48.85, 'longitude': 2.35}, format='json')
+        self.assertEqual(response.data['zone'], polygon.id)
+        response = client.post('/api/ideas/', {**payload, 'latitude': 48.94, 'longitude': 2.44}, format='json')
+        self.assertEqual(response.data['zone'], point.id)
+
+        invalid = {'type': 'Polygon', 'coordinates': [[[0, 0]]]}
+        self.assertEqual(client.patch(f'/api/zones/{point.id}/', {'geometry': invalid}, format='json').status_code, 400)
+        response = client.patch(f'/api/zones/{point.id}/', {'geometry': square(2.0, 48.0, 2.0)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        Idea.objects.update(zone=polygon)
+        stats.rebuild()
+        call_command('assign_zones', stdout=io.StringIO())
+        self.assertEqual(Idea.objects.filter(zone=point).count(), 1)
+        self.assertEqual(stats.check(), {})
+
+    def test_malformed_geometry_does_not_break_the_index(self):
+        zones = [
+            (1, 48.85, 2.35, square(2.34, 48.84, 0.02)),
+            (2, 48.95, 2.45, {'type': 'Polygon', 'coordinates': [[[0, 0]]]}),
+            (3, 48.75, 2.25, {'type': 'Polygon', 'coordinates': 'x'}),
+        ]
+        with self.assertLogs('api.spatial', 'WARNING') as logs:
+            locator = ZoneLocator(zones)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(locator.locate(48.85, 2.35), 1)
+        # Zone ignorée : retrouvée par son centre
+        self.assertEqual(locator.locate(48.951, 2.451), 2)
+
+    def test_admin_rejects_malformed_geometry(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.fr', password=None)
+        client = Client()
+        client.force_login(admin)
+        zone = create_zone()
+        form = {'name': 'Centre', 'zone_type': 'neighborhood', 'latitude': 48.85, 'longitude': 2.35, 'description': ''}
+        response = client.post(f'/admin/api/zone/{zone.id}/change/', {
+            **form, 'geometry': json.dumps({'type': 'Polygon', 'coordinates': [[[0, 0]]]}),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Géométrie GeoJSON invalide')
+        zone.refresh_from_db()
+        self.assertIsNone(zone.geometry)
+        response = client.post(f'/admin/api/zone/{zone.id}/change/', {**form, 'geometry': json.dumps(square(2.3, 48.8, 0.1))})
+        self.assertEqual(response.status_code, 302)
+        zone.refresh_from_db()
+        self.assertEqual(zone.geometry['type'], 'Polygon')
+
+
+class SimilarityTests(TestCase):
+    TITLE = 'Piste cyclable rue de Rivoli'
+    DESCRIPTION = 'Créer une piste cyclable sécurisée le long de la rue de Rivoli.'
+
+    def setUp(self):
+        self.user = create_user(password=None)
+        self.zone = create_zone()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, title, description, latitude=48.85, category='transport'):
+        response = self.client.post('/api/ideas/', {
+            'title': title, 'description': description, 'category': category,
+            'latitude': latitude, 'longitude': 2.35, 'zone': self.zone.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['possible_duplicates']
+
+    def test_creation_reports_near_duplicates(self):
+        self.assertEqual(self.post(self.TITLE, self.DESCRIPTION), [])
+        duplicates = self.post('Pistes cyclables rue Rivoli', 'Créer des pistes cyclables sécurisées rue de Rivoli')
+        self.assertEqual(len(duplicates), 1)
+        self.assertEqual(self.post(self.TITLE, self.DESCRIPTION, category='social'), [])
+        self.assertEqual(self.post(self.TITLE, self.DESCRIPTION, latitude=48.95), [])
+
+        first = Idea.objects.get(pk=duplicates[0]['id'])
+        self.assertEqual(len(self.client.get(f'/api/ideas/{first.id}/similar/').data), 1)
+        first.title, first.description = 'Tout autre chose', 'Rien à voir'
+        first.save()
+        self.assertEqual(self.client.get(f'/api/ideas/{first.id}/similar/').data, [])
+
+    def test_hidden_ideas_are_not_duplicates(self):
+        self.post(self.TITLE, self.DESCRIPTION)
+        deletion.soft_delete(self.user)
+        other = create_user('bob', password=None)
+        self.assertEqual(similarity.find_similar(self.TITLE, self.DESCRIPTION, 'transport', 48.85, 2.35), [])
+        create_idea(other, self.zone, self.TITLE, description=self.DESCRIPTION)
+        self.assertEqual(similarity.duplicate_groups(), [])
+
+    def test_duplicate_groups(self):
+        def idea(title, description):
+            return create_idea(self.user, self.zone, title, description=description).pk
+
+        first = idea(self.TITLE, 'Créer une piste cyclable sécurisée rue de Rivoli')
+        second = idea('Pistes cyclables rue de Rivoli', 'Créer des pistes cyclables sécurisées rue de Rivoli')
+        third = idea('Piste cyclable rue Rivoli', 'Une piste cyclable sécurisée rue de Rivoli svp')
+        idea('Bancs au parc', 'Installer des bancs')
+        with mock.patch.object(similarity, 'VERIFY_BATCH_SIZE', 1):
+            self.assertEqual(similarity.duplicate_groups(rebuild_index=True), [(first, second, third)])
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', email='admin@example.fr', password=None)
+        self.client.force_login(self.admin)
+        users = [create_user(f'citoyen{i}', password=None) for i in range(10)]
+        self.zones = [create_zone(f'Zone {i}') for i in range(5)]
+        for i in range(30):
+            idea = create_idea(users[i % 10], self.zones[i % 5], f'Idée {i}')
+            comment = Comment.objects.create(idea=idea, user=users[i % 10], content='Commentaire')
+            CommentVote.objects.create(comment=comment, user=users[(i + 1) % 10], is_positive=True)
+            Vote.objects.create(idea=idea, user=users[(i + 2) % 10], is_positive=True)
+
+    def test_changelists_cost_a_bounded_number_of_queries(self):
+        for model in ('user', 'zone', 'idea', 'vote', 'comment', 'commentvote', 'revokedtoken'):
+            self.client.get(f'/admin/api/{model}/')
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/admin/api/{model}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertLess(len(queries), 12, model)
+        response = self.client.get('/admin/api/zone/')
+        self.assertContains(response, '<td class="field-idea_count">6</td>')
+        response = self.client.get('/admin/api/comment/')
+        self.assertContains(response, '<td class="field-vote_count">1</td>')
+
+    def test_move_to_zone_offers_only_live_zones(self):
+        deleted = self.zones[4]
+        deleted.deleted_at = deleted.created_at
+        deleted.save(update_fields=['deleted_at'])
+        response = self.client.get('/admin/api/idea/')
+        self.assertNotContains(response, f'<option value="{self.zones[0].pk}"')
+
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'api', 'model_name': 'idea', 'field_name': 'zone', 'term': 'Zone',
+        })
+        self.assertEqual(
+            sorted(int(result['id']) for result in response.json()['results']),
+            [zone.pk for zone in self.zones[:4]],
+        )
+
+        ideas = list(Idea.objects.filter(zone=self.zones[0]).values_list('pk', flat=True))
+        for zone in (deleted, self.zones[1]):
+            self.client.post('/admin/api/idea/', {
+                'action': 'move_to_zone', '_selected_action': ideas, 'zone': zone.pk,
+            })
+        self.assertEqual(run_jobs(), 1)
+        self.assertEqual(Idea.objects.filter(zone=deleted).count(), 6)
+        self.assertEqual(Idea.objects.filter(zone=self.zones[1]).count(), 12)
+
+
+class ModerationTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_superuser(username='admin', email='admin@example.fr', password=None)
+        users = [create_user(f'citoyen{i}', password=None) for i in range(6)]
+        self.zones = [create_zone(f'Zone {i}') for i in range(3)]
+        for i in range(30):
+            idea = create_idea(users[i % 6], self.zones[i % 3], f'Idée {i}', category=('transport', 'social')[i % 2])
+            for j in range(3):
+                Vote.objects.create(idea=idea, user=users[(i + j) % 6], is_positive=(i + j) % 3 > 0)
+            comment = Comment.objects.create(idea=idea, user=users[0], content='Commentaire')
+            CommentVote.objects.create(comment=comment, user=users[1], is_positive=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def assertRollupsConsistent(self):
+        self.assertEqual(stats.check(), {})
+
+        def buckets():
+            rows = ActivityBucket.objects.values_list('granularity', 'bucket_start', 'zone_id', 'category', *activity.COUNTER_FIELDS)
+            return sorted(row for row in rows if any(row[4:]))
+
+        live = buckets()
+        activity.rebuild()
+        self.assertEqual(live, buckets())
+
+    def test_api_queues_the_operation(self):
+        payload = {'action': 'status', 'status': 'approved', 'filters': {'zone': self.zones[0].id}}
+        response = self.client.post('/api/moderation/', payload, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['state'], 'pending')
+        self.assertFalse(Idea.objects.filter(status='approved').exists())
+        self.assertEqual(run_jobs(), 1)
+        response = self.client.get(f"/api/moderation/{response.data['id']}/")
+        self.assertEqual((response.data['state'], response.data['processed'], response.data['affected']), ('done', 10, 10))
+        self.assertRollupsConsistent()
+
+    def test_operations_are_applied_in_chunks(self):
+        ids = list(Idea.objects.order_by('pk').values_list('pk', flat=True)[:20])
+        job = ModerationJob.objects.create(action='zone', params={'ids': ids, 'zone': self.zones[2].id})
+        moderation.run(job, chunk_size=7)
+        self.assertEqual((job.state, job.processed, job.total, job.affected), ('done', 20, 20, 14))
+        self.assertRollupsConsistent()
+
+        job = ModerationJob.objects.create(action='delete', params={'ids': ids[:12]})
+        moderation.run(job, chunk_size=5)
+        self.assertEqual(job.affected, 12)
+        self.assertEqual(Idea.objects.count(), 18)
+        self.assertFalse(Vote.objects.filter(idea_id__in=ids[:12]).exists())
+        self.assertFalse(CommentVote.objects.filter(comment__idea_id__in=ids[:12]).exists())
+        self.assertRollupsConsistent()
+
+    def test_invalid_requests_are_rejected(self):
+        invalid = [
+            {'action': 'zone', 'ids': [1]},
+            {'action': 'delete', 'filters': {'zone': 'abc'}},
+            {'action': 'delete', 'filters': {'status': 'inconnu'}},
+            {'action': 'delete', 'filters': {'couleur': 'rouge'}},
+            {'action': 'purge_zone', 'ids': [1]},
+        ]
+        for payload in invalid:
+            self.assertEqual(self.client.post('/api/moderation/', payload, format='json').status_code, 400, payload)
+        self.assertFalse(ModerationJob.objects.exists())
+        citizen = APIClient()
+        citizen.force_authenticate(User.objects.get(username='citoyen1'))
+        response = citizen.post('/api/moderation/', {'action': 'delete', 'ids': [1]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_admin_actions_are_queued(self):
+        admin_client = Client()
+        admin_client.force_login(self.staff)
+        ids = list(Idea.objects.values_list('pk', flat=True)[:10])
+        admin_client.post('/admin/api/idea/', {'action': 'set_status_rejected', '_selected_action': ids})
+        self.assertEqual(Job.objects.filter(task='moderation').count(), 1)
+        self.assertEqual(run_jobs(), 1)
+        self.assertEqual(Idea.objects.filter(status='rejected').count(), 10)
+        admin_client.post('/admin/api/idea/', {'action': 'bulk_delete', '_selected_action': ids})
+        run_jobs()
+        self.assertFalse(Idea.objects.filter(pk__in=ids).exists())
+        self.assertRollupsConsistent()
+        self.assertEqual(admin_client.get('/admin/api/moderationjob/').status_code, 200)
+
+
+class EventStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.users = [create_user(f'citoyen{i}', password=None) for i in range(3)]
+        self.zone = create_zone()
+        self.idea = create_idea(self.users[0], self.zone)
+
+    async def read_events(self, stream, count, timeout):
+        events = []
+
+        async def read():
+            async for chunk in stream:
+                chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+                if chunk.startswith('event'):
+                    events.append(chunk)
+                    if len(events) == count:
+                        return
+
+        try:
+            await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return events
+
+    async def test_votes_and_comments_reach_idea_and_zone_streams(self):
+        client = AsyncClient()
+        self.assertEqual((await client.get('/api/stream/')).status_code, 400)
+        self.assertEqual((await client.get('/api/stream/?idea=999')).status_code, 404)
+        streams = []
+        for url in (f'/api/stream/?idea={self.idea.id}', f'/api/stream/?zone={self.zone.id}'):
+            response = await client.get(url)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = response.streaming_content.__aiter__()
+            await stream.__anext__()
+            streams.append(stream)
+
+        @transaction.atomic
+        def activity_burst():
+            # Notifications émises ensemble à la validation : un seul événement de compteurs
+            for user in self.users:
+                Vote.objects.create(idea=self.idea, user=user, is_positive=True)
+            Comment.objects.create(idea=self.idea, user=self.users[1], content='Commentaire')
+
+        await sync_to_async(activity_burst)()
+        for events in await asyncio.gather(*[self.read_events(stream, 2, 1.0) for stream in streams]):
+            self.assertEqual(sorted(event.split('\n')[0] for event in events), ['event: comment', 'event: counts'])
+            counts = json.loads(next(event for event in events if 'counts' in event).split('data: ')[1])
+            self.assertEqual((counts['vote_count'], counts['comment_count']), (3, 1))
+        # Déconnexion : les abonnements sont libérés
+        await asyncio.gather(*[self.read_events(stream, 1, 0.05) for stream in streams])
+        self.assertFalse(broker._subscribers)
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.alice = create_user(password=None)
+        self.bob = create_user('bob', password=None)
+        self.zone = create_zone()
+        self.ideas = [create_idea(self.alice, self.zone, f'Idée {i}') for i in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def sync(self, token=None, **params):
+        if token:
+            params['since'] = token
+        return self.client.get('/api/sync/', params)
+
+    def test_changes_since_token(self):
+        full = self.sync().data
+        self.assertEqual((len(full['ideas']), len(full['zones'])), (5, 1))
+        token = full['token']
+        self.assertEqual(self.sync(token).data['ideas'], [])
+
+        Vote.objects.create(idea=self.ideas[0], user=self.alice, is_positive=True)
+        Vote.objects.create(idea=self.ideas[0], user=self.bob, is_positive=False)
+        Comment.objects.create(idea=self.ideas[1], user=self.bob, content='Commentaire')
+        delta = self.sync(token).data
+        # Seuls les votes de l'utilisateur sont synchronisés
+        self.assertEqual([vote['idea'] for vote in delta['votes']], [self.ideas[0].id])
+        ideas = {idea['id']: idea for idea in delta['ideas']}
+        self.assertEqual(sorted(ideas), [self.ideas[0].id, self.ideas[1].id])
+        self.assertEqual(ideas[self.ideas[0].id]['votesStats']['total'], 2)
+        self.assertEqual(len(delta['comments']), 1)
+
+        token = delta['token']
+        deleted_id = self.ideas[1].id
+        self.ideas[1].delete()
+        delta = self.sync(token).data
+        self.assertEqual((delta['deleted']['ideas'], delta['deleted']['comments']), ([deleted_id], []))
+        # Une ligne par objet dans le journal
+        self.assertEqual(ChangeLog.objects.filter(kind='idea', object_id=self.ideas[0].id).count(), 1)
+        self.assertTrue(self.sync(limit=2).data['has_more'])
+        self.assertEqual(APIClient().get('/api/sync/').data['votes'], [])
+
+    def test_hidden_subjects_are_reported_deleted(self):
+        token = self.sync().data['token']
+        comment = Comment.objects.create(idea=self.ideas[0], user=self.bob, content='Commentaire')
+        deletion.soft_delete(self.alice)
+        delta = self.sync(token).data
+        self.assertEqual(delta['comments'], [])
+        self.assertEqual(delta['deleted']['comments'], [comment.id])
+        self.assertIn(self.ideas[0].id, delta['deleted']['ideas'])
+
+    def test_invalid_and_expired_tokens(self):
+        self.assertEqual(self.sync('nimportequoi').status_code, 400)
+        expired = changelog.make_token(1, timezone.now() - timedelta(days=31))
+        self.assertEqual(self.sync(expired).status_code, 410)
+        self.assertEqual(self.sync(limit='beaucoup').status_code, 400)
+
+
+class BatchFetchTests(TestCase):
+    def setUp(self):
+        users = [create_user(f'citoyen{i}', password=None) for i in range(3)]
+        self.zones = [create_zone(f'Zone {i}') for i in range(4)]
+        self.ids = []
+        for i in range(30):
+            idea = create_idea(users[i % 3], self.zones[i % 4], f'Idée {i}')
+            comment = Comment.objects.create(idea=idea, user=users[1], content='Commentaire')
+            CommentVote.objects.create(comment=comment, user=users[2], is_positive=True)
+            self.ids.append(idea.id)
+        self.client = APIClient()
+
+    def batch(self, ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/ideas/batch/', {'ids': ids}, format='json')
+        return response, len(queries)
+
+    def test_batch_cost_does_not_depend_on_its_size(self):
+        few, few_queries = self.batch(self.ids[:5])
+        many, many_queries = self.batch(self.ids[::-1] + [9999])
+        self.assertEqual(few_queries, many_queries)
+        self.assertEqual([idea['id'] for idea in many.data['results']], self.ids[::-1])
+        self.assertEqual(many.data['missing'], [9999])
+        self.assertEqual(many.data['results'][0]['zone']['idea_count'], 8)
+
+    def test_ids_filter_keeps_the_requested_order(self):
+        wanted = self.ids[:5][::-1] + [9999]
+        response = self.client.get('/api/ideas/', {'ids': ','.join(map(str, wanted))})
+        self.assertEqual([idea['id'] for idea in response.data['results']], wanted[:-1])
+        self.assertEqual(response.data['missing'], [9999])
+        response = self.client.get('/api/zones/', {'ids': f'{self.zones[2].id},{self.zones[0].id}'})
+        self.assertEqual([zone['idea_count'] for zone in response.data['results']], [7, 8])
+        self.assertEqual(self.client.get('/api/ideas/', {'ids': 'a,b'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/ideas/batch/', {'ids': 'nope'}, format='json').status_code, 400)
+
+
+class MyVoteTests(TestCase):
+    def setUp(self):
+        author = create_user(password=None)
+        self.voter = create_user('bob', password=None)
+        zone = create_zone()
+        self.ideas = []
+        for i in range(20):
+            idea = create_idea(author, zone, f'Idée {i}')
+            comment = Comment.objects.create(idea=idea, user=author, content='Commentaire')
+            if i % 2:
+                Vote.objects.create(idea=idea, user=self.voter, is_positive=bool(i % 3))
+                CommentVote.objects.create(comment=comment, user=self.voter, is_positive=True)
+            self.ideas.append(idea)
+        self.client = APIClient()
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, len(queries)
+
+    def test_list_reports_the_vote_of_the_user(self):
+        anonymous, _ = self.get('/api/ideas/', page_size=5)
+        self.assertTrue(all(idea['my_vote'] is None for idea in anonymous.data['results']))
+        self.client.force_authenticate(self.voter)
+        _, few_queries = self.get('/api/ideas/', page_size=5)
+        response, many_queries = self.get('/api/ideas/', page_size=20)
+        self.assertEqual(few_queries, many_queries)
+        votes_by_idea = {vote.idea_id: vote for vote in Vote.objects.filter(user=self.voter)}
+        for idea in response.data['results']:
+            vote = votes_by_idea.get(idea['id'])
+            self.assertEqual(idea['my_vote'], vote and {'id': vote.id, 'is_positive': vote.is_positive})
+
+    def test_detail_vote_and_comments_report_the_vote(self):
+        self.client.force_authenticate(self.voter)
+        self.assertIsNotNone(self.client.get(f'/api/ideas/{self.ideas[1].id}/').data['my_vote'])
+        response = self.client.post(f'/api/ideas/{self.ideas[0].id}/vote/', {'is_positive': True}, format='json')
+        self.assertTrue(response.data['idea']['my_vote']['is_positive'])
+        response = self.client.delete(f'/api/ideas/{self.ideas[0].id}/unvote/')
+        self.assertIsNone(response.data['idea']['my_vote'])
+        comments = self.client.get(f'/api/ideas/{self.ideas[1].id}/comments/').data['results']
+        self.assertTrue(comments[0]['my_vote']['is_positive'])
+
+
+class CoordinateTests(TestCase):
+    def setUp(self):
+        self.user = create_user(password=None)
+        self.zone = create_zone(latitude=48.8566, longitude=2.3522)
+        self.idea = create_idea(self.user, self.zone, latitude=48.856612345678, longitude=2.352212345678)
+        # 0,9 km à l'est : dans le rayon d'1 km seulement avec la correction cos(lat)
+        self.east = create_idea(self.user, self.zone, 'Est', latitude=48.8566, longitude=2.3522 + 0.9 / (111 * 0.6579))
+        self.client = APIClient()
+
+    def test_coordinates_are_rounded_floats(self):
+        self.assertEqual(self.client.get(f'/api/ideas/{self.idea.id}/').data['position'], {'lat': 48.856612, 'lng': 2.352212})
+        with override_settings(COORDINATE_PRECISION=3):
+            zone = self.client.get(f'/api/zones/{self.zone.id}/').data
+            self.assertEqual((zone['latitude'], zone['longitude']), (48.857, 2.352))
+        self.assertIsInstance(self.client.get('/api/ideas/').json()['results'][0]['position']['lat'], float)
+
+    def test_near_me_corrects_longitude_distances(self):
+        response = self.client.get('/api/ideas/near_me/', {'lat': 48.8566, 'lng': 2.3522, 'radius': 1})
+        self.assertEqual({idea['id'] for idea in response.data}, {self.idea.id, self.east.id})
+        self.assertEqual(self.client.get('/api/ideas/near_me/', {'lat': 'x', 'lng': 2}).status_code, 400)
+
+    def test_out_of_range_latitude_is_rejected(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/ideas/', {
+            'title': 'Idée', 'description': 'Description', 'category': 'transport',
+            'latitude': 91, 'longitude': 2, 'zone': self.zone.id,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('latitude', response.data)
+
+
+def decode_map(content):
+    """Décode le format binaire de /api/ideas/map/ en colonnes, comme la réponse JSON"""
+    _, _, precision, count, truncated = mapdata.HEADER.unpack_from(content)
+    position = mapdata.HEADER.size
+
+    def labels():
+        nonlocal position
+        values = []
+        position += 1
+        for _ in range(content[position - 1]):
+            length = content[position]
+            values.append(content[position + 1:position + 1 + length].decode())
+            position += 1 + length
+        return values
+
+    def varints():
+        nonlocal position
+        values = []
+        for _ in range(count):
+            shift = value = 0
+            while True:
+                byte = content[position]
+                position += 1
+                value |= (byte & 0x7F) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            values.append((value >> 1) ^ -(value & 1))
+        return values
+
+    categories, statuses = labels(), labels()
+    columns = {name: varints() for name in ('id', 'lat', 'lng')}
+    columns['category'] = list(content[position:position + count])
+    columns['status'] = list(content[position + count:position + 2 * count])
+    position += 2 * count
+    columns['votes'] = varints()
+    assert position == len(content)
+    return dict(columns, precision=precision, count=count, truncated=bool(truncated),
+                categories=categories, statuses=statuses)
+
+
+class MapTests(TestCase):
+    BBOX = '2,48,3,49'
+
+    def setUp(self):
+        user = create_user(password=None)
+        zone = create_zone()
+        for i in range(40):
+            create_idea(
+                user, zone, f'Idée {i}', latitude=48.80 + i * 0.00313, longitude=2.30 - i * 0.00171,
+                category=('transport', 'social', 'mobility')[i % 3], status='proposed' if i % 2 else 'approved',
+                vote_count=i % 5,
+            )
+        create_idea(user, zone, 'Ailleurs', latitude=10, longitude=10)
+        self.client = APIClient()
+
+    def points(self, payload):
+        """Points (id, lat, lng, catégorie, statut, votes) d'une réponse en colonnes delta"""
+        scale = 10 ** payload['precision']
+        ids, lats, lngs = (list(itertools.accumulate(payload[name])) for name in ('id', 'lat', 'lng'))
+        return sorted(zip(
+            ids, [lat / scale for lat in lats], [lng / scale for lng in lngs],
+            [payload['categories'][code] for code in payload['category']],
+            [payload['statuses'][code] for code in payload['status']], payload['votes'],
+        ))
+
+    def expected(self, **filters):
+        ideas = Idea.objects.filter(latitude__gt=48, **filters)
+        return sorted(
+            (idea.id, round(idea.latitude, 5), round(idea.longitude, 5), idea.category, idea.status, idea.vote_count)
+            for idea in ideas
+        )
+
+    def test_json_and_binary_payloads_carry_the_same_points(self):
+        payload = self.client.get('/api/ideas/map/', {'bbox': self.BBOX}).json()
+        self.assertEqual(payload['count'], 40)
+        self.assertEqual(self.points(payload), self.expected())
+        response = self.client.get('/api/ideas/map/', {'bbox': self.BBOX, 'format': 'bin'})
+        self.assertEqual(response['Content-Type'], 'application/vnd.ma-rue-ideale.map')
+        self.assertEqual(self.points(decode_map(response.content)), self.expected())
+        payload = self.client.get('/api/ideas/map/', {'bbox': self.BBOX, 'category': 'social', 'status': 'approved'}).json()
+        self.assertEqual(self.points(payload), self.expected(category='social', status='approved'))
+
+    def test_truncation_keeps_the_most_voted_points(self):
+        with override_settings(MAP={'MAX_POINTS': 10}):
+            payload = self.client.get('/api/ideas/map/', {'bbox': self.BBOX}).json()
+        self.assertTrue(payload['truncated'])
+        self.assertEqual(payload['count'], 10)
+        self.assertTrue(all(votes in (3, 4) for votes in payload['votes']))
+
+    def test_invalid_bounding_boxes(self):
+        self.assertEqual(self.client.get('/api/ideas/map/', {'bbox': '3,48,2,49'}).status_code, 400)
+        response = self.client.get('/api/ideas/map/', {'bbox': 'x', 'format': 'bin'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'error', response.content)
+        self.assertEqual(self.client.get('/api/ideas/map/', {'bbox': '0,0,1,1'}).json()['count'], 0)
+
+
+class HeatmapTests(TestCase):
+    BBOX = (2.3, 48.8, 2.4, 48.9)
+    PARAMS = {'bbox': '2.3,48.8,2.4,48.9', 'resolution': 8, 'category': 'social'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(password=None)
+        zone = create_zone()
+        rng = random.Random(3)
+        self.ideas = [
+            create_idea(
+                self.user, zone, f'Idée {i}', latitude=48.8 + rng.random() * 0.1, longitude=2.3 + rng.random() * 0.1,
+                category=('transport', 'social')[i % 2], vote_count=i % 4,
+            )
+            for i in range(200)
+        ]
+        # Sur le bord supérieur de l'emprise : compté dans la dernière cellule
+        create_idea(self.user, zone, 'Bord', latitude=48.9, longitude=2.4, category='social')
+        self.client = APIClient()
+
+    def test_grid_weights_ideas_by_votes(self):
+        grid, count = heatmap.compute(self.BBOX, 10, use_numpy=False)
+        self.assertEqual(count, 201)
+        self.assertEqual(sum(map(sum, grid)), sum(1 + idea.vote_count for idea in Idea.objects.all()))
+        self.assertGreaterEqual(grid[-1][-1], 1)
+
+    @unittest.skipIf(heatmap.np is None, 'NumPy non installé')
+    def test_python_and_numpy_grids_match(self):
+        for smooth in (0, 1.5):
+            for resolution in (4, 37):
+                python_grid, python_count = heatmap.compute(self.BBOX, resolution, smooth, use_numpy=False)
+                numpy_grid, numpy_count = heatmap.compute(self.BBOX, resolution, smooth, use_numpy=True)
+                self.assertEqual(python_count, numpy_count)
+                for python_row, numpy_row in zip(python_grid, numpy_grid):
+                    for python_value, numpy_value in zip(python_row, numpy_row):
+                        self.assertAlmostEqual(python_value, numpy_value, places=9)
+
+    def test_cached_grid_until_a_vote_is_committed(self):
+        first = self.client.get('/api/ideas/heatmap/', self.PARAMS)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(len(first.data['grid']), 64)
+        self.assertEqual(first.data['count'], 101)
+        with CaptureQueriesContext(connection) as queries:
+            # Paramètre sans effet sur la grille : même entrée de cache
+            again = self.client.get('/api/ideas/heatmap/', dict(self.PARAMS, page=3))
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(again.data, first.data)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(idea=self.ideas[3], user=self.user, is_positive=True)
+            self.ideas[3].update_vote_stats()
+        updated = self.client.get('/api/ideas/heatmap/', self.PARAMS)
+        self.assertNotEqual(updated.data['grid'], first.data['grid'])
+
+    def test_invalid_parameters(self):
+        for params in (
+            {'bbox': 'x'}, dict(self.PARAMS, resolution=0), dict(self.PARAMS, smooth=9), dict(self.PARAMS, smooth='nan'),
+        ):
+            self.assertEqual(self.client.get('/api/ideas/heatmap/', params).status_code, 400)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        caches['idempotency'].clear()
+        self.user = create_user(password=None)
+        self.zone = create_zone()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.body = {
+            'title': 'Piste cyclable', 'description': 'Description', 'category': 'transport',
+            'latitude': 48.85, 'longitude': 2.35, 'zone': self.zone.id,
+        }
+
+    def post(self, body, key, client=None, url='/api/ideas/'):
+        return (client or self.client).post(url, body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_response(self):
+        first = self.post(self.body, 'k1')
+        self.assertEqual(first.status_code, 201)
+        again = self.post(self.body, 'k1')
+        self.assertEqual(again.status_code, 201)
+        self.assertEqual(again[idempotency.REPLAY_HEADER], 'true')
+        self.assertEqual(again.json(), first.json())
+        self.assertEqual(Idea.objects.count(), 1)
+        # Sans clé, chaque requête crée une idée
+        self.client.post('/api/ideas/', self.body, format='json')
+        self.assertEqual(Idea.objects.count(), 2)
+
+    def test_keys_are_scoped_to_the_user(self):
+        self.post(self.body, 'k1')
+        other = APIClient()
+        other.force_authenticate(create_user('bob', password=None))
+        self.assertEqual(self.post(self.body, 'k1', other).status_code, 201)
+        self.assertEqual(Idea.objects.count(), 2)
+
+    def test_key_reused_for_another_body(self):
+        self.post(self.body, 'k1')
+        self.assertEqual(self.post(dict(self.body, title='Autre'), 'k1').status_code, 422)
+
+    def test_failures_are_not_stored(self):
+        self.assertEqual(self.post({'title': 'Incomplète'}, 'k2').status_code, 400)
+        self.assertEqual(self.post({'title': 'Incomplète'}, 'k2').status_code, 400)
+        self.assertEqual(self.post(self.body, 'k2').status_code, 201)
+
+    def test_request_in_flight_with_the_same_key(self):
+        request = mock.Mock(user=self.user, path='/api/ideas/')
+        caches['idempotency'].add(
+            idempotency.cache_key(request, 'k3'), (idempotency.PENDING, idempotency.fingerprint(mock.Mock(data=self.body))),
+        )
+        self.assertEqual(self.post(self.body, 'k3').status_code, 409)
+        self.assertEqual(Idea.objects.count(), 0)
+
+    def test_key_too_long(self):
+        self.assertEqual(self.post(self.body, 'k' * (idempotency.MAX_KEY_LENGTH + 1)).status_code, 400)
+
+    def test_comment_and_vote_replay(self):
+        idea = create_idea(self.user, self.zone)
+        for _ in range(2):
+            response = self.post({'content': 'Bravo'}, 'c1', url=f'/api/ideas/{idea.id}/comments/')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(Comment.objects.count(), 1)
+        for _ in range(2):
+            response = self.post({'is_positive': True}, 'v1', url=f'/api/ideas/{idea.id}/vote/')
+        self.assertEqual(response.json()['message'], 'Vote ajouté')
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+class VoteTests(TestCase):
+    def setUp(self):
+        self.user = create_user(password=None)
+        self.idea = create_idea(self.user, create_zone())
+        self.comment = Comment.objects.create(idea=self.idea, user=self.user, content='Bravo')
+
+    def counts(self):
+        self.idea.refresh_from_db()
+        return self.idea.vote_count, self.idea.positive_votes, self.idea.negative_votes
+
+    def test_cast_flip_and_retract(self):
+        self.assertIsNone(votes.cast(self.idea, self.user, True))
+        self.assertEqual(self.counts(), (1, 1, 0))
+        # Même vote : rien n'est écrit
+        self.assertIs(votes.cast(self.idea, self.user, True), True)
+        self.assertEqual(self.counts(), (1, 1, 0))
+        self.assertIs(votes.cast(self.idea, self.user, False), True)
+        self.assertEqual(self.counts(), (1, 0, 1))
+        self.assertFalse(Vote.objects.get().is_positive)
+        self.assertTrue(votes.retract(self.idea, self.user))
+        self.assertFalse(votes.retract(self.idea, self.user))
+        self.assertEqual(self.counts(), (0, 0, 0))
+        self.assertEqual(votes.recount(Idea.objects.all()), [])
+
+    def test_comment_votes(self):
+        self.assertIsNone(votes.cast_comment_vote(self.comment, self.user, False))
+        self.assertIs(votes.cast_comment_vote(self.comment, self.user, False), False)
+        self.assertIs(votes.cast_comment_vote(self.comment, self.user, True), False)
+        self.assertTrue(CommentVote.objects.get().is_positive)
+        self.assertTrue(votes.retract_comment_vote(self.comment, self.user))
+        self.assertFalse(CommentVote.objects.exists())
+
+    def test_response_messages(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for is_positive, message in ((True, 'Vote ajouté'), (True, 'Vote inchangé'), (False, 'Vote modifié')):
+            response = client.post(f'/api/ideas/{self.idea.id}/vote/', {'is_positive': is_positive}, format='json')
+            self.assertEqual(response.json()['message'], message)
+            response = client.post(f'/api/comments/{self.comment.id}/vote/', {'is_positive': is_positive}, format='json')
+            self.assertEqual(response.json()['message'], message)
+        self.assertEqual(client.post(f'/api/ideas/{self.idea.id}/vote/', {'is_positive': 'peut-être'}, format='json').status_code, 400)
+
+    def test_vote_routes_write_through_votes(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/votes/', {'idea': self.idea.id, 'is_positive': True}, format='json')
+        self.assertEqual(response.status_code, 201)
+        # Second POST : le vote est inversé, sans violer l'unicité
+        response = client.post('/api/votes/', {'idea': self.idea.id, 'is_positive': False}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(response.data['is_positive'])
+        self.assertEqual(self.counts(), (1, 0, 1))
+        vote_id = response.data['id']
+        response = client.patch(f'/api/votes/{vote_id}/', {'is_positive': True}, format='json')
+        self.assertTrue(response.data['is_positive'])
+        self.assertEqual(self.counts(), (1, 1, 0))
+        self.assertEqual(stats.check(), {})
+        self.assertEqual(client.delete(f'/api/votes/{vote_id}/').status_code, 204)
+        self.assertEqual(self.counts(), (0, 0, 0))
+        self.assertEqual(votes.recount(Idea.objects.all()), [])
+        self.assertEqual(stats.check(), {})
+
+        response = client.post('/api/comment-votes/', {'comment': self.comment.id, 'is_positive': True}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = client.post('/api/comment-votes/', {'comment': self.comment.id, 'is_positive': False}, format='json')
+        self.assertFalse(CommentVote.objects.get().is_positive)
+        self.assertEqual(client.delete(f"/api/comment-votes/{response.data['id']}/").status_code, 204)
+        self.assertFalse(CommentVote.objects.exists())
+
+    def test_update_vote_stats_recounts_in_place(self):
+        other = create_user('bob', password=None)
+        Vote.objects.create(idea=self.idea, user=self.user, is_positive=True)
+        # Vote écrit sans passer par le modèle : l'idée en mémoire est périmée
+        votes.cast(self.idea, other, False)
+        stale = Idea.objects.get(pk=self.idea.pk)
+        Idea.objects.filter(pk=self.idea.pk).update(vote_count=0, positive_votes=0, negative_votes=0)
+        stale.update_vote_stats()
+        self.assertEqual((stale.vote_count, stale.positive_votes, stale.negative_votes), (2, 1, 1))
+        self.assertEqual(self.counts(), (2, 1, 1))
+        self.assertEqual(votes.recount(Idea.objects.all()), [])
+
+
+class ConcurrentVoteTests(TransactionTestCase):
+    THREADS = 6
+    OPERATIONS = 40
+
+    def test_concurrent_casts_flips_and_retracts(self):
+        users = [create_user(f'votant{index}', password=None) for index in range(3)]
+        idea = create_idea(users[0], create_zone())
+        errors = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            barrier.wait()
+            try:
+                for _ in range(self.OPERATIONS):
+                    user = rng.choice(users)
+                    if rng.random() < 0.7:
+                        votes.cast(idea, user, rng.random() < 0.5)
+                    else:
+                        votes.retract(idea, user)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # Aucune idée à corriger : les compteurs correspondent à la table des votes
+        self.assertEqual(votes.recount(Idea.objects.all()), [])
+        idea.refresh_from_db()
+        positive = Vote.objects.filter(idea=idea, is_positive=True).count()
+        negative = Vote.objects.filter(idea=idea, is_positive=False).count()
+        self.assertEqual((idea.vote_count, idea.positive_votes, idea.negative_votes), (positive + negative, positive, negative))
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.alice = create_user(password=None)
+        self.bob = create_user('bob', password=None)
+        self.zones = [create_zone(), create_zone('Gare', 48.8, 2.3)]
+        self.ideas = []
+        for i in range(10):
+            idea = create_idea(self.alice, self.zones[i % 2], f'Idée {i}')
+            comment = Comment.objects.create(idea=idea, user=self.alice, content='Bravo')
+            if i % 2:
+                Vote.objects.create(idea=idea, user=self.bob, is_positive=bool(i % 3))
+                CommentVote.objects.create(comment=comment, user=self.bob, is_positive=True)
+            self.ideas.append(idea)
+        self.client = APIClient()
+
+    def get(self, url='/api/ideas/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content), len(queries.captured_queries)
+
+    def assert_uncached(self, data, user=None):
+        """Compare une réponse au rendu de chaque idée sans cache"""
+        ideas = {idea.pk: idea for idea in Idea.objects.all()}
+        context = vote_context(mock.Mock(user=user), list(ideas.values())) if user else {}
+        self.assertEqual(len(data['results']), len(ideas))
+        for item in data['results']:
+            expected = IdeaListSerializer(ideas[item['id']], context=context).data
+            self.assertEqual(item, json.loads(json.dumps(expected, cls=DjangoJSONEncoder)))
+
+    def test_cached_fragments_save_queries(self):
+        first, missed = self.get()
+        again, hit = self.get()
+        self.assertLess(hit, missed)
+        self.assertEqual(again, first)
+        self.assert_uncached(again)
+
+    def test_personal_fields_are_not_cached(self):
+        self.get()
+        self.client.force_authenticate(self.bob)
+        data, _ = self.get()
+        self.assert_uncached(data, self.bob)
+        self.assertTrue(any(item['my_vote'] for item in data['results']))
+        self.client.force_authenticate(None)
+        data, _ = self.get()
+        self.assertTrue(all(item['my_vote'] is None for item in data['results']))
+
+    def test_writes_refresh_the_fragments(self):
+        self.get()
+        self.client.force_authenticate(self.alice)
+        self.client.post(f'/api/ideas/{self.ideas[0].id}/vote/', {'is_positive': True}, format='json')
+        self.client.post(f'/api/comments/{self.ideas[2].comments.get().id}/vote/', {'is_positive': False}, format='json')
+        comment = self.ideas[4].comments.get()
+        comment.content = 'Modifié'
+        comment.save()
+        Comment.objects.create(idea=self.ideas[6], user=self.bob, content='Nouveau')
+        Vote.objects.filter(idea=self.ideas[1]).delete()
+        self.alice.first_name = 'Alice'
+        self.alice.save()
+        create_idea(self.bob, self.zones[0], 'Nouvelle')
+        self.client.force_authenticate(None)
+        data, _ = self.get()
+        self.assert_uncached(data)
+
+    def test_zone_idea_count_is_not_cached(self):
+        self.get('/api/zones/')
+        create_idea(self.bob, self.zones[0], 'Nouvelle')
+        data, _ = self.get('/api/zones/')
+        counts = {zone['id']: zone['idea_count'] for zone in data['results']}
+        self.assertEqual(counts[self.zones[0].id], 6)
+
+
+class ConditionalTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.alice = create_user(password=None)
+        self.bob = create_user('bob', password=None)
+        self.zone = create_zone()
+        self.ideas = [create_idea(self.alice, self.zone, f'Idée {i}') for i in range(3)]
+        self.comment = Comment.objects.create(idea=self.ideas[0], user=self.alice, content='Bravo')
+        self.client = APIClient()
+
+    def assert_revalidated(self, url, write, changed=True):
+        """304 tant que rien ne change, puis 200 après ``write`` si ``changed``"""
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        unchanged = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(unchanged.status_code, 304, url)
+        self.assertEqual(unchanged['ETag'], etag)
+        write()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200 if changed else 304, url)
+
+    def test_votes_and_comments_change_the_etags(self):
+        idea = self.ideas[0]
+        urls = ['/api/ideas/', f'/api/ideas/{idea.id}/', f'/api/ideas/{idea.id}/comments/', '/api/comments/',
+                f'/api/zones/{self.zone.id}/ideas/']
+        for index, url in enumerate(urls):
+            self.assert_revalidated(url, lambda: votes.cast(idea, create_user(f'votant{index}', password=None), True))
+            self.assert_revalidated(url, lambda: votes.cast_comment_vote(self.comment, self.bob, index % 2 == 0))
+            self.assert_revalidated(url, lambda: Comment.objects.create(idea=idea, user=self.bob, content='x').delete())
+
+    def test_unrelated_writes_keep_the_etag(self):
+        other = create_zone('Gare', 48.8, 2.3)
+        self.assert_revalidated(f'/api/zones/{other.id}/', lambda: create_idea(self.bob, self.zone), changed=False)
+        self.assert_revalidated(f'/api/ideas/{self.ideas[0].id}/comments/', lambda: create_idea(self.bob, self.zone), changed=False)
+        self.assert_revalidated(f'/api/zones/{other.id}/', other.save)
+
+    def test_score_refresh_changes_sorted_lists(self):
+        for ordering in ('hot', 'controversial'):
+            self.assert_revalidated(f'/api/ideas/?ordering={ordering}', tasks.refresh_idea_scores)
+        self.assert_revalidated('/api/ideas/', tasks.refresh_idea_scores, changed=False)
+
+    def test_etags_depend_on_user_and_query(self):
+        response = self.client.get('/api/ideas/')
+        self.client.force_authenticate(self.bob)
+        personal = self.client.get('/api/ideas/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(personal.status_code, 200)
+        self.assertIn('Authorization', personal['Vary'])
+        self.assertNotEqual(self.client.get('/api/ideas/?category=transport')['ETag'], personal['ETag'])
+        self.assertEqual(self.client.get('/api/ideas/?ordering=inconnu').status_code, 400)
+        self.assertEqual(self.client.get('/api/ideas/999999/').status_code, 404)
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches['fragments'].clear()
+        self.users = [create_user('alice', password=None), create_user('bob', password=None)]
+        zones = [create_zone(), create_zone('Gare', 48.8, 2.3)]
+        for i in range(45):
+            idea = create_idea(self.users[i % 2], zones[i % 2], f'Idée {i}', category='transport' if i % 3 else 'social')
+            Comment.objects.create(idea=idea, user=self.users[0], content='Bravo')
+            Vote.objects.create(idea=idea, user=self.users[1], is_positive=True)
+        self.client = APIClient()
+
+    def get(self, url):
+        """Réponse et requêtes ``COUNT(*)`` exécutées (hors nombre d'idées des zones)"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        counts = [query['sql'] for query in queries.captured_queries
+                  if 'COUNT(*)' in query['sql'] and '"api_zone"' not in query['sql']]
+        return response.data, counts
+
+    def test_pages_without_count_query(self):
+        data, counts = self.get('/api/ideas/')
+        self.assertEqual((data['count'], counts), (45, []))
+        self.assertEqual(len(data['results']), 20)
+        self.assertTrue(data['next'].endswith('page=2'))
+        self.assertIsNone(data['previous'])
+        data, _ = self.get('/api/ideas/?page=2')
+        self.assertNotIn('page=', data['previous'])
+        data, _ = self.get('/api/ideas/?page=3')
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['next'])
+        self.assertTrue(data['previous'].endswith('page=2'))
+        for page in ('4', '0', 'abc'):
+            self.assertEqual(self.client.get(f'/api/ideas/?page={page}').status_code, 404)
+
+    def test_maintained_counters_follow_filters(self):
+        zone = Zone.objects.get(name='Centre')
+        data, counts = self.get(f'/api/ideas/?zone={zone.id}&category=transport')
+        self.assertEqual(data['count'], Idea.objects.filter(zone=zone, category='transport').count())
+        self.assertEqual(counts, [])
+
+    def test_other_filters_cache_the_count(self):
+        data, counts = self.get(f'/api/ideas/?author={self.users[0].id}')
+        self.assertEqual((data['count'], len(counts)), (23, 1))
+        data, counts = self.get(f'/api/ideas/?author={self.users[0].id}&page=2')
+        self.assertEqual((data['count'], counts), (23, []))
+        # Dernière page pleine : pas de page suivante
+        data, _ = self.get(f'/api/ideas/?author={self.users[1].id}&page=2')
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNone(data['next'])
+
+    def test_count_can_be_skipped(self):
+        data, counts = self.get('/api/ideas/?count=false&page=2')
+        self.assertIsNone(data['count'])
+        self.assertIn('count=false', data['next'])
+        self.assertEqual(counts, [])
+
+    def test_comments_and_votes(self):
+        data, counts = self.get('/api/comments/')
+        self.assertEqual((data['count'], counts), (45, []))
+        self.client.force_authenticate(self.users[1])
+        data, _ = self.get('/api/votes/')
+        self.assertEqual(data['count'], 45)
+        _, counts = self.get('/api/votes/?page=2')
+        self.assertEqual(counts, [])
+
+
+class KeysetTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.users = [create_user(f'citoyen{i}', password=None) for i in range(45)]
+        self.idea = create_idea(self.users[0], create_zone())
+        for index, user in enumerate(self.users[:25]):
+            Vote.objects.create(idea=self.idea, user=user, is_positive=bool(index % 4))
+        self.comments = [
+            Comment.objects.create(idea=self.idea, user=self.users[i % 5], content=f'Commentaire {i}') for i in range(25)
+        ]
+        for user in self.users[:10]:
+            CommentVote.objects.create(comment=self.comments[-1], user=user, is_positive=user.pk % 3 != 0)
+        self.client = APIClient()
+
+    def walk(self, url):
+        """Identifiants de toutes les pages, en suivant les liens ``next``"""
+        seen = []
+        while url:
+            data = self.client.get(url).data
+            seen += [item['id'] for item in data['results']]
+            url = data['next']
+        return seen
+
+    def test_detail_carries_the_first_comment_page(self):
+        url = f'/api/ideas/{self.idea.id}/'
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url).data
+        self.assertNotIn('votes', data)
+        self.assertEqual(data['votesStats'], {'total': 25, 'up': 18, 'down': 7})
+        self.assertEqual(data['comment_count'], 25)
+        self.assertEqual([comment['content'] for comment in data['comments']],
+                         [f'Commentaire {i}' for i in range(24, 4, -1)])
+        up = CommentVote.objects.filter(is_positive=True).count()
+        self.assertEqual(data['comments'][0]['votesStats'], {'total': 10, 'up': up, 'down': 10 - up})
+        self.assertNotIn('votes', data['comments'][0])
+        following = self.client.get(data['comments_next']).data
+        self.assertEqual([comment['content'] for comment in following['results']],
+                         [f'Commentaire {i}' for i in range(4, -1, -1)])
+        self.assertIsNone(following['next'])
+        # Nombre de requêtes indépendant du nombre de votes
+        for user in self.users[25:]:
+            Vote.objects.create(idea=self.idea, user=user, is_positive=True)
+        with CaptureQueriesContext(connection) as again:
+            self.client.get(url)
+        self.assertEqual(len(again.captured_queries), len(queries.captured_queries))
+
+    def test_votes_are_paged_newest_first(self):
+        url = f'/api/ideas/{self.idea.id}/votes/'
+        first = self.client.get(url).data
+        self.assertEqual(len(first['results']), 20)
+        self.assertIn('username', first['results'][0]['user'])
+        expected = list(Vote.objects.filter(idea=self.idea).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(url), expected)
+        self.assertEqual(self.client.get(url + '?cursor=zzz').status_code, 404)
+        self.assertEqual(self.client.get('/api/ideas/999999/votes/').status_code, 404)
+
+    def test_new_comment_tops_the_first_page(self):
+        url = f'/api/ideas/{self.idea.id}/comments/'
+        expected = [comment.id for comment in reversed(self.comments)]
+        self.assertEqual(self.walk(url), expected)
+        etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(self.users[2])
+        response = self.client.post(url, {'content': 'Nouveau'}, format='json')
+        self.assertEqual(response.data['votesStats']['total'], 0)
+        self.client.force_authenticate(None)
+        page = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(page.status_code, 200)
+        self.assertEqual(page.data['results'][0]['id'], response.data['id'])
+        self.assertIsNone(page.data['previous'])
+
+    def test_list_rows_carry_the_latest_comments(self):
+        other = create_idea(self.users[1], self.idea.zone, 'Sans commentaire')
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get('/api/ideas/').data
+        rows = {row['id']: row for row in data['results']}
+        row = rows[self.idea.id]
+        self.assertEqual(row['comment_count'], 25)
+        self.assertEqual([comment['id'] for comment in row['comments']],
+                         [comment.id for comment in reversed(self.comments)][:LIST_COMMENTS])
+        self.assertEqual(row['comments'][0]['votesStats']['total'], 10)
+        self.assertNotIn('votes', row['comments'][0])
+        self.assertEqual(rows[other.id]['comments'], [])
+        # Plus de commentaires : autant de requêtes
+        for i in range(5):
+            Comment.objects.create(idea=other, user=self.users[0], content=f'Réponse {i}')
+        caches['fragments'].clear()
+        with CaptureQueriesContext(connection) as again:
+            self.client.get('/api/ideas/')
+        self.assertEqual(len(again.captured_queries), len(queries.captured_queries))
+
+
+class CompoundDocumentTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.users = [create_user(f'citoyen{i}', password=None, first_name=f'Prénom{i}') for i in range(4)]
+        self.zones = [create_zone(f'Zone {i}') for i in range(3)]
+        for i in range(25):
+            idea = create_idea(self.users[i % 2], self.zones[i % 2], f'Idée {i}')
+            comment = Comment.objects.create(idea=idea, user=self.users[2], content='Bravo')
+            CommentVote.objects.create(comment=comment, user=self.users[3], is_positive=True)
+            Vote.objects.create(idea=idea, user=self.users[3], is_positive=True)
+        self.client = APIClient()
+
+    def test_references_and_included_objects(self):
+        plain = self.client.get('/api/ideas/')
+        response = self.client.get('/api/ideas/?include=zones,users')
+        data = response.data
+        self.assertEqual([row['id'] for row in data['results']], [row['id'] for row in plain.data['results']])
+        first = data['results'][0]
+        self.assertNotIn('zone', first)
+        self.assertNotIn('author', first)
+        self.assertEqual(first['comments'][0]['user_id'], self.users[2].id)
+        self.assertEqual([zone['id'] for zone in data['included']['zones']], [self.zones[0].id, self.zones[1].id])
+        zones = {zone['id']: zone for zone in data['included']['zones']}
+        nested = plain.data['results'][0]['zone']
+        self.assertEqual(dict(zones[nested['id']]), dict(nested))
+        # Auteurs des idées et des commentaires, pas ceux des votes
+        self.assertEqual({user['id'] for user in data['included']['users']}, {user.id for user in self.users[:3]})
+        self.assertIn('name', data['included']['users'][0])
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(json.loads(self.client.get('/api/ideas/?include=zones,users').content), json.loads(response.content))
+
+    def test_include_subsets(self):
+        data = self.client.get('/api/ideas/?include=zones').data
+        self.assertEqual(list(data['included']), ['zones'])
+        self.assertIn('zone_id', data['results'][0])
+        self.assertEqual(self.client.get('/api/ideas/?include=inconnu').status_code, 400)
+        self.assertNotIn('included', self.client.get('/api/ideas/?include=').data)
+
+    def test_batch_fetches(self):
+        ideas = list(Idea.objects.order_by('pk')[:3])
+        data = self.client.post('/api/ideas/batch/?include=users', {'ids': [idea.id for idea in ideas]}, format='json').data
+        self.assertEqual({user['id'] for user in data['included']['users']}, {user.id for user in self.users[:3]})
+        data = self.client.get('/api/ideas/?include=zones&ids=' + ','.join(str(idea.id) for idea in ideas)).data
+        self.assertEqual(len(data['included']['zones']), 2)
+
+    def test_personal_votes_and_renamed_users(self):
+        self.client.force_authenticate(self.users[3])
+        data = self.client.get('/api/ideas/?include=zones').data
+        self.assertTrue(all(row['my_vote'] and row['comments'][0]['my_vote'] for row in data['results']))
+        self.client.force_authenticate(None)
+        data = self.client.get('/api/ideas/?include=zones').data
+        self.assertTrue(all(row['my_vote'] is None for row in data['results']))
+        response = self.client.get('/api/ideas/?include=users')
+        self.users[2].first_name = 'Zoé'
+        self.users[2].save()
+        renamed = self.client.get('/api/ideas/?include=users', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(renamed.status_code, 200)
+        names = {user['id']: user['name'] for user in renamed.data['included']['users']}
+        self.assertIn('Zoé', names[self.users[2].id])
+
+
+def flaky_task(fail=True):
+    if fail:
+        raise ValueError('Échec simulé')
+    return 'ok'
+
+
+def slow_task(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+# Attribut posé par @task, sans enregistrer ces tâches hors des tests
+flaky_task.max_attempts = 3
+slow_task.max_attempts = None
+
+
+@override_settings(JOBS={'RETRY_BASE_DELAY': 10, 'RETRY_MAX_DELAY': 60, 'STALE_AFTER': 300})
+@mock.patch.dict(jobs.TASKS, {'flaky': flaky_task, 'slow': slow_task})
+class JobTests(TestCase):
+    def test_failures_are_retried_with_backoff(self):
+        job = jobs.enqueue('flaky')
+        self.assertEqual(job.max_attempts, 3)
+        now = timezone.now()
+        for attempt, delay in ((1, 10), (2, 20)):
+            self.assertEqual(jobs.claim('tests', 1, now), [job.pk])
+            self.assertEqual(jobs.execute(job.pk), Job.STATES.PENDING)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn('Échec simulé', job.error)
+            # Délai exponentiel avec une part aléatoire d'au plus 25 %
+            waited = (job.run_at - job.finished_at).total_seconds()
+            self.assertTrue(delay <= waited <= delay * 1.25, waited)
+            self.assertEqual(jobs.claim('tests', 1, now), [])
+            now = job.run_at
+        jobs.claim('tests', 1, now)
+        self.assertEqual(jobs.execute(job.pk), Job.STATES.FAILED)
+        self.assertEqual(jobs.retry_failed(Job.objects.all()), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.STATES.PENDING, 0))
+
+    def test_retry_delay_is_capped(self):
+        self.assertLessEqual(jobs.retry_delay(12), timedelta(seconds=60 * 1.25))
+        self.assertGreaterEqual(jobs.retry_delay(12), timedelta(seconds=60))
+
+    def test_success_and_deduplication(self):
+        job = jobs.enqueue('flaky', {'fail': False}, dedup_key='unique')
+        self.assertEqual(jobs.enqueue('flaky', {'fail': False}, dedup_key='unique'), job)
+        self.assertEqual(run_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.result, job.attempts), (Job.STATES.DONE, 'ok', 1))
+        with self.assertRaises(jobs.UnknownTask):
+            jobs.enqueue('inconnue')
+
+    def test_only_silent_jobs_are_requeued(self):
+        now = timezone.now()
+        started = now - timedelta(hours=2)
+        long_running, abandoned = (jobs.enqueue('slow', {'seconds': 0}, run_at=started) for _ in range(2))
+        self.assertEqual(len(jobs.claim('tests', 2, started)), 2)
+        # Tâche longue dont le worker est vivant : démarrée il y a longtemps, signe de vie récent
+        self.assertTrue(jobs.beat(long_running.pk, now - timedelta(seconds=30)))
+        self.assertEqual(jobs.requeue_stale(now), 1)
+        long_running.refresh_from_db()
+        abandoned.refresh_from_db()
+        self.assertEqual(long_running.state, Job.STATES.RUNNING)
+        self.assertEqual(abandoned.state, Job.STATES.PENDING)
+        self.assertIn('Abandonnée', abandoned.error)
+        self.assertFalse(jobs.beat(abandoned.pk))
+
+
+@override_settings(JOBS={'HEARTBEAT_INTERVAL': 0.05, 'STALE_AFTER': 300})
+@mock.patch.dict(jobs.TASKS, {'slow': slow_task})
+class JobHeartbeatTests(TransactionTestCase):
+    def test_worker_beats_while_the_task_runs(self):
+        started = timezone.now() - timedelta(hours=1)
+        job = jobs.enqueue('slow', {'seconds': 0.5}, run_at=started)
+        self.assertEqual(jobs.claim('tests', 1, started), [job.pk])
+        self.assertEqual(jobs.execute(job.pk), Job.STATES.DONE)
+        job.refresh_from_db()
+        self.assertGreater(job.heartbeat_at, started + timedelta(minutes=59))
+        self.assertFalse([thread for thread in threading.enumerate() if thread.name.startswith('job-heartbeat')])
+
+
+@override_settings(JOBS={'PERIODIC': {}})
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.staff = create_user('moderatrice', password=None, is_staff=True)
+        self.alice, self.bob, self.carol = (create_user(name, password=None) for name in ('alice', 'bob', 'carol'))
+        self.zones = [create_zone(), create_zone('Gare', 48.86, 2.36)]
+        self.alice_ideas = [create_idea(self.alice, self.zones[0], f'Idée {i}') for i in range(3)]
+        self.bob_idea = create_idea(self.bob, self.zones[1], 'Idée de Bob')
+        self.carol_idea = create_idea(self.carol, self.zones[0], 'Idée de Carol')
+        for idea, user, is_positive in (
+            (self.bob_idea, self.alice, True), (self.bob_idea, self.carol, False),
+            (self.carol_idea, self.alice, False), (self.alice_ideas[0], self.bob, True),
+        ):
+            votes.cast(idea, user, is_positive)
+        alice_comments = [Comment.objects.create(idea=self.bob_idea, user=self.alice, content=f'Avis {i}') for i in range(3)]
+        carol_comment = Comment.objects.create(idea=self.bob_idea, user=self.carol, content='Avis de Carol')
+        Comment.objects.create(idea=self.alice_ideas[1], user=self.bob, content='Avis de Bob')
+        votes.cast_comment_vote(carol_comment, self.alice, True)
+        votes.cast_comment_vote(alice_comments[0], self.carol, True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def assert_consistent(self):
+        self.assertEqual(stats.check(), {})
+        expected = {key: dict(counters) for key, counters in activity.compute_rows().items() if any(counters.values())}
+        stored = {}
+        for bucket in ActivityBucket.objects.all():
+            counters = {field: getattr(bucket, field) for field in activity.COUNTER_FIELDS}
+            if any(counters.values()):
+                stored[bucket.granularity, bucket.bucket_start, bucket.zone_id, bucket.category] = counters
+        self.assertEqual(stored, expected)
+        self.assertEqual(votes.recount(Idea.objects.all()), [])
+        for idea in Idea.objects.all():
+            self.assertEqual(idea.comment_count, idea.comments.count())
+
+    def idea_ids(self):
+        return sorted(idea['id'] for idea in self.client.get('/api/ideas/').data['results'])
+
+    def test_deleted_user_is_hidden_then_purged(self):
+        self.assert_consistent()
+        response = self.client.delete(f'/api/users/{self.alice.pk}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['action'], 'purge_user')
+        self.alice.refresh_from_db()
+        self.assertFalse(self.alice.is_active)
+        self.assertEqual(self.idea_ids(), sorted([self.bob_idea.pk, self.carol_idea.pk]))
+        self.assertEqual(self.client.get(f'/api/ideas/{self.alice_ideas[0].pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/users/{self.alice.pk}/').status_code, 404)
+        self.assertEqual(Job.objects.get().task, 'purge_subject')
+
+        job = ModerationJob.objects.get()
+        moderation.run(job, chunk_size=2)
+        self.assertEqual(job.state, ModerationJob.STATES.DONE, job.error)
+        self.assertEqual(job.processed, job.total)
+        self.assertFalse(User.objects.filter(pk=self.alice.pk).exists())
+        self.assertFalse(Idea.objects.filter(author_id=self.alice.pk).exists())
+        detail = self.client.get(f'/api/ideas/{self.bob_idea.pk}/').data
+        self.assertEqual(detail['comment_count'], 1)
+        self.assertEqual(detail['votesStats'], {'total': 1, 'up': 0, 'down': 1})
+        self.assert_consistent()
+
+    def test_deleted_zone_is_purged_by_the_worker(self):
+        response = self.client.delete(f'/api/zones/{self.zones[0].pk}/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.client.get(f'/api/zones/{self.zones[0].pk}/').status_code, 404)
+        self.assertEqual(self.idea_ids(), [self.bob_idea.pk])
+        self.assertEqual(self.client.get('/api/ideas/').data['count'], 1)
+        self.assertEqual(len(self.client.get('/api/zones/').data['results']), 1)
+        call_command('run_worker', '--burst', '--processes', '0', '--no-periodic', verbosity=0, stdout=io.StringIO())
+        self.assertFalse(Zone.objects.filter(pk=self.zones[0].pk).exists())
+        self.assertEqual(list(Idea.objects.values_list('pk', flat=True)), [self.bob_idea.pk])
+        job = self.client.get(f'/api/moderation/{response.data["id"]}/').data
+        self.assertEqual((job['state'], job['processed'], job['total']), ('done', 4, 4))
+        self.assert_consistent()
+
+    def test_admin_deletion_is_soft(self):
+        admin = create_user('admin', password=None, is_staff=True, is_superuser=True)
+        client = Client()
+        client.force_login(admin)
+        response = client.post(f'/admin/api/zone/{self.zones[0].pk}/delete/', {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.zones[0].refresh_from_db()
+        self.assertIsNotNone(self.zones[0].deleted_at)
+        self.assertEqual(ModerationJob.objects.get().action, ModerationJob.ACTIONS.PURGE_ZONE)
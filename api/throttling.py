@@ -0,0 +1,89 @@
+"""Limitation de débit par seau à jetons (token bucket).
+
+Chaque seau est une ligne ``ThrottleBucket`` partagée entre les processus,
+qui ne stocke que l'instant où il sera de nouveau plein : prendre un jeton est
+un seul ``UPDATE`` conditionnel, atomique même sous requêtes concurrentes d'un
+même client. Les taux se configurent comme pour DRF dans
+``DEFAULT_THROTTLE_RATES`` : ``'10/min'`` donne un seau de 10 jetons rechargé
+à raison de 10 jetons par minute.
+"""
+from django.db.models import F
+from django.db.models.functions import Greatest
+from rest_framework.throttling import SimpleRateThrottle
+
+from .models import ThrottleBucket
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Limitation par seau à jetons stocké en base"""
+    cache_format = 'bucket_%(scope)s_%(ident)s'
+    # Ne limiter que les requêtes d'écriture (les lectures restent libres)
+    write_only = False
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        if self.write_only and request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        interval = self.duration / self.num_requests
+        now = self.timer()
+        # Au moins un jeton disponible tant que le seau est plein avant cette limite
+        limit = now + (self.num_requests - 1) * interval
+        self.wait_time = None
+        for _ in range(2):
+            if ThrottleBucket.objects.filter(key=self.key, full_at__lte=limit).update(
+                full_at=Greatest(F('full_at'), now) + interval,
+            ):
+                return True
+            bucket, created = ThrottleBucket.objects.get_or_create(
+                key=self.key, defaults={'full_at': now + interval},
+            )
+            if created:
+                return True
+            if bucket.full_at > limit:
+                self.wait_time = bucket.full_at - limit
+                return False
+        # Seau créé entre-temps par une requête concurrente et de nouveau vide
+        self.wait_time = interval
+        return False
+
+    @classmethod
+    def prune(cls, now=None):
+        """Supprime les seaux pleins (équivalents à une absence de seau)"""
+        deleted, _ = ThrottleBucket.objects.filter(full_at__lte=now or cls.timer()).delete()
+        return deleted
+
+    def wait(self):
+        return getattr(self, 'wait_time', None)
+
+
+class LoginRateThrottle(TokenBucketThrottle):
+    """Limitation des tentatives de connexion (par adresse IP)"""
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class VoteRateThrottle(TokenBucketThrottle):
+    """Limitation des votes (idées et commentaires)"""
+    scope = 'vote'
+    write_only = True
+
+
+class CommentRateThrottle(TokenBucketThrottle):
+    """Limitation de la création de commentaires"""
+    scope = 'comment'
+    write_only = True
@@ -4,9 +4,11 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
+from .throttling import LoginRateThrottle
 from .views import (
     UserViewSet, UserRegistrationView, UserLoginView, UserLogoutView,
-    ZoneViewSet, IdeaViewSet, VoteViewSet, CommentViewSet, CommentVoteViewSet
+    ZoneViewSet, IdeaViewSet, VoteViewSet, CommentViewSet, CommentVoteViewSet,
+    ActivityTimeseriesView, ModerationJobViewSet, SyncView, event_stream
 )
 
 # Configuration du router pour les ViewSets
@@ -17,6 +19,7 @@ router.register(r'ideas', IdeaViewSet)
 router.register(r'votes', VoteViewSet)
 router.register(r'comments', CommentViewSet)
 router.register(r'comment-votes', CommentVoteViewSet)
+router.register(r'moderation', ModerationJobViewSet)
 
 urlpatterns = [
     # Routes du router
@@ -27,7 +30,16 @@ urlpatterns = [
     path('auth/logout/', UserLogoutView.as_view(), name='user-logout'),
     path('auth/register/', UserRegistrationView.as_view(), name='user-register'),
     
+    # Synchronisation incrémentale
+    path('sync/', SyncView.as_view(), name='sync'),
+
+    # Flux temps réel (Server-Sent Events, à servir en ASGI)
+    path('stream/', event_stream, name='event-stream'),
+
+    # Statistiques
+    path('stats/timeseries/', ActivityTimeseriesView.as_view(), name='stats-timeseries'),
+
     # Routes JWT standard (optionnelles)
-    path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('auth/token/', TokenObtainPairView.as_view(throttle_classes=[LoginRateThrottle]), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ] 
\ No newline at end of file
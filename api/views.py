@@ -1,29 +1,55 @@
-from django.shortcuts import render
-from rest_framework import viewsets, status, permissions
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import mixins, serializers, viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
-from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.functional import cached_property
+from datetime import datetime, time, timedelta
+from django.db.models import Q, Sum
 from django.contrib.auth import authenticate
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import User, Zone, Idea, Vote, Comment, CommentVote
+from . import activity, changelog, deletion, heatmap, mapdata, moderation, realtime, similarity, stats as zone_stats, votes
+from .models import User, Zone, Idea, Vote, Comment, CommentVote, ZoneStat, ModerationJob
+from .pagination import KeysetPagination
+from .ranking import ORDERINGS, scores_version
+from .compound import CompoundDocumentMixin, included_users, included_zones
+from .conditional import conditional, latest
+from .idempotency import idempotent
+from .revocation import revoke_token
+from .spatial import radius_box
+from .throttling import LoginRateThrottle, VoteRateThrottle, CommentRateThrottle
 from .serializers import (
-    UserSerializer, UserRegistrationSerializer, ZoneSerializer,
-    IdeaSerializer, IdeaCreateSerializer, IdeaListSerializer, VoteSerializer,
-    CommentSerializer, CommentCreateSerializer, CommentVoteSerializer
+    UserSerializer, UserRegistrationSerializer, ZoneDetailSerializer,
+    IdeaSerializer, IdeaCreateSerializer, IdeaListSerializer, IdeaCompactSerializer, VoteSerializer,
+    CommentSerializer, CommentCreateSerializer, CommentSummarySerializer, CommentVoteSerializer,
+    ModerationJobSerializer, ZoneSyncSerializer, IdeaSyncSerializer, CommentSyncSerializer,
+    VoteSyncSerializer, attach_comment_vote_stats, attach_idea_counts,
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
-    """ViewSet pour les utilisateurs"""
+class SoftDeleteMixin:
+    """``DELETE`` masque l'objet et renvoie l'opération de purge (202) au lieu de le supprimer en cascade"""
+
+    def destroy(self, request, *args, **kwargs):
+        job = deletion.soft_delete(self.get_object(), user=request.user)
+        return Response(ModerationJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class UserViewSet(SoftDeleteMixin, viewsets.ModelViewSet):
+    """ViewSet pour les utilisateurs (suppression purgée en tâche de fond)"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         if self.request.user.is_staff:
-            return User.objects.all()
+            return User.objects.filter(deleted_at__isnull=True)
         return User.objects.filter(id=self.request.user.id)
 
     @action(detail=False, methods=['get'])
@@ -36,6 +62,7 @@ class UserViewSet(viewsets.ModelViewSet):
 class UserRegistrationView(APIView):
     """Vue pour l'inscription des utilisateurs"""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginRateThrottle]
 
     def post(self, request):
         serializer = UserRegistrationSerializer(data=request.data)
@@ -51,6 +78,7 @@ class UserRegistrationView(APIView):
 class UserLoginView(APIView):
     """Vue pour la connexion des utilisateurs avec JWT"""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginRateThrottle]
 
     def post(self, request):
         email = request.data.get('email')
@@ -83,20 +111,136 @@ class UserLogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        # Avec JWT, la déconnexion se fait côté client en supprimant le token
-        # Optionnellement, on peut blacklister le token
+        # Le jeton de rafraîchissement est optionnel mais doit appartenir à l'utilisateur
+        refresh = None
+        raw_refresh = request.data.get('refresh')
+        if raw_refresh:
+            try:
+                refresh = RefreshToken(raw_refresh)
+            except TokenError:
+                return Response({
+                    'error': 'Jeton de rafraîchissement invalide'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if str(refresh.get(jwt_settings.USER_ID_CLAIM)) != str(request.user.id):
+                return Response({
+                    'error': 'Jeton de rafraîchissement invalide'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            revoke_token(refresh, user=request.user)
+
+        # Révoque aussi le jeton d'accès utilisé pour cette requête
+        if request.auth is not None and jwt_settings.JTI_CLAIM in request.auth:
+            revoke_token(request.auth, user=request.user)
+
         return Response({'message': 'Déconnexion réussie'})
 
 
-class ZoneViewSet(viewsets.ModelViewSet):
-    """ViewSet pour les zones géographiques"""
+def my_votes(user, ideas=(), comments=()):
+    """Votes de l'utilisateur sur des idées (et leurs commentaires) et des commentaires.
+
+    Une requête IN par type d'objet, quel que soit le nombre d'éléments.
+    """
+    idea_ids = [idea.pk for idea in ideas]
+    comment_ids = [comment.pk for comment in comments]
+    votes = {'ideas': {}, 'comments': {}}
+    if idea_ids:
+        rows = Vote.objects.filter(user=user, idea_id__in=idea_ids).values_list('idea_id', 'id', 'is_positive')
+        for idea_id, pk, is_positive in rows:
+            votes['ideas'][idea_id] = {'id': pk, 'is_positive': is_positive}
+    if idea_ids or comment_ids:
+        rows = (
+            CommentVote.objects.filter(Q(comment__idea_id__in=idea_ids) | Q(comment_id__in=comment_ids), user=user)
+            .values_list('comment_id', 'id', 'is_positive')
+        )
+        for comment_id, pk, is_positive in rows:
+            votes['comments'][comment_id] = {'id': pk, 'is_positive': is_positive}
+    return votes
+
+
+def vote_direction(request):
+    """Sens du vote demandé (``is_positive``, vrai par défaut) ; None si invalide"""
+    try:
+        return serializers.BooleanField().to_internal_value(request.data.get('is_positive', True))
+    except ValidationError:
+        return None
+
+
+def vote_message(previous, is_positive):
+    """Message de réponse d'un vote selon son sens précédent (voir ``votes.cast``)"""
+    if previous is None:
+        return 'Vote ajouté'
+    if previous == is_positive:
+        return 'Vote inchangé'
+    return 'Vote modifié'
+
+
+def vote_context(request, ideas=(), comments=()):
+    """Contexte de sérialisation avec les votes de l'utilisateur connecté (``my_vote``)"""
+    context = {'request': request}
+    if request.user.is_authenticated:
+        context['my_votes'] = my_votes(request.user, ideas, comments)
+    return context
+
+
+def lookup_pk(value):
+    """Identifiant numérique d'une URL de détail (None si invalide)"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchFetchMixin:
+    """Récupération groupée par liste d'identifiants (?ids=1,2,3 ou POST batch/)"""
+    batch_max_ids = 500
+
+    @conditional('list_validators')
+    def list(self, request, *args, **kwargs):
+        if 'ids' in request.query_params:
+            return self.batch_response(request.query_params['ids'].split(','))
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
+    def batch(self, request):
+        """Récupère plusieurs objets à partir d'une longue liste d'identifiants"""
+        ids = request.data.get('ids')
+        if not isinstance(ids, list):
+            return Response({
+                'error': 'Liste d\'identifiants (ids) requise'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return self.batch_response(ids)
+
+    def batch_response(self, raw_ids):
+        try:
+            ids = list(dict.fromkeys(int(value) for value in raw_ids if str(value).strip()))
+        except (TypeError, ValueError):
+            return Response({'error': 'Identifiants invalides'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > self.batch_max_ids:
+            return Response({
+                'error': f'{self.batch_max_ids} identifiants au maximum'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        objects = {obj.pk: obj for obj in self.load_batch(ids)}
+        # Ordre de la demande conservé ; les identifiants inconnus sont signalés
+        found = [objects[pk] for pk in ids if pk in objects]
+        serializer = self.get_serializer(found, many=True)
+        return Response({
+            'results': serializer.data,
+            'missing': [pk for pk in ids if pk not in objects],
+        })
+
+    def load_batch(self, ids):
+        return self.filter_queryset(self.get_queryset()).filter(pk__in=ids)
+
+
+class ZoneViewSet(SoftDeleteMixin, BatchFetchMixin, viewsets.ModelViewSet):
+    """ViewSet pour les zones géographiques (suppression purgée en tâche de fond)"""
     queryset = Zone.objects.all()
-    serializer_class = ZoneSerializer
+    serializer_class = ZoneDetailSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     """Récupère tous les types d'une zone"""
     def get_queryset(self):
-        queryset = Zone.objects.all()
+        queryset = Zone.objects.filter(deleted_at__isnull=True)
         zone_type = self.request.query_params.get('zone_type')
         name = self.request.query_params.get('name')
         if zone_type:
@@ -104,30 +248,153 @@ class ZoneViewSet(viewsets.ModelViewSet):
         if name:
             queryset = queryset.filter(name__icontains=name)
         return queryset
-    
+
+    def load_batch(self, ids):
+        zones = list(super().load_batch(ids))
+        attach_idea_counts(zones)
+        return zones
+
+    def list_validators(self, request, *args, **kwargs):
+        # Suppression d'une zone : nombre de zones ; nombre d'idées : ZoneStat
+        zones = self.filter_queryset(self.get_queryset())
+        return [latest(zones), zones.count(), latest(ZoneStat.objects.filter(zone__in=zones))]
+
+    def detail_validators(self, request, pk=None, **kwargs):
+        zone_id = lookup_pk(pk)
+        if self.action != 'ideas':
+            return [latest(Zone.objects.filter(pk=zone_id)), latest(ZoneStat.objects.filter(zone_id=zone_id))]
+        hidden = deletion.hidden_subjects()
+        return [
+            latest(Zone.objects.filter(pk=zone_id)),
+            latest(ZoneStat.objects.filter(zone_id=zone_id)),
+            latest(deletion.visible_ideas(Idea.objects.filter(zone_id=zone_id), hidden)),
+            hidden,
+        ]
+
+    @conditional('detail_validators')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=True, methods=['get'])
+    @conditional('detail_validators')
     def ideas(self, request, pk=None):
         """Récupère toutes les idées d'une zone"""
         zone = self.get_object()
-        ideas = zone.ideas.all()
-        serializer = IdeaListSerializer(ideas, many=True)
+        ideas = list(deletion.visible_ideas(zone.ideas.all()))
+        serializer = IdeaListSerializer(ideas, many=True, context=vote_context(request, ideas))
         return Response(serializer.data)
 
-
-class IdeaViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """Statistiques d'une zone (agrégats matérialisés)"""
+        zone = self.get_object()
+        summary = zone_stats.summarize(ZoneStat.objects.filter(zone=zone))
+        summary['zone'] = zone.id
+        summary['most_active'] = list(
+            deletion.visible_ideas(zone.ideas.order_by('-vote_count', '-id'))
+            .values('id', 'title', 'category', 'status', 'vote_count', 'comment_count')[:zone_stats.MOST_ACTIVE_LIMIT]
+        )
+        return Response(summary)
+
+    @action(detail=False, methods=['get'], url_path='stats')
+    def all_stats(self, request):
+        """Statistiques de toutes les zones (agrégats matérialisés)"""
+        by_zone = {}
+        for row in ZoneStat.objects.filter(zone__in=self.get_queryset()).order_by('zone_id'):
+            by_zone.setdefault(row.zone_id, []).append(row)
+        results = []
+        for zone_id, rows in by_zone.items():
+            summary = zone_stats.summarize(rows)
+            summary['zone'] = zone_id
+            results.append(summary)
+        return Response(results)
+
+
+class IdeaViewSet(CompoundDocumentMixin, BatchFetchMixin, viewsets.ModelViewSet):
     """ViewSet pour les idées"""
     queryset = Idea.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Document composé (?include=zones,users, voir api/compound.py)
+    includable = {'zones': included_zones, 'users': included_users}
+
+    @cached_property
+    def hidden_subjects(self):
+        # Zones et auteurs en cours de suppression (api/deletion.py), lus une fois par requête
+        return deletion.hidden_subjects()
 
     def get_serializer_class(self):
         if self.action == 'create':
             return IdeaCreateSerializer
-        elif self.action == 'list':
-            return IdeaListSerializer
+        elif self.action in ('list', 'batch'):
+            return IdeaCompactSerializer if self.is_compound() else IdeaListSerializer
         return IdeaSerializer
 
+    def get_serializer(self, *args, **kwargs):
+        # my_vote : votes de la page lus en une fois (rien pour les anonymes)
+        if args and self.request.user.is_authenticated:
+            ideas = list(args[0]) if kwargs.get('many') else [args[0]]
+            if kwargs.get('many'):
+                args = (ideas,) + args[1:]
+            kwargs['context'] = {**self.get_serializer_context(), **vote_context(self.request, ideas)}
+        return super().get_serializer(*args, **kwargs)
+
+    def with_relations(self, queryset):
+        """Idées avec auteur et zone chargés en un nombre fixe de requêtes"""
+        # Derniers commentaires : lus pour les seules idées absentes du cache de fragments
+        ideas = list(queryset.select_related('author', 'zone'))
+        attach_idea_counts(idea.zone for idea in ideas)
+        return ideas
+
+    def load_batch(self, ids):
+        return self.with_relations(super().load_batch(ids))
+
+    def list_validators(self, request, *args, **kwargs):
+        # Zones imbriquées : modifications, suppressions et nombre d'idées (ZoneStat,
+        # avancé aussi par la suppression d'une idée)
+        validators = [
+            latest(self.filter_queryset(self.get_queryset())),
+            latest(Zone.objects.all()),
+            Zone.objects.count(),
+            latest(ZoneStat.objects.all()),
+            self.hidden_subjects,
+        ]
+        if request.query_params.get('ordering'):
+            # Tri par score : les recalculs périodiques n'avancent pas updated_at
+            validators.append(scores_version())
+        return validators
+
+    def detail_validators(self, request, pk=None, **kwargs):
+        ideas = Idea.objects.filter(pk=lookup_pk(pk))
+        return [
+            latest(ideas),
+            latest(Zone.objects.filter(ideas__in=ideas)),
+            latest(ZoneStat.objects.filter(zone__ideas__in=ideas)),
+            self.hidden_subjects,
+        ]
+
+    def comment_validators(self, request, pk=None):
+        # Suppression d'un commentaire, votes (sur l'idée ou ses commentaires) : updated_at de l'idée
+        idea_id = lookup_pk(pk)
+        return [latest(Comment.objects.filter(idea_id=idea_id)), latest(Idea.objects.filter(pk=idea_id))]
+
+    @conditional('detail_validators')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def paginated_count(self, queryset):
+        """Nombre d'idées lu dans ZoneStat si seuls la zone, la catégorie et le statut filtrent"""
+        params = self.request.query_params
+        # ZoneStat compte encore les idées masquées jusqu'à leur purge
+        if params.get('author') or params.get('search') or any(self.hidden_subjects):
+            return None
+        rows = ZoneStat.objects.all()
+        for param, field in (('zone', 'zone_id'), ('category', 'category'), ('status', 'status')):
+            if params.get(param):
+                rows = rows.filter(**{field: params[param]})
+        return rows.aggregate(total=Sum('idea_count'))['total'] or 0
+
     def get_queryset(self):
-        queryset = Idea.objects.all()
+        queryset = deletion.visible_ideas(Idea.objects.all(), self.hidden_subjects)
         
         # Filtres
         category = self.request.query_params.get('category', None)
@@ -135,6 +402,7 @@ class IdeaViewSet(viewsets.ModelViewSet):
         zone = self.request.query_params.get('zone', None)
         author = self.request.query_params.get('author', None)
         search = self.request.query_params.get('search', None)
+        ordering = self.request.query_params.get('ordering', None)
         
         if category:
             queryset = queryset.filter(category=category)
@@ -149,94 +417,158 @@ class IdeaViewSet(viewsets.ModelViewSet):
                 Q(title__icontains=search) | 
                 Q(description__icontains=search)
             )
+        if ordering:
+            # Tri sur les scores précalculés et indexés (voir api/ranking.py)
+            if ordering not in ORDERINGS:
+                raise ValidationError({'ordering': f"Valeurs possibles : {', '.join(ORDERINGS)}"})
+            queryset = queryset.order_by(*ORDERINGS[ordering])
         
         return queryset
 
-    @action(detail=True, methods=['post'])
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Crée une idée et signale les doublons possibles déjà proposés"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        idea = serializer.save()
+        data = dict(serializer.data)
+        data['possible_duplicates'] = similarity.find_similar_to(idea)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Idées quasi identiques proposées à proximité (même catégorie)"""
+        idea = self.get_object()
+        return Response(similarity.find_similar_to(idea))
+
+    @action(detail=True, methods=['post'], throttle_classes=[VoteRateThrottle])
+    @idempotent
     def vote(self, request, pk=None):
         """Vote sur une idée"""
         idea = self.get_object()
-        is_positive = request.data.get('is_positive', True)
-        
-        # Vérifier si l'utilisateur a déjà voté
-        existing_vote = Vote.objects.filter(idea=idea, user=request.user).first()
-        
-        if existing_vote:
-            # Modifier le vote existant
-            existing_vote.is_positive = is_positive
-            existing_vote.save()
-            message = "Vote modifié"
-        else:
-            # Créer un nouveau vote
-            Vote.objects.create(
-                idea=idea,
-                user=request.user,
-                is_positive=is_positive
-            )
-            message = "Vote ajouté"
-        
-        # Mettre à jour les statistiques de l'idée
-        idea.update_vote_stats()
+        is_positive = vote_direction(request)
+        if is_positive is None:
+            return Response({
+                'error': 'is_positive doit être un booléen'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Insertion ou modification en une instruction (sûre en cas de requêtes simultanées)
+        previous = votes.cast(idea, request.user, is_positive)
+        message = vote_message(previous, is_positive)
         
         return Response({
             'message': message,
-            'idea': IdeaSerializer(idea, context={'request': request}).data
+            'idea': self.get_serializer(idea).data
         })
 
-    @action(detail=True, methods=['delete'])
+    @action(detail=True, methods=['delete'], throttle_classes=[VoteRateThrottle])
     def unvote(self, request, pk=None):
         """Supprime le vote de l'utilisateur sur une idée"""
         idea = self.get_object()
         
-        try:
-            vote = Vote.objects.get(idea=idea, user=request.user)
-            vote.delete()
-            idea.update_vote_stats()
-            
+        if votes.retract(idea, request.user):
             return Response({
                 'message': 'Vote supprimé',
-                'idea': IdeaSerializer(idea, context={'request': request}).data
+                'idea': self.get_serializer(idea).data
             })
-        except Vote.DoesNotExist:
+        return Response({
+            'error': 'Aucun vote trouvé'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    @action(
+        detail=False, methods=['get'], url_path='map', pagination_class=None,
+        renderer_classes=[*api_settings.DEFAULT_RENDERER_CLASSES, mapdata.MapBinaryRenderer],
+    )
+    def map_points(self, request):
+        """Idées d'une emprise en colonnes compactes (JSON, ou binaire avec ?format=bin)"""
+        try:
+            bbox = mapdata.parse_bbox(request.query_params.get('bbox'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        rows, truncated = mapdata.load_rows(bbox, request.query_params)
+        return Response(mapdata.build_columns(rows, truncated))
+
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def heatmap(self, request):
+        """Carte de chaleur des idées d'une emprise, pondérées par leurs votes"""
+        try:
+            bbox = mapdata.parse_bbox(request.query_params.get('bbox'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        max_resolution = heatmap.heatmap_setting('MAX_RESOLUTION')
+        max_smoothing = heatmap.heatmap_setting('MAX_SMOOTHING')
+        try:
+            resolution = int(request.query_params.get('resolution', heatmap.heatmap_setting('DEFAULT_RESOLUTION')))
+            smooth = float(request.query_params.get('smooth', 0))
+        except ValueError:
+            return Response({
+                'error': 'resolution doit être un entier et smooth un nombre'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= resolution <= max_resolution:
             return Response({
-                'error': 'Aucun vote trouvé'
-            }, status=status.HTTP_404_NOT_FOUND)
+                'error': f'resolution doit être comprise entre 1 et {max_resolution}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 <= smooth <= max_smoothing:
+            return Response({
+                'error': f'smooth doit être compris entre 0 et {max_smoothing}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response(heatmap.heatmap(bbox, resolution, smooth, request.query_params))
 
     @action(detail=False, methods=['get'])
     def near_me(self, request):
         """Récupère les idées proches de la position de l'utilisateur"""
         lat = request.query_params.get('lat')
         lng = request.query_params.get('lng')
-        radius = float(request.query_params.get('radius', 1.0))  # Rayon en km
         
         if not lat or not lng:
             return Response({
                 'error': 'Latitude et longitude requises'
             }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            lat, lng = float(lat), float(lng)
+            radius = float(request.query_params.get('radius', 1.0))  # Rayon en km
+        except ValueError:
+            return Response({
+                'error': 'Latitude, longitude et rayon doivent être des nombres'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Calcul simple de distance (approximation)
-        lat, lng = float(lat), float(lng)
-        lat_min, lat_max = lat - radius/111, lat + radius/111
-        lng_min, lng_max = lng - radius/(111 * abs(lat)), lng + radius/(111 * abs(lat))
-        
-        ideas = Idea.objects.filter(
-            latitude__range=(lat_min, lat_max),
-            longitude__range=(lng_min, lng_max)
-        )
+        # Carré englobant le rayon (approximation), filtré sur idea_position_idx
+        lat_range, lng_range = radius_box(lat, lng, radius)
+        ideas = self.with_relations(deletion.visible_ideas(Idea.objects.filter(
+            latitude__range=lat_range,
+            longitude__range=lng_range
+        ), self.hidden_subjects))
         
-        serializer = IdeaListSerializer(ideas, many=True)
+        serializer = IdeaListSerializer(ideas, many=True, context=vote_context(request, ideas))
         return Response(serializer.data)
 
-    @action(detail=True, methods=['get', 'post'])
+    @action(detail=True, methods=['get'], pagination_class=KeysetPagination)
+    @conditional('comment_validators')
+    def votes(self, request, pk=None):
+        """Votes d'une idée, paginés par curseur (du plus récent au plus ancien)"""
+        idea = self.get_object()
+        page = self.paginate_queryset(idea.votes.select_related('user'))
+        return self.get_paginated_response(VoteSerializer(page, many=True).data)
+
+    @action(
+        detail=True, methods=['get', 'post'], throttle_classes=[CommentRateThrottle],
+        pagination_class=KeysetPagination,
+    )
+    @idempotent
+    @conditional('comment_validators')
     def comments(self, request, pk=None):
         """Gère les commentaires d'une idée"""
         idea = self.get_object()
         
         if request.method == 'GET':
-            # Récupérer tous les commentaires de l'idée
-            comments = idea.comments.all().order_by('-created_at')
-            serializer = CommentSerializer(comments, many=True, context={'request': request})
-            return Response(serializer.data)
+            # Commentaires paginés par curseur, avec le décompte de leurs votes
+            comments = self.paginate_queryset(idea.comments.select_related('user'))
+            attach_comment_vote_stats(comments)
+            serializer = CommentSummarySerializer(
+                comments, many=True, context=vote_context(request, comments=comments)
+            )
+            return self.get_paginated_response(serializer.data)
         
         elif request.method == 'POST':
             # Créer un nouveau commentaire
@@ -247,7 +579,7 @@ class IdeaViewSet(viewsets.ModelViewSet):
             if serializer.is_valid():
                 comment = serializer.save()
                 return Response(
-                    CommentSerializer(comment, context={'request': request}).data,
+                    CommentSummarySerializer(comment, context=vote_context(request, comments=[comment])).data,
                     status=status.HTTP_201_CREATED
                 )
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -258,22 +590,32 @@ class VoteViewSet(viewsets.ModelViewSet):
     queryset = Vote.objects.all()
     serializer_class = VoteSerializer
     permission_classes = [permissions.IsAuthenticated]
-
-    """Filtre par votes de l'utilisateur connecté et filtre par idées"""
-    queryset = Vote.objects.all()
-    serializer_class = VoteSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    # Même seau que /api/ideas/{id}/vote/ (les lectures ne sont pas limitées)
+    throttle_classes = [VoteRateThrottle]
 
     def get_queryset(self):
+        """Filtre par votes de l'utilisateur connecté et filtre par idées"""
         queryset = Vote.objects.filter(user=self.request.user)
         idea_id = self.request.query_params.get('idea_id', None)
         if idea_id:
             queryset = queryset.filter(idea_id=idea_id)
         return queryset
-    
 
+    # Écritures par api/votes.py, comme /api/ideas/{id}/vote/ : compteurs ajustés par deltas
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        idea = serializer.validated_data['idea']
+        votes.cast(idea, self.request.user, serializer.validated_data['is_positive'])
+        serializer.instance = Vote.objects.get(idea=idea, user=self.request.user)
+
+    def perform_update(self, serializer):
+        vote = serializer.instance
+        if serializer.validated_data.get('idea', vote.idea) != vote.idea:
+            raise ValidationError({'idea': "L'idée d'un vote ne peut pas être modifiée."})
+        votes.cast(vote.idea, self.request.user, serializer.validated_data.get('is_positive', vote.is_positive))
+        vote.refresh_from_db()
+
+    def perform_destroy(self, instance):
+        votes.retract(instance.idea, self.request.user)
 
 
 class CommentViewSet(viewsets.ModelViewSet):
@@ -287,7 +629,46 @@ class CommentViewSet(viewsets.ModelViewSet):
         return CommentSerializer
 
     def get_queryset(self):
-        return Comment.objects.all().order_by('-created_at')
+        return deletion.visible_comments(Comment.objects.all()).order_by('-created_at')
+
+    def list_validators(self, request, *args, **kwargs):
+        # Suppressions et votes : updated_at des idées, ou ZoneStat si l'idée est supprimée
+        return [
+            latest(Comment.objects.all()), latest(Idea.objects.all()), latest(ZoneStat.objects.all()),
+            deletion.hidden_subjects(),
+        ]
+
+    def detail_validators(self, request, pk=None, **kwargs):
+        comments = Comment.objects.filter(pk=lookup_pk(pk))
+        return [latest(comments), latest(Idea.objects.filter(comments__in=comments))]
+
+    def paginated_count(self, queryset):
+        # Tous les commentaires : total maintenu dans ZoneStat (sauf idées masquées en attente de purge)
+        if any(deletion.hidden_subjects()):
+            return None
+        return ZoneStat.objects.aggregate(total=Sum('comment_count'))['total'] or 0
+
+    @conditional('list_validators')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional('detail_validators')
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def get_serializer(self, *args, **kwargs):
+        # my_vote : votes de la page lus en une fois (rien pour les anonymes)
+        if args and self.request.user.is_authenticated:
+            comments = list(args[0]) if kwargs.get('many') else [args[0]]
+            if kwargs.get('many'):
+                args = (comments,) + args[1:]
+            kwargs['context'] = {**self.get_serializer_context(), **vote_context(self.request, comments=comments)}
+        return super().get_serializer(*args, **kwargs)
+
+    def get_throttles(self):
+        if self.action == 'create':
+            return [CommentRateThrottle()]
+        return super().get_throttles()
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -304,51 +685,37 @@ class CommentViewSet(viewsets.ModelViewSet):
             raise permissions.PermissionDenied("Vous ne pouvez supprimer que vos propres commentaires.")
         instance.delete()
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], throttle_classes=[VoteRateThrottle])
     def vote(self, request, pk=None):
         """Vote sur un commentaire"""
         comment = self.get_object()
-        is_positive = request.data.get('is_positive', True)
-        
-        # Vérifier si l'utilisateur a déjà voté
-        existing_vote = CommentVote.objects.filter(comment=comment, user=request.user).first()
-        
-        if existing_vote:
-            # Modifier le vote existant
-            existing_vote.is_positive = is_positive
-            existing_vote.save()
-            message = "Vote modifié"
-        else:
-            # Créer un nouveau vote
-            CommentVote.objects.create(
-                comment=comment,
-                user=request.user,
-                is_positive=is_positive
-            )
-            message = "Vote ajouté"
+        is_positive = vote_direction(request)
+        if is_positive is None:
+            return Response({
+                'error': 'is_positive doit être un booléen'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        previous = votes.cast_comment_vote(comment, request.user, is_positive)
+        message = vote_message(previous, is_positive)
         
         return Response({
             'message': message,
-            'comment': CommentSerializer(comment, context={'request': request}).data
+            'comment': self.get_serializer(comment).data
         })
 
-    @action(detail=True, methods=['delete'])
+    @action(detail=True, methods=['delete'], throttle_classes=[VoteRateThrottle])
     def unvote(self, request, pk=None):
         """Supprime le vote de l'utilisateur sur un commentaire"""
         comment = self.get_object()
         
-        try:
-            vote = CommentVote.objects.get(comment=comment, user=request.user)
-            vote.delete()
-            
+        if votes.retract_comment_vote(comment, request.user):
             return Response({
                 'message': 'Vote supprimé',
-                'comment': CommentSerializer(comment, context={'request': request}).data
+                'comment': self.get_serializer(comment).data
             })
-        except CommentVote.DoesNotExist:
-            return Response({
-                'error': 'Aucun vote trouvé'
-            }, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'error': 'Aucun vote trouvé'
+        }, status=status.HTTP_404_NOT_FOUND)
 
 
 class CommentVoteViewSet(viewsets.ModelViewSet):
@@ -356,23 +723,185 @@ class CommentVoteViewSet(viewsets.ModelViewSet):
     queryset = CommentVote.objects.all()
     serializer_class = CommentVoteSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Même seau que /api/comments/{id}/vote/ (les lectures ne sont pas limitées)
+    throttle_classes = [VoteRateThrottle]
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
             return CommentVote.objects.filter(user=self.request.user)
         return CommentVote.objects.none()
 
+    # Écritures par api/votes.py, comme /api/comments/{id}/vote/
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        comment = serializer.validated_data['comment']
+        votes.cast_comment_vote(comment, self.request.user, serializer.validated_data['is_positive'])
+        serializer.instance = CommentVote.objects.get(comment=comment, user=self.request.user)
 
     def perform_update(self, serializer):
+        vote = serializer.instance
         # Seul l'utilisateur peut modifier son vote
-        if serializer.instance.user != self.request.user:
+        if vote.user != self.request.user:
             raise permissions.PermissionDenied("Vous ne pouvez modifier que vos propres votes.")
-        serializer.save()
+        if serializer.validated_data.get('comment', vote.comment) != vote.comment:
+            raise ValidationError({'comment': "Le commentaire d'un vote ne peut pas être modifié."})
+        votes.cast_comment_vote(
+            vote.comment, self.request.user, serializer.validated_data.get('is_positive', vote.is_positive)
+        )
+        vote.refresh_from_db()
 
     def perform_destroy(self, instance):
         # Seul l'utilisateur peut supprimer son vote
         if instance.user != self.request.user:
             raise permissions.PermissionDenied("Vous ne pouvez supprimer que vos propres votes.")
-        instance.delete()
+        votes.retract_comment_vote(instance.comment, self.request.user)
+
+
+class ActivityTimeseriesView(APIView):
+    """Séries temporelles de participation (lues depuis les tranches pré-agrégées)"""
+    permission_classes = [permissions.AllowAny]
+    INTERVALS = ('hour', 'day', 'week')
+
+    def _parse_moment(self, value):
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            moment = datetime.combine(day, time.min)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def get(self, request):
+        interval = request.query_params.get('interval', 'day')
+        if interval not in self.INTERVALS:
+            return Response({
+                'error': f"Intervalle invalide (valeurs possibles : {', '.join(self.INTERVALS)})"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            end = self._parse_moment(request.query_params['end']) if 'end' in request.query_params else timezone.now()
+            default_span = timedelta(days=1) if interval == 'hour' else timedelta(days=30)
+            start = self._parse_moment(request.query_params['start']) if 'start' in request.query_params else end - default_span
+        except ValueError:
+            return Response({
+                'error': 'Dates invalides (format AAAA-MM-JJ ou ISO 8601)'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if interval == 'hour':
+            # Les tranches horaires ne sont conservées que pour les derniers jours
+            start = max(start, activity.hourly_cutoff())
+        else:
+            start = activity.truncate(activity.DAY, start)
+
+        zone = request.query_params.get('zone')
+        category = request.query_params.get('category')
+        if zone is not None and not zone.isdigit():
+            return Response({'error': 'Zone invalide'}, status=status.HTTP_400_BAD_REQUEST)
+        if category is not None and category not in Idea.CATEGORIES.values:
+            return Response({'error': 'Catégorie invalide'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'interval': interval,
+            'start': start,
+            'end': end,
+            'results': activity.timeseries(
+                interval, start, end,
+                zone_id=int(zone) if zone is not None else None,
+                category=category,
+            ),
+        })
+
+
+class SyncView(APIView):
+    """Vue de synchronisation incrémentale (journal des modifications)"""
+    permission_classes = [permissions.AllowAny]
+
+    # Type d'entrée du journal -> (clé de réponse, requête, sérialiseur)
+    SOURCES = {
+        # Zones, idées et commentaires masqués (suppression en cours) : signalés comme supprimés
+        changelog.ZONE: ('zones', lambda user, hidden: Zone.objects.filter(deleted_at__isnull=True),
+                         ZoneSyncSerializer),
+        changelog.IDEA: ('ideas', lambda user, hidden: deletion.visible_ideas(
+            Idea.objects.select_related('author'), hidden), IdeaSyncSerializer),
+        changelog.COMMENT: ('comments', lambda user, hidden: deletion.visible_comments(
+            Comment.objects.select_related('user'), hidden), CommentSyncSerializer),
+        changelog.VOTE: ('votes', lambda user, hidden: Vote.objects.filter(user=user), VoteSyncSerializer),
+    }
+
+    def get(self, request):
+        since = request.query_params.get('since')
+        try:
+            position = changelog.parse_token(since) if since else 0
+        except changelog.InvalidToken:
+            return Response({
+                'error': 'Jeton de synchronisation invalide'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except changelog.ExpiredToken:
+            return Response({
+                'error': 'Jeton expiré : une synchronisation complète est nécessaire'
+            }, status=status.HTTP_410_GONE)
+
+        limit = request.query_params.get('limit', changelog.sync_setting('PAGE_SIZE'))
+        try:
+            limit = min(max(int(limit), 1), changelog.sync_setting('MAX_PAGE_SIZE'))
+        except (TypeError, ValueError):
+            return Response({'error': 'Paramètre limit invalide'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user if request.user.is_authenticated else None
+        entries = changelog.changes(position, user.id if user else None, limit)
+
+        data = {'token': changelog.make_token(entries[-1]['id'] if entries else position),
+                'has_more': len(entries) == limit}
+        deleted = {}
+        hidden = deletion.hidden_subjects() if entries else None
+        for kind, (key, queryset, serializer_class) in self.SOURCES.items():
+            updated_ids = [entry['object_id'] for entry in entries if entry['kind'] == kind and not entry['deleted']]
+            deleted_ids = [entry['object_id'] for entry in entries if entry['kind'] == kind and entry['deleted']]
+            objects = list(queryset(user, hidden).filter(pk__in=updated_ids)) if updated_ids else []
+            # Objet supprimé entre-temps : signalé comme tel
+            found = {obj.pk for obj in objects}
+            deleted_ids += [pk for pk in updated_ids if pk not in found]
+            data[key] = serializer_class(objects, many=True).data
+            deleted[key] = deleted_ids
+        data['deleted'] = deleted
+        return Response(data)
+
+
+class ModerationJobViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
+                           mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """ViewSet pour la modération groupée des idées, exécutée en tâche de fond (réservé au staff)"""
+    queryset = ModerationJob.objects.all()
+    serializer_class = ModerationJobSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def create(self, request, *args, **kwargs):
+        # Opération exécutée par run_worker : progression suivie sur /api/moderation/{id}/
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        serializer.instance = moderation.start(data['action'], data['params'], user=self.request.user)
+
+
+async def event_stream(request):
+    """Flux Server-Sent Events des votes et commentaires d'idées ou de zones"""
+    channels = []
+    for param, model in (('idea', Idea), ('zone', Zone)):
+        for value in request.GET.getlist(param):
+            if not value.isdigit():
+                return JsonResponse({'error': f'Identifiant invalide : {param}={value}'}, status=400)
+            if not await model.objects.filter(pk=value).aexists():
+                return JsonResponse({'error': f'{param} {value} introuvable'}, status=404)
+            channels.append(f'{param}:{int(value)}')
+    if not channels:
+        return JsonResponse({'error': 'Paramètre idea ou zone requis'}, status=400)
+
+    subscription = realtime.broker.subscribe(channels)
+    response = StreamingHttpResponse(realtime.event_stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Désactive la mise en tampon des reverse proxies (Nginx)
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
@@ -0,0 +1,215 @@
+"""Écriture des votes (idées et commentaires) en une instruction SQL.
+
+Un vote est enregistré par ``INSERT … ON CONFLICT DO UPDATE … RETURNING`` et
+retiré par ``DELETE … RETURNING`` : deux requêtes concurrentes du même
+utilisateur ne peuvent plus violer la contrainte d'unicité. La mise à jour
+n'a lieu que si le sens du vote change, ce qui donne l'état précédent :
+
+- une ligne renvoyée avec la date de création fournie : vote créé ;
+- une autre ligne renvoyée : vote inversé ;
+- aucune ligne : vote inchangé.
+
+Les compteurs de l'idée sont ajustés par deltas (``F``), sans recompter
+les votes. Ces écritures ne passant pas par ``Model.save``/``delete``, les
+signaux ne sont pas déclenchés : ``ZoneStat``, les tranches d'activité, le
+journal de synchronisation, le temps réel, les cartes de chaleur et la
+version des fragments sérialisés (``updated_at``) sont mis à jour ici.
+"""
+from django.db import connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import activity, changelog, heatmap, realtime, stats
+from .models import Comment, CommentVote, Idea, Vote
+from .ranking import compute_scores
+
+
+def _table(model, parent):
+    quote = connection.ops.quote_name
+    return quote(model._meta.db_table), quote(model._meta.get_field(parent).column)
+
+
+def _upsert(model, parent, parent_id, user_id, is_positive, now):
+    """Vote enregistré et son sens précédent (None si créé) ; (None, is_positive) si inchangé"""
+    table, column = _table(model, parent)
+    sql = (
+        f'INSERT INTO {table} ({column}, user_id, is_positive, created_at) VALUES (%s, %s, %s, %s) '
+        f'ON CONFLICT ({column}, user_id) DO UPDATE SET is_positive = excluded.is_positive '
+        f'WHERE {table}.is_positive <> excluded.is_positive '
+        f'RETURNING id, created_at'
+    )
+    params = [parent_id, user_id, is_positive, connection.ops.adapt_datetimefield_value(now)]
+    rows = list(model.objects.raw(sql, params))
+    if not rows:
+        return None, is_positive
+    vote = rows[0]
+    return vote, (None if vote.created_at == now else not is_positive)
+
+
+def _delete(model, parent, parent_id, user_id):
+    """Vote supprimé (None s'il n'existait pas)"""
+    table, column = _table(model, parent)
+    sql = f'DELETE FROM {table} WHERE {column} = %s AND user_id = %s RETURNING id, is_positive, created_at'
+    rows = list(model.objects.raw(sql, [parent_id, user_id]))
+    return rows[0] if rows else None
+
+
+def _apply_idea_delta(idea, positive, negative):
+    """Ajoute des deltas aux compteurs de votes de l'idée et recalcule ses scores"""
+    ideas = Idea.objects.filter(pk=idea.pk)
+    ideas.update(
+        vote_count=F('vote_count') + positive + negative,
+        positive_votes=F('positive_votes') + positive,
+        negative_votes=F('negative_votes') + negative,
+    )
+    # Ligne verrouillée par la mise à jour jusqu'à la fin de la transaction
+    values = ideas.values(
+        'vote_count', 'positive_votes', 'negative_votes', 'created_at', 'zone_id', 'category', 'status'
+    ).get()
+    scores = compute_scores(values['positive_votes'], values['negative_votes'], values['created_at'])
+    ideas.update(**scores, updated_at=timezone.now())
+    for field in ('vote_count', 'positive_votes', 'negative_votes', 'zone_id', 'category', 'status'):
+        setattr(idea, field, values[field])
+    for field, value in scores.items():
+        setattr(idea, field, value)
+    stats.apply_delta(
+        values['zone_id'], values['category'], values['status'],
+        positive_votes=positive, negative_votes=negative,
+    )
+    changelog.record(changelog.IDEA, idea.pk)
+    realtime.notify_counts(idea.pk)
+    transaction.on_commit(heatmap.invalidate)
+
+
+def _direction(is_positive):
+    # Deltas (positifs, négatifs) d'un vote dans un sens donné
+    return (1, 0) if is_positive else (0, 1)
+
+
+def cast(idea, user, is_positive):
+    """Vote sur une idée ; retourne le sens précédent (None si le vote est nouveau)"""
+    now = timezone.now()
+    with transaction.atomic():
+        vote, previous = _upsert(Vote, 'idea', idea.pk, user.pk, is_positive, now)
+        if vote is None:
+            return previous
+        if previous is None:
+            positive, negative = _direction(is_positive)
+        else:
+            # Vote inversé : passe d'un compteur à l'autre
+            positive, negative = (1, -1) if is_positive else (-1, 1)
+        _apply_idea_delta(idea, positive, negative)
+        changelog.record(changelog.VOTE, vote.pk, idea_id=idea.pk, user_id=user.pk)
+        if previous is None:
+            activity.record(idea.zone_id, idea.category, now, votes=1)
+    return previous
+
+
+def retract(idea, user):
+    """Retire le vote d'un utilisateur sur une idée ; retourne False s'il n'existait pas"""
+    with transaction.atomic():
+        vote = _delete(Vote, 'idea', idea.pk, user.pk)
+        if vote is None:
+            return False
+        positive, negative = _direction(vote.is_positive)
+        _apply_idea_delta(idea, -positive, -negative)
+        changelog.record(changelog.VOTE, vote.pk, deleted=True, idea_id=idea.pk, user_id=user.pk)
+        activity.record(idea.zone_id, idea.category, vote.created_at, votes=-1)
+    return True
+
+
+def _comment_key(comment):
+    return Comment.objects.filter(pk=comment.pk).values_list('idea__zone_id', 'idea__category').first()
+
+
+def _touch_idea(comment):
+    # Les votes de commentaires font partie de la représentation de l'idée (api/fragments.py)
+    Idea.objects.filter(comments=comment.pk).update(updated_at=timezone.now())
+
+
+def cast_comment_vote(comment, user, is_positive):
+    """Vote sur un commentaire ; retourne le sens précédent (None si le vote est nouveau)"""
+    now = timezone.now()
+    with transaction.atomic():
+        vote, previous = _upsert(CommentVote, 'comment', comment.pk, user.pk, is_positive, now)
+        if vote is not None:
+            _touch_idea(comment)
+        if vote is not None and previous is None:
+            key = _comment_key(comment)
+            if key:
+                activity.record(*key, now, comment_votes=1)
+    return previous
+
+
+def retract_comment_vote(comment, user):
+    """Retire le vote d'un utilisateur sur un commentaire ; retourne False s'il n'existait pas"""
+    with transaction.atomic():
+        vote = _delete(CommentVote, 'comment', comment.pk, user.pk)
+        if vote is None:
+            return False
+        _touch_idea(comment)
+        key = _comment_key(comment)
+        if key:
+            activity.record(*key, vote.created_at, comment_votes=-1)
+    return True
+
+
+# Champs d'idée réécrits par ``recount``
+RECOUNT_FIELDS = ['vote_count', 'positive_votes', 'negative_votes', 'hot_score', 'wilson_score',
+                  'controversy_score', 'updated_at']
+
+
+def recount(ideas):
+    """Réécrit, depuis la table des votes, les compteurs (et scores) des idées de ``ideas`` qui divergent.
+
+    Une requête groupée pour tout le lot ; retourne les zones des idées corrigées.
+    """
+    rows = list(ideas.values_list('pk', 'zone_id', 'vote_count', 'positive_votes', 'negative_votes', 'created_at'))
+    counts = {}
+    actual = (
+        Vote.objects.filter(idea_id__in=[row[0] for row in rows])
+        .values_list('idea_id', 'is_positive').annotate(n=Count('id')).order_by()
+    )
+    for idea_id, is_positive, n in actual:
+        counts[idea_id, is_positive] = n
+    now = timezone.now()
+    fixed = []
+    zone_ids = []
+    for pk, zone_id, total, positive, negative, created_at in rows:
+        up, down = counts.get((pk, True), 0), counts.get((pk, False), 0)
+        if (total, positive, negative) == (up + down, up, down):
+            continue
+        fixed.append(Idea(
+            pk=pk, vote_count=up + down, positive_votes=up, negative_votes=down,
+            updated_at=now, **compute_scores(up, down, created_at, now),
+        ))
+        zone_ids.append(zone_id)
+    if fixed:
+        Idea.objects.bulk_update(fixed, RECOUNT_FIELDS)
+        changelog.record_many(changelog.IDEA, [idea.pk for idea in fixed])
+    return zone_ids
+
+
+def reconcile(batch_size=500):
+    """Corrige les compteurs de votes des idées qui divergent de la table des votes.
+
+    Les idées sont parcourues par lots de clés primaires ; seules les idées
+    incohérentes sont réécrites (scores compris), puis ``ZoneStat`` est
+    reconstruit pour leurs zones. Retourne le nombre d'idées corrigées.
+    """
+    zone_ids = set()
+    fixed = 0
+    last_pk = 0
+    while True:
+        batch = list(Idea.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1]
+        with transaction.atomic():
+            zones = recount(Idea.objects.filter(pk__in=batch))
+        zone_ids.update(zones)
+        fixed += len(zones)
+    if zone_ids:
+        stats.rebuild(sorted(zone_ids))
+        heatmap.invalidate()
+    return fixed
@@ -80,6 +80,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Base de test sur disque : les tests de concurrence (api/tests.py) l'ouvrent depuis plusieurs threads
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -131,15 +133,68 @@ AUTH_USER_MODEL = 'api.User'
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.RevocableJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Sans COUNT(*) à chaque page ; ?count=false supprime le total (api/pagination.py)
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.CountlessPageNumberPagination',
     'PAGE_SIZE': 20,
+    # Seaux à jetons (api/throttling.py) : capacité / période de recharge.
+    # Une écriture en base par requête limitée (voir README_DEV, « Limitation de débit »)
+    'DEFAULT_THROTTLE_RATES': {
+        'login': '10/min',
+        'vote': '30/min',
+        'comment': '10/min',
+    },
+}
+
+# Authentification : hachage des mots de passe dans un pool borné (api/hashing.py)
+AUTHENTICATION_BACKENDS = [
+    'api.backends.BoundedHashingBackend',
+]
+
+PASSWORD_HASHING = {
+    'MAX_WORKERS': 2,       # Hachages simultanés au maximum
+    'MAX_PENDING': 8,       # Hachages en attente au-delà desquels la requête est refusée aussitôt (503)
+    'RETRY_AFTER': 1,       # Secondes indiquées dans l'en-tête Retry-After du refus
+}
+
+# Cache
+# Le cache "idempotency" doit être partagé entre les processus (Redis ou Memcached
+# en production) ; avec DatabaseCache, sa table est créée par createcachetable,
+# sans laquelle les requêtes avec Idempotency-Key échouent.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Réponses rejouables des requêtes POST avec Idempotency-Key (api/idempotency.py)
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_idempotency_cache',
+        'TIMEOUT': 24 * 3600,           # Fenêtre de rejeu (secondes)
+        'OPTIONS': {
+            'MAX_ENTRIES': 50_000,      # Au-delà, expirées puis une partie des entrées sont évincées
+        },
+    },
+    # Version des scores de classement, partagée par le worker et les serveurs (api/ranking.py)
+    'ranking': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_ranking_cache',
+        'TIMEOUT': None,
+    },
+    # Représentations sérialisées des idées et zones listées (api/fragments.py)
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'TIMEOUT': 3600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20_000,
+        },
+    },
 }
 
 # JWT settings
@@ -166,8 +221,86 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 
     'JTI_CLAIM': 'jti',
+
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.RevocableTokenRefreshSerializer',
+}
+
+# Révocation des jetons (voir api/revocation.py)
+TOKEN_REVOCATION = {
+    'FILTER_CAPACITY': 100_000,    # Nombre de JTI avant reconstruction du filtre
+    'FILTER_ERROR_RATE': 0.001,    # Taux de faux positifs (confirmés en base)
+    'REFRESH_INTERVAL': 5.0,       # Secondes entre deux synchronisations avec la base
 }
 
 # CORS settings
+from corsheaders.defaults import default_headers
 CORS_ALLOW_ALL_ORIGINS = True  # Pour le développement seulement
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'if-none-match', 'if-modified-since')
+# Validateurs des requêtes conditionnelles (api/conditional.py)
+CORS_EXPOSE_HEADERS = ['etag', 'last-modified']
+
+# Séries temporelles d'activité : durée de conservation des tranches horaires
+ACTIVITY_HOURLY_RETENTION_DAYS = 2
+
+# Index spatial des zones : durée de vie maximale dans chaque processus (secondes)
+ZONE_INDEX_TTL = 300
+
+# Coordonnées renvoyées par l'API : nombre de décimales (6 ≈ 0,1 m)
+COORDINATE_PRECISION = 6
+
+# Carte des idées en colonnes (api/mapdata.py)
+MAP = {
+    'PRECISION': 5,         # Décimales des coordonnées quantifiées (≈ 1 m)
+    'MAX_POINTS': 200_000,  # Idées par réponse ; au-delà, les plus votées
+}
+
+# Cartes de chaleur (api/heatmap.py)
+HEATMAP = {
+    'DEFAULT_RESOLUTION': 64,
+    'MAX_RESOLUTION': 256,
+    'MAX_SMOOTHING': 5,     # Écart type maximal du lissage gaussien (cellules)
+    'CACHE_TIMEOUT': 300,   # Secondes ; les écritures périment aussi le cache
+}
+
+# Détection des doublons : rayon de recherche (km) et similarité minimale (Jaccard)
+IDEA_DUPLICATE_RADIUS_KM = 1.0
+IDEA_DUPLICATE_THRESHOLD = 0.5
+
+# Pagination des grandes tables : durée de mise en cache du nombre total (secondes)
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
+
+# Flux temps réel (api/realtime.py)
+REALTIME = {
+    'COALESCE_INTERVAL': 0.25,
+    'KEEPALIVE_INTERVAL': 15,
+    'QUEUE_SIZE': 100,
+}
+
+# Synchronisation incrémentale (api/changelog.py)
+SYNC = {
+    'TOMBSTONE_RETENTION_DAYS': 30,
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+}
+
+# File de tâches de fond en base (api/jobs.py, commande run_worker)
+JOBS = {
+    'PROCESSES': 2,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BASE_DELAY': 10,     # Secondes avant la 2e tentative, doublées ensuite
+    'RETRY_MAX_DELAY': 3600,
+    'HEARTBEAT_INTERVAL': 30,   # Secondes entre deux signes de vie d'une tâche en cours
+    'STALE_AFTER': 300,         # Secondes sans signe de vie avant de reprendre une tâche abandonnée
+    'RETENTION_DAYS': 7,
+    'PERIODIC': {
+        'refresh_idea_scores': {'every': 3600, 'params': {'max_age_days': 30}},
+        'reconcile_vote_counts': {'every': 86400},
+        'rebuild_activity': {'every': 86400, 'params': {'prune_only': True}},
+        'prune_change_log': {'every': 86400},
+        'purge_revoked_tokens': {'every': 86400},
+        'prune_throttle_buckets': {'every': 3600},
+        'prune_jobs': {'every': 86400},
+    },
+}